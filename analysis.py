@@ -2,8 +2,14 @@ from parser import parse
 from classes import Function, BasicBlock
 from util import *
 
+# すべてのコンパイルでデバッグ出力を行うかどうか
+# 個別のコンパイルではProgram.verboseで指定する。
 _verbose = False
 
+# 関数fのコンパイルでデバッグ出力を行うかどうか
+def is_verbose(f):
+    return _verbose or (f.program is not None and f.program.verbose)
+
 # 基本ブロックへの分割
 def divide_into_blocks(f):
     # 最初の命令が[None, 'deflabel', LABEL]であることを前提とする。
@@ -15,17 +21,17 @@ def divide_into_blocks(f):
     cur_label = f.entry
 
     # 基本ブロックに分割し、ブロックへの命令の登録と後続ブロックの設定を行う。
-    for cur_inst in f.insts[1:] + [[None, 'deflabel', ['label', f.end]]]:
-        if op(cur_inst) == 'deflabel':
+    for cur_inst in f.insts[1:] + [make_inst(None, Op.DEFLABEL, make_label(f.end))]:
+        if op(cur_inst) == Op.DEFLABEL:
             prev_bb = cur_label
             cur_label = label_name(right(cur_inst, 1))
             f.bbtable[cur_label] = BasicBlock(cur_label)
-            if op(prev_inst) == 'goto':  # [None, 'goto', LABEL]
+            if op(prev_inst) == Op.GOTO:  # [None, 'goto', LABEL]
                 f.bbtable[prev_bb].succ.append(label_name(right(prev_inst, 1)))
-            elif op(prev_inst) == 'if':  # [None, 'if', ID, LABEL, LABEL]
+            elif op(prev_inst) == Op.IF:  # [None, 'if', ID, LABEL, LABEL]
                 f.bbtable[prev_bb].succ.append(label_name(right(prev_inst, 2)))
                 f.bbtable[prev_bb].succ.append(label_name(right(prev_inst, 3)))
-            elif op(prev_inst) == 'return':
+            elif op(prev_inst) == Op.RETURN:
                 f.bbtable[prev_bb].succ.append(f.end)
             else:
                 f.bbtable[prev_bb].succ.append(cur_label)
@@ -40,16 +46,17 @@ def divide_into_blocks(f):
         if label == f.end:
             continue
         last_inst = f.bbtable[label].insts[-1]
-        if op(last_inst) == 'return':
+        if op(last_inst) == Op.RETURN:
             # return文の置き換えを行う。
             # [None, 'return', ID]
             # -> ['retval', '=', ID] [None, 'goto', '__end']
-            f.bbtable[label].insts[-1:] = [[['id', '.retval'], '=', right(last_inst, 1)],
-                                           [None, 'goto', ['label', '__end']]]
-        elif op(last_inst) not in ('goto', 'if', 'return'):
+            f.bbtable[label].insts[-1:] = [
+                make_inst(make_id('.retval'), Op.COPY, right(last_inst, 1)),
+                make_inst(None, Op.GOTO, make_label(f.end))]
+        elif op(last_inst) not in (Op.GOTO, Op.IF, Op.RETURN):
             # 末尾が分岐系命令でなければ後続ブロックへのgoto命令を挿入する。
             f.bbtable[label].insts.append(
-                [None, 'goto', ['label', f.bbtable[label].succ[0]]])
+                make_inst(None, Op.GOTO, make_label(f.bbtable[label].succ[0])))
 
     # 関数は必ず出口ブロックで終了するものとする。
     # したがって関数中のすべてのreturn文は出口ブロックに一度分岐する。
@@ -57,19 +64,23 @@ def divide_into_blocks(f):
     f.symtable.add_sym(f.end, 'label')
     f.symtable.add_sym('.retval', 'localvar', {'type': f.ftype, 'bb': f.end })
     f.bbtable[f.entry].insts.insert(
-        1, [['id', '.retval'], 'deflocal', ['type', f.ftype]])
+        1, make_inst(make_id('.retval'), Op.DEFLOCAL, make_type(f.ftype)))
     f.bbtable['__end'] = BasicBlock(f.end)
     f.bbtable[f.end].insts.extend(
-        [[None, 'deflabel', ['label', f.end]],
-         [None, 'return', ['id', '.retval']]])
+        [make_inst(None, Op.DEFLABEL, make_label(f.end)),
+         make_inst(None, Op.RETURN, make_id('.retval'))])
 
     # 関数入口からたどることのできる基本ブロックを列挙する。
+    # 基本ブロックの多い関数でも再帰の深さの制限にかからないよう、
+    # 明示的なスタックを使ってたどる。
     def find_connected_block(bb, result):
-        if bb in result:
-            return
-        result.add(bb)
-        for succ in f.bbtable[bb].succ:
-            find_connected_block(succ, result)
+        work = [bb]
+        while work:
+            bb = work.pop()
+            if bb in result:
+                continue
+            result.add(bb)
+            work.extend(f.bbtable[bb].succ)
 
     # 不要になった基本ブロックは削除する。
     all_bbs = set([bb for bb in f.bbtable.keys()])
@@ -84,7 +95,7 @@ def divide_into_blocks(f):
         for s in f.bbtable[bbname].succ:
             f.bbtable[s].pred.append(bbname)
 
-    if _verbose:
+    if is_verbose(f):
         print('*** Basic Blocks start ***')
         for bb in f.bbtable.values():
             print('{} (pred={}) (succ={})'.format(bb.name, bb.pred, bb.succ))
@@ -92,67 +103,80 @@ def divide_into_blocks(f):
                 print('  {}'.format(i))
         print('*** Basic Blocks end ***')
     
-# 基本ブロックの支配集合DOMを計算する。
-# DOM(B): Bが支配するブロックの集合
+# 入口ブロックから深さ優先でたどったときの帰りがけ順の逆順
+# (reverse postorder)に基本ブロック名を並べたリストを返す。
+def reverse_postorder(f):
+    order = []
+    visited = {f.entry}
+    stack = [(f.entry, iter(f.bbtable[f.entry].succ))]
+    while stack:
+        bbname, succs = stack[-1]
+        for succ in succs:
+            if succ not in visited:
+                visited.add(succ)
+                stack.append((succ, iter(f.bbtable[succ].succ)))
+                break
+        else:
+            stack.pop()
+            order.append(bbname)
+    order.reverse()
+    return order
+
+# 基本ブロックの直接支配IDOMを計算する。
+# Cooper, Harvey, Kennedyの"A Simple, Fast Dominance Algorithm"による。
+# 基本ブロックにreverse postorderで番号をつけ、先行ブロックの直接支配を
+# 支配木上で交わるまでたどる処理を、変化がなくなるまで繰り返す。
+# 支配集合DOM(B)(Bを支配するブロックの集合)は、f.domが参照されたときに
+# 直接支配の関係から求める(Function.dom)。
 def calc_dom(f):
-    # 初期としてすべてのブロックをDOM集合に入れる。
-    # ただしエントリブロックはエントリブロックのみ支配するものとする。
-    for bbname in f.bbtable.keys():
-        f.dom[bbname] = set(f.bbtable.keys())
-    f.dom[f.entry] = set([f.entry])
+    order = reverse_postorder(f)
+    number = {bbname: n for n, bbname in enumerate(order)}
+    preds = [[number[p] for p in f.bbtable[bbname].pred if p in number]
+             for bbname in order]
+    idom = [None] * len(order)
+    idom[0] = 0
+
+    # 支配木上で2つのブロックの共通の祖先を求める。
+    def intersect(b1, b2):
+        while b1 != b2:
+            while b1 > b2:
+                b1 = idom[b1]
+            while b2 > b1:
+                b2 = idom[b2]
+        return b1
 
-    # DOM集合の状態が変わらなくなるまで繰り返す。
-    while True:
+    changed = True
+    while changed:
         changed = False
-        for this_bb in f.bbtable.keys():
-            prev_len = len(f.dom[this_bb])
-            for pred in f.bbtable[this_bb].pred:
-                f.dom[this_bb] &= f.dom[pred]
-            f.dom[this_bb] |= set([this_bb])
-            if len(f.dom[this_bb]) != prev_len:
+        for b in range(1, len(order)):
+            new_idom = None
+            for p in preds[b]:
+                if idom[p] is not None:
+                    new_idom = p if new_idom is None else intersect(p, new_idom)
+            if idom[b] != new_idom:
+                idom[b] = new_idom
                 changed = True
-        if not changed:
-            break
 
-    if _verbose:
+    # 入口ブロックの直接支配はNoneとする。
+    f.idom = {}
+    for bbname in f.bbtable.keys():
+        n = number[bbname]
+        f.idom[bbname] = order[idom[n]] if n != 0 else None
+    f.dom = None
+
+    if is_verbose(f):
         print('*** DOM start  ***')
         for k, v in f.dom.items():
             print(k, v)
         print('*** DOM end  ***')
 
-# 直接支配IDOMの関係と支配木treeを計算する。
+# 直接支配IDOMの関係から支配木treeを作成する。
 def calc_idom(f):
-    candidate = {}
-    for x in f.dom:
-        candidate[x] = f.dom[x] - set([x])
-
-    processed = [f.entry]
-    while True:
-        ascendant = None
-        for k, v in candidate.items():
-            if k not in processed and len(v) == 1:
-                processed.append(k)
-                ascendant = v
-                break
-        if ascendant is not None:
-            for k, v in candidate.items():
-                if len(v) > 1:
-                    v -= ascendant
-        else:
-            break
-    f.idom = {}
-    for k, v in candidate.items():
-        if len(v) == 1:
-            f.idom[k] = v.pop()
-        else:
-            f.idom[k] = None
-
-    # 直接支配の関係から支配木を作成する。
     f.tree = {bbname:[] for bbname in f.idom.values()}
     for k, v in f.idom.items():
         f.tree[v].append(k)
 
-    if _verbose:
+    if is_verbose(f):
         print('*** IDOM start  ***')
         for k, v in f.idom.items():
             print(k, v)
@@ -163,41 +187,26 @@ def calc_idom(f):
         print('*** TREE end  ***')
 
 # 支配辺境を計算する。
+# 合流点(先行ブロックが2個以上のブロック)Bの各先行ブロックから、Bの直接支配
+# ブロックに達するまで支配木をさかのぼり、途中のブロックの支配辺境にBを加える
+# (Cooper, Harvey, Kennedyの"A Simple, Fast Dominance Algorithm"による)。
+# 支配辺境はブロック名の集合とする。
 def calc_df(f):
-    # 深さ優先で訪れるリーフノードのリストを作成する。
-    def get_traverse_order(tree, current, order):
-        if current not in tree:
-            order.append(current)
-            return
-        else:
-            for child in tree[current]:
-                get_traverse_order(tree, child, order)
-            order.append(current)
-            return
+    f.df = {bbname: set() for bbname in f.bbtable.keys()}
+    for bbname, bb in f.bbtable.items():
+        if len(bb.pred) < 2:
+            continue
+        for pred in bb.pred:
+            runner = pred
+            while runner != f.idom[bbname]:
+                f.df[runner].add(bbname)
+                runner = f.idom[runner]
 
-    f.df = {}
-    order = []
-    get_traverse_order(f.tree, f.entry, order)
-
-    for x in order:
-        f.df[x] = []
-        for y in f.bbtable[x].succ:
-            if f.idom[y] != x:
-                f.df[x].append(y)
-        child = []
-        for t in f.bbtable.keys():
-            if f.idom[t] == x:
-                child.append(t)
-        for z in child:
-            for y in f.df[z]:
-                if f.idom[y] != x:
-                    f.df[x].append(y)
-
-    if _verbose:
+    if is_verbose(f):
         print('*** DF start  ***')
         for k, v in f.df.items():
             print(k, v)
-            print('*** DF end  ***')
+        print('*** DF end  ***')
 
 # 変数の定義が指定した基本ブロックにあるか確かめる。
 def exists_def(f, bb, var):
@@ -206,21 +215,78 @@ def exists_def(f, bb, var):
             return True
     return False
 
+# φ関数を挿入する対象の変数(局所変数と関数引数)の一覧を返す。
+def phi_candidates(f):
+    return list(f.symtable.sym_enumerator(kind=('localvar', 'param')))
+
+# 基本ブロックの入口と出口で生きている変数を求める(生存変数解析)。
+# 対象はφ関数を挿入する変数(局所変数と関数引数)とする。
+# 結果はブロック名から変数名の集合への辞書f.live_in、f.live_outに設定する。
+def calc_liveness(f):
+    variables = set(phi_candidates(f))
+    # ブロック内で定義より前に参照される変数(uevar)と、定義される変数(kill)
+    uevar = {}
+    kill = {}
+    for bbname, bb in f.bbtable.items():
+        used = set()
+        defined = set()
+        for i in bb.insts:
+            for term in i.args:
+                if (term.kind == TERM_ID and term.val in variables
+                    and term.val not in defined):
+                    used.add(term.val)
+            if i.left is not None and i.left.kind == TERM_ID and i.left.val in variables:
+                defined.add(i.left.val)
+        uevar[bbname] = used
+        kill[bbname] = defined
+
+    # 後続ブロックから先に処理すると早く収束するので、
+    # reverse postorderの逆順に変化がなくなるまで繰り返す。
+    order = reverse_postorder(f)
+    order.reverse()
+    f.live_in = {bbname: set(uevar[bbname]) for bbname in f.bbtable.keys()}
+    f.live_out = {bbname: set() for bbname in f.bbtable.keys()}
+    changed = True
+    while changed:
+        changed = False
+        for bbname in order:
+            out = set()
+            for succ in f.bbtable[bbname].succ:
+                out |= f.live_in[succ]
+            if out != f.live_out[bbname]:
+                f.live_out[bbname] = out
+                f.live_in[bbname] = uevar[bbname] | (out - kill[bbname])
+                changed = True
+
+    if is_verbose(f):
+        print('*** LIVE start ***')
+        for bbname in f.bbtable.keys():
+            print('{} in={} out={}'.format(bbname, sorted(f.live_in[bbname]),
+                                           sorted(f.live_out[bbname])))
+        print('*** LIVE end ***')
+
 # φ関数を挿入する。
-def insert_phi_functions(f):
+# prunedがTrueの場合は、ブロックの入口で生きている変数に対してだけφ関数を
+# 挿入する(pruned SSA)。生存変数解析の結果(f.live_in)がなければ計算する。
+def insert_phi_functions(f, pruned=True):
     # 局所変数の定義命令を、0への定数コピー文に置換する。
     insts = f.bbtable[f.entry].insts
     for i in range(len(insts)):
-        if (op(insts[i]) == 'deflocal'
+        if (op(insts[i]) == Op.DEFLOCAL
             and not exists_def(f, f.entry, tval(right(insts[i], 1)))):
-            insts[i] = [['id', tval(left(insts[i]))], '=', ['num', '0']]
-
-    # 局所変数('localvar')と関数引数('param')が定義される基本ブロックを列挙する。
-    # 現在の仕様ではlocalvarとparamはエントリブロックにしかないはず。
-    defbb = {}
-    for var in f.symtable.sym_enumerator(kind=('localvar', 'param')):
-        defbb[var] = [b for b, battr in f.bbtable.items() for i in battr.insts
-                      if is_id(left(i)) and tval(left(i)) == var]
+            insts[i] = make_inst(left(insts[i]), Op.COPY, make_num(0))
+
+    # 局所変数('localvar')と関数引数('param')が定義される基本ブロックを、
+    # すべての命令を一度だけ走査して列挙する。
+    defbb = {var: [] for var in phi_candidates(f)}
+    for b, battr in f.bbtable.items():
+        for i in battr.insts:
+            if is_id(left(i)):
+                blocks = defbb.get(tval(left(i)))
+                if blocks is not None and (not blocks or blocks[-1] != b):
+                    blocks.append(b)
+    if pruned and not f.live_in:
+        calc_liveness(f)
     inserted = {x:None for x in f.bbtable.keys()}
     work = {x:None for x in f.bbtable.keys()}
     w = []
@@ -231,19 +297,19 @@ def insert_phi_functions(f):
         while w != []:
             x = w.pop()  # 任意の基本ブロックを一つ取り出す。
             for y in f.df[x]:
-                if inserted[y] != v:
+                if inserted[y] != v and (not pruned or v in f.live_in[y]):
                     # 変数xに対するファイ関数がまだ基本ブロックyに挿入されて
                     # いなければ先頭に挿入する。
-                    ids = []
-                    for k in range(len(f.bbtable[y].pred)):
-                        ids.append(['id', v])
-                    f.bbtable[y].insts.insert(1, [['id', v], 'phi', *ids])
+                    var = make_id(v)
+                    ids = [var] * len(f.bbtable[y].pred)
+                    f.bbtable[y].insts.insert(1, Inst(var, Op.PHI, ids))
                     inserted[y] = v
-                    if work[y] == v:
+                    # φ関数も変数の定義なので、yの支配辺境も調べる。
+                    if work[y] != v:
                         w.append(y)
                         work[y] = v
 
-    if _verbose:
+    if is_verbose(f):
         print('*** insert Phi start ***')
         for bb in f.bbtable.values():
             print('{} (pred={}) (succ={})'.format(bb.name, bb.pred, bb.succ))
@@ -251,64 +317,78 @@ def insert_phi_functions(f):
                 print('  {}'.format(i))
         print('*** insert Phi end ***')
 
-# 置き換えられる変数名を探して実際に置き換える。
-def search(f, stack, counter, bbname):
+# 基本ブロック内の変数を新しい番号の変数に置き換える。
+# 置き換えで新たに定義した変数の元の変数名のリストを返す。
+def rename_block(f, stack, counter, prefix, bbname):
+    pushed = []
     # 基本ブロック内の文を先頭から変数の置き換えを実施する。
     for i in f.bbtable[bbname].insts:
         # 右辺がファイ関数呼び出しでない場合、右辺の各変数VをViに置き換える。
-        if op(i) != 'phi':
-            for pos in range(len(right(i))):
-                term = right(i, 1+pos)
-                if is_id(term) and tval(term) in stack:
-                    set_tval(term, '{}.{}'
-                             .format(tval(term), stack[tval(term)][-1]))
+        if i.op != Op.PHI:
+            args = i.args
+            for pos in range(len(args)):
+                term = args[pos]
+                if term.kind == TERM_ID and term.val in stack:
+                    args[pos] = stack[term.val][-1]
         # 左辺には変数名が2個以上となることはないことを前提として、
         # 左辺の変数を新しい番号の変数に置き換える。
-        # if stmt[0] in stack:
-        if is_id(left(i)):
-            lterm = left(i)
-            old_name = lterm[1]
-            new_name = '{}.{}'.format(lterm[1], counter[old_name])
+        lterm = i.left
+        if lterm is not None and lterm.kind == TERM_ID:
+            old_name = lterm.val
+            new_name = prefix[old_name] + str(counter[old_name])
             f.symtable.add_sym(new_name, 'ssavar',
-                             {'type': f.symtable.get_sym(old_name, 'type'),
+                             {'type': f.symtable.get_type(old_name),
                               'bb': bbname,
                               'origin': old_name})
-            stack[old_name].append(counter[old_name])
+            # 新しい変数の項を、以降の参照箇所で共有する。
+            i.left = make_id(new_name)
+            stack[old_name].append(i.left)
             counter[old_name] += 1
-            lterm[1] = new_name
+            pushed.append(old_name)
 
     # 後続ブロックに対して変数名の置き換えを実施する。
     for succ in f.bbtable[bbname].succ:
         # 後続ブロックからみて現在のブロックが何番目かを調べ、
         # φ関数中の同じ位置の引数の変数名を置き換える。
+        # φ関数はブロック先頭のラベル定義の直後にまとめて置かれている。
         pos = f.bbtable[succ].pred.index(bbname)
-        for i in f.bbtable[succ].insts:
-            if op(i) == 'phi':
-                term = right(i, pos+1)
-                set_tval(term, '{}.{}'
-                         .format(tval(right(i, pos+1)),
-                                 stack[tval(right(i, pos+1))][-1]))
-
-    # 支配木上での子ブロックに対して再帰的に変数名の置き換えを実施する。
-    if bbname in f.tree:
-        for child in f.tree[bbname]:
-            search(f, stack, counter, child)
-
-    # 元の左辺の変数に対するスタックを1つ戻す。
-    ssavars = [k for k in f.symtable.sym_enumerator(kind='ssavar')]
-    for i in f.bbtable[bbname].insts:
-        if is_id(left(i)) and id_name(left(i)) in ssavars:
-            stack[f.symtable.get_sym(id_name(left(i)), 'origin')].pop()
+        insts = f.bbtable[succ].insts
+        for n in range(1, len(insts)):
+            i = insts[n]
+            if i.op != Op.PHI:
+                break
+            i.args[pos] = stack[i.args[pos].val][-1]
+    return pushed
 
 # SSA形式の命令列に対して変数名の置き換え、SSA形式として完成させる。
+# 支配木を深さ優先でたどり、各ブロックで定義した変数のスタックを、そのブロックの
+# 子孫をすべて処理した後に戻す。深い支配木でも再帰の深さの制限にかからないよう、
+# 明示的なスタックを使ってたどる。
 def rename_variables(f):
-    stack = {var: [0] for var in f.symtable.sym_enumerator(
-        kind=('localvar', 'param', 'temp'))}
-    counter = {var: 1 for var in f.symtable.sym_enumerator(
-        kind=('localvar', 'param', 'temp'))}
-    search(f, stack, counter, f.entry)
+    variables = list(f.symtable.sym_enumerator(kind=('localvar', 'param', 'temp')))
+    stack = {var: [make_id(var + '.0')] for var in variables}
+    counter = {var: 1 for var in variables}
+    prefix = {var: var + '.' for var in variables}
 
-    if _verbose:
+    pushed = rename_block(f, stack, counter, prefix, f.entry)
+    work = [(iter(f.tree.get(f.entry, ())), pushed)]
+    while work:
+        children, pushed = work[-1]
+        for child in children:
+            work.append((iter(f.tree.get(child, ())),
+                         rename_block(f, stack, counter, prefix, child)))
+            break
+        else:
+            # 元の左辺の変数に対するスタックを戻す。
+            work.pop()
+            for var in pushed:
+                stack[var].pop()
+
+    # 仮引数を置き換え後の変数名にする。
+    renamed = [left(i) for i in f.bbtable[f.entry].insts if op(i) == Op.DEFPARAM]
+    f.params = [[p[0], v] for p, v in zip(f.params, renamed)]
+
+    if is_verbose(f):
         print('*** rename var start ***')
         for bb in f.bbtable.values():
             print('{} (pred={}) (succ={})'.format(bb.name, bb.pred, bb.succ))
@@ -320,9 +400,9 @@ def rename_variables(f):
 def get_term_type(f, term):
     if is_id(term):
         if f.symtable.get_sym(id_name(term)):
-            return f.symtable.get_sym(id_name(term), 'type')
+            return f.symtable.get_type(id_name(term))
         else:
-            return f.program.symtable.get_sym(id_name(term), 'type')
+            return f.program.symtable.get_type(id_name(term))
     elif is_num(term):
         # 数値はすべてintとする。
         return 'int'
@@ -332,35 +412,51 @@ def get_term_type(f, term):
 # 基本ブロックをたどって型が未決の識別子に型を設定する。
 # 支配木情報を利用するため、支配木の確定後に実行すること。
 def set_type(f, block):
-    if block in f.tree:
-        for child in f.tree[block]:
-            set_type(f, child)
-            
+    # 支配木を帰りがけ順にたどる。
+    work = [(block, iter(f.tree.get(block, ())))]
+    while work:
+        current, children = work[-1]
+        for child in children:
+            work.append((child, iter(f.tree.get(child, ()))))
+            break
+        else:
+            work.pop()
+            set_block_type(f, current)
+
+# 2項演算の被演算子の型が一致しないことを、プログラムの警告に記録する。
+def type_mismatch(f, t1, type1, t2, type2):
+    message = 'type mismatch in function {}: {}({}), {}({})'.format(
+        f.name, t1.val, type1, t2.val, type2)
+    if f.program is not None:
+        f.program.warnings.append(message)
+    else:
+        print('warning: ' + message)
+
+# ひとつの基本ブロック内の識別子に型を設定する。
+def set_block_type(f, block):
     # 自ブロックの各文に対して型を設定する。
     for i in f.bbtable[block].insts:
         # 左辺が識別子の場合は右辺の型が左辺の型になる。
         if is_id(left(i)) and get_term_type(f, left(i)) is None:
-            if op(i) in ('+', '-', '*', '/'):
+            if op(i) in (Op.ADD, Op.SUB, Op.MUL, Op.DIV):
                 # 右辺が加減乗除の場合は右辺の計算結果が左辺の型になる。
                 t1 = get_term_type(f, right(i, 1))
                 t2 = get_term_type(f, right(i, 2))
                 if t1 != t2:
-                    print('WARNING: type mismatch: {}(), {}()'
-                          .format(right(i, 1), t1, right(i, 2), t2))
+                    type_mismatch(f, right(i, 1), t1, right(i, 2), t2)
                 f.symtable.set_sym(id_name(left(i)), {'type': t1})
-            elif op(i) in ('<', '<=', '>', '>=', '==', '!='):
+            elif op(i) in (Op.LT, Op.LE, Op.GT, Op.GE, Op.EQ, Op.NE):
                 # 右辺が比較式の場合は式の結果はboolean型とする。
                 t1 = get_term_type(f, right(i, 1))
                 t2 = get_term_type(f, right(i, 2))
                 if t1 != t2:
-                    print('WARNING: type mismatch: {}(), {}()'
-                          .format(right(i, 1), t1, right(i, 2), t2))
+                    type_mismatch(f, right(i, 1), t1, right(i, 2), t2)
                 f.symtable.set_sym(id_name(left(i)), {'type': 'boolean'})
-            elif op(i) in ('unary_minus', '='):
+            elif op(i) in (Op.NEG, Op.COPY):
                 # 単項演算子またはコピー文の場合
                 t1 = get_term_type(f, right(i, 1))
                 f.symtable.set_sym(id_name(left(i)), {'type': t1})
-            elif op(i) == 'call':
+            elif op(i) == Op.CALL:
                 # 関数呼び出しの場合
                 t1 = get_term_type(f, right(i, 1))
                 f.symtable.set_sym(id_name(left(i)), {'type': t1})
@@ -372,41 +468,969 @@ def type_analysis(f):
     set_type(f, f.entry)
 
 # コピー伝播最適化を行う。
+# コピー文"a = b"をすべて削除し、aの参照をbに置き換える。
+# "a = b; c = a"のようなコピーの連鎖は、union-findの要領でコピー元を
+# 根までたどって(経路を短縮しながら)最初のコピー元に置き換える。
+# 引数がすべて同じ値のφ関数(φ関数自身を参照する引数は除く)もコピー文とみなす。
+# この処理の後にはコピー文が残らないので、LLVM IRにコピー文は出力されない。
 def copy_propagation(f):
-    copy_inst = {}
-    # コピー文を探す。
-    for bbattr in f.bbtable.values():
-        pos = []
-        for i in range(len(bbattr.insts)):
-            inst = bbattr.insts[i]
-            if is_copy(inst):
-                # コピー文の左辺の変数名をキーとし、右辺の項(変数または数値)を
-                # 値とする辞書要素を追加する。
-                copy_inst[id_name(left(inst))] = right(inst, 1)
-                pos.append(i)
-                
-        # コピー文を削除する。
-        bbattr.insts = [bbattr.insts[i]
-                        for i in range(len(bbattr.insts)) if i not in pos]
-
-    # コピー先の変数の使用箇所をコピー元の変数または数値で置き換える。
-    for bbattr in f.bbtable.values():
-        for inst in bbattr.insts:
-            for pos in range(2, len(inst)):
-                if id_name(inst[pos]) in copy_inst:
-                    inst[pos] = copy_inst[id_name(inst[pos])]
+    # コピー先の変数名 -> コピー元の項
+    copies = {}
+
+    # 項のコピー元をたどり、最初のコピー元の項を返す。
+    def find(term):
+        path = []
+        while term.kind == TERM_ID and term.val in copies:
+            path.append(term.val)
+            term = copies[term.val]
+        for name in path:
+            copies[name] = term
+        return term
+
+    # コピー文を探して削除する。
+    for bb in f.bbtable.values():
+        insts = []
+        for i in bb.insts:
+            if i.op == Op.COPY:
+                copies[i.left.val] = i.args[0]
+            else:
+                insts.append(i)
+        bb.insts = insts
+
+    # コピー先の変数の参照をコピー元で置き換える。
+    # 置き換えによって引数がすべて同じになったφ関数は、コピー文として
+    # 扱い、変化がなくなるまで繰り返す。扱ったφ関数は最後にまとめて削除する。
+    phis = [(bb, i) for bb in f.bbtable.values() for i in bb.insts
+            if i.op == Op.PHI]
+    removed = set()
+    changed = True
+    while changed:
+        changed = False
+        for bb in f.bbtable.values():
+            for i in bb.insts:
+                args = i.args
+                for pos in range(len(args)):
+                    term = args[pos]
+                    if term.kind == TERM_ID and term.val in copies:
+                        args[pos] = find(term)
+        remaining = []
+        for bb, i in phis:
+            args = [a for a in i.args if not same_id(a, i.left)]
+            if args and all(a.kind == args[0].kind and a.val == args[0].val
+                            for a in args):
+                copies[i.left.val] = args[0]
+                removed.add(i)
+                changed = True
+            else:
+                remaining.append((bb, i))
+        phis = remaining
+    if removed:
+        for bb in f.bbtable.values():
+            bb.insts = [i for i in bb.insts if i not in removed]
+
+    for name in copies:
+        if f.symtable.get_sym(name) is not None:
+            f.symtable.delete_sym(name)
+
+    if is_verbose(f):
+        print_blocks(f, 'copy propagation ({} removed)'.format(len(copies)))
+
+# 基本ブロックと命令の一覧を印字する。
+def print_blocks(f, title):
+    print('*** {} start ***'.format(title))
+    for bb in f.bbtable.values():
+        print('{} (pred={}) (succ={})'.format(bb.name, bb.pred, bb.succ))
+        for i in bb.insts:
+            print('  {}'.format(i))
+    print('*** {} end ***'.format(title))
+
+# 基本ブロックsrcからdstへの辺を削除する。
+# dstのφ関数からは、srcに対応する位置の引数を削除する。
+def remove_edge(f, src, dst):
+    f.bbtable[src].succ.remove(dst)
+    bb = f.bbtable[dst]
+    pos = bb.pred.index(src)
+    del bb.pred[pos]
+    for i in bb.insts:
+        if i.op == Op.PHI:
+            del i.args[pos]
+
+# 基本ブロックを削除する。
+# 後続ブロックへの辺と、ブロック内で定義していた変数とラベルも識別子表から削除する。
+def remove_block(f, bbname):
+    bb = f.bbtable[bbname]
+    for succ in list(bb.succ):
+        if succ in f.bbtable:
+            remove_edge(f, bbname, succ)
+    for i in bb.insts:
+        if is_id(left(i)) and f.symtable.get_sym(id_name(left(i))) is not None:
+            f.symtable.delete_sym(id_name(left(i)))
+    if f.symtable.get_sym(bbname) is not None:
+        f.symtable.delete_sym(bbname)
+    del f.bbtable[bbname]
+
+# 後続ブロックが1個だけで、その後続ブロックの先行ブロックが自分だけであれば、
+# 2つの基本ブロックを1個にまとめる。インライン展開で生じる、ラベルと分岐だけの
+# ブロックの連なりを取り除く。入口ブロックと出口ブロックはまとめない。
+# まとめたブロックのφ関数は引数が1個なので、コピー文に置き換える。
+def merge_blocks(f):
+    merged = 0
+    for bbname in list(f.bbtable.keys()):
+        bb = f.bbtable.get(bbname)
+        if bb is None:
+            continue
+        while len(bb.succ) == 1 and bb.insts and bb.insts[-1].op == Op.GOTO:
+            succ = f.bbtable[bb.succ[0]]
+            if succ.name in (f.entry, f.end, bbname) or succ.pred != [bbname]:
+                break
+            insts = []
+            for i in succ.insts[1:]:
+                if i.op == Op.PHI:
+                    i = make_inst(i.left, Op.COPY, i.args[0])
+                if (is_id(left(i))
+                    and f.symtable.get_sym(id_name(left(i))) is not None):
+                    f.symtable.set_sym(id_name(left(i)), {'bb': bbname})
+                insts.append(i)
+            bb.insts[-1:] = insts
+            bb.succ = succ.succ
+            for name in bb.succ:
+                pred = f.bbtable[name].pred
+                pred[pred.index(succ.name)] = bbname
+            if f.symtable.get_sym(succ.name) is not None:
+                f.symtable.delete_sym(succ.name)
+            del f.bbtable[succ.name]
+            merged += 1
+    if merged > 0:
+        update_dominators(f)
+    if is_verbose(f):
+        print_blocks(f, 'merge blocks ({} merged)'.format(merged))
+
+# 制御フローを変更した後に、支配木と支配辺境を計算し直す。
+def update_dominators(f):
+    calc_dom(f)
+    calc_idom(f)
+    calc_df(f)
+
+# 32ビット符号付き整数の範囲に丸める。
+def wrap_int32(value):
+    value &= 0xffffffff
+    return value - 0x100000000 if value & 0x80000000 else value
+
+# 定数伝播で使う束の要素
+# 定数値はintで表し、まだ値が決まらない状態をUNDEF、定数でないことが
+# 分かった状態をVARYINGとする。
+UNDEF = 'undef'
+VARYING = 'varying'
+
+# 束の交わりを求める。
+def meet(v1, v2):
+    if v1 == UNDEF:
+        return v2
+    elif v2 == UNDEF or v1 == v2:
+        return v1
+    else:
+        return VARYING
+
+# 定数の演算結果を求める。
+# 0による除算と、結果が表現できない除算は畳み込まない(VARYINGとする)。
+def fold_constant(opcode, values):
+    if opcode == Op.COPY:
+        return values[0]
+    elif opcode == Op.NEG:
+        return wrap_int32(-values[0])
+    a, b = values
+    if opcode == Op.ADD:
+        return wrap_int32(a + b)
+    elif opcode == Op.SUB:
+        return wrap_int32(a - b)
+    elif opcode == Op.MUL:
+        return wrap_int32(a * b)
+    elif opcode == Op.DIV:
+        if b == 0 or (a == -0x80000000 and b == -1):
+            return VARYING
+        # C言語と同じく0方向に切り捨てる。
+        q = abs(a) // abs(b)
+        return q if (a < 0) == (b < 0) else -q
+    elif opcode == Op.LT:
+        return int(a < b)
+    elif opcode == Op.LE:
+        return int(a <= b)
+    elif opcode == Op.GT:
+        return int(a > b)
+    elif opcode == Op.GE:
+        return int(a >= b)
+    elif opcode == Op.EQ:
+        return int(a == b)
+    elif opcode == Op.NE:
+        return int(a != b)
+    return VARYING
+
+# 畳み込みの対象とする命令
+foldable_ops = (Op.COPY, Op.NEG, Op.ADD, Op.SUB, Op.MUL, Op.DIV,
+                Op.LT, Op.LE, Op.GT, Op.GE, Op.EQ, Op.NE)
+
+# 条件付き定数伝播(sparse conditional constant propagation)を行う。
+# Wegman, Zadeckのアルゴリズムにより、実行されうる辺だけをたどって各SSA変数の
+# 値が定数かどうかを求める。その結果により、
+#   - 定数となる変数の参照を数値に置き換え、定義命令を削除する。
+#   - 条件が定数のif命令をgoto命令に置き換える。
+#   - 到達しない基本ブロックと、それに対応するφ関数の引数を削除する。
+def sccp(f):
+    # 変数の値と、変数を参照している命令(ブロック名, 命令)の一覧
+    value = {}
+    uses = {}
+    for bbname, bb in f.bbtable.items():
+        for i in bb.insts:
+            for term in i.args:
+                if term.kind == TERM_ID:
+                    uses.setdefault(term.val, []).append((bbname, i))
+            if i.left is not None and i.left.kind == TERM_ID:
+                value[i.left.val] = UNDEF
+
+    # 項の値を返す。定義のない変数は定数でないものとする。
+    def term_value(term):
+        if term.kind == TERM_NUM:
+            return wrap_int32(int(term.val))
+        return value.get(term.val, VARYING)
+
+    executable = set()
+    visited = set()
+    flow_work = [(None, f.entry)]
+    ssa_work = []
+
+    def set_value(name, v):
+        if value[name] != v:
+            value[name] = v
+            ssa_work.extend(uses.get(name, ()))
+
+    def visit(bbname, i):
+        opcode = i.op
+        if opcode == Op.PHI:
+            v = UNDEF
+            pred = f.bbtable[bbname].pred
+            for pos, term in enumerate(i.args):
+                if (pred[pos], bbname) in executable:
+                    v = meet(v, term_value(term))
+            set_value(i.left.val, v)
+        elif opcode in foldable_ops:
+            values = [term_value(term) for term in i.args]
+            if opcode in self_compare and same_id(i.args[0], i.args[1]):
+                # 自分自身との比較は値によらず定数となる。
+                v = int(self_compare[opcode])
+            elif opcode == Op.SUB and same_id(i.args[0], i.args[1]):
+                v = 0
+            elif VARYING in values:
+                v = VARYING
+            elif UNDEF in values:
+                v = UNDEF
+            else:
+                v = fold_constant(opcode, values)
+            set_value(i.left.val, v)
+        elif opcode == Op.IF:
+            cond = term_value(i.args[0])
+            if cond == VARYING:
+                flow_work.append((bbname, label_name(i.args[1])))
+                flow_work.append((bbname, label_name(i.args[2])))
+            elif cond != UNDEF:
+                target = i.args[1] if cond != 0 else i.args[2]
+                flow_work.append((bbname, label_name(target)))
+        elif opcode == Op.GOTO:
+            flow_work.append((bbname, label_name(i.args[0])))
+        elif i.left is not None and i.left.kind == TERM_ID:
+            # 関数呼び出しや仮引数の定義の結果は定数でないものとする。
+            set_value(i.left.val, VARYING)
+
+    while flow_work or ssa_work:
+        while flow_work:
+            edge = flow_work.pop()
+            if edge in executable:
+                continue
+            executable.add(edge)
+            bbname = edge[1]
+            if bbname not in visited:
+                visited.add(bbname)
+                for i in f.bbtable[bbname].insts:
+                    visit(bbname, i)
+            else:
+                # 新たに実行されうる辺ができたので、φ関数だけを評価し直す。
+                for i in f.bbtable[bbname].insts:
+                    if i.op == Op.PHI:
+                        visit(bbname, i)
+        while ssa_work:
+            bbname, i = ssa_work.pop()
+            if bbname in visited:
+                visit(bbname, i)
+
+    # 定数となった変数の参照を数値に置き換える。
+    # boolean型の変数はif命令の条件の場合だけ置き換える。
+    constants = {name: v for name, v in value.items()
+                 if v != UNDEF and v != VARYING}
+    changed_cfg = False
+    for name in [name for name in constants
+                 if f.symtable.get_type(name) == 'boolean']:
+        del constants[name]
+    for bbname in list(f.bbtable.keys()):
+        if bbname not in visited:
+            continue
+        bb = f.bbtable[bbname]
+        if constants:
+            for i in bb.insts:
+                args = i.args
+                for pos in range(len(args)):
+                    term = args[pos]
+                    if term.kind == TERM_ID and term.val in constants:
+                        args[pos] = make_num(constants[term.val])
+        last = bb.insts[-1]
+        if last.op == Op.IF:
+            cond = term_value(last.args[0])
+            if cond != VARYING and cond != UNDEF:
+                taken, other = last.args[1], last.args[2]
+                if cond == 0:
+                    taken, other = other, taken
+                bb.insts[-1] = make_inst(None, Op.GOTO, taken)
+                if label_name(other) != label_name(taken):
+                    remove_edge(f, bbname, label_name(other))
+                changed_cfg = True
+
+    # 到達しない基本ブロックを削除する。
+    for bbname in [b for b in f.bbtable.keys() if b not in visited]:
+        remove_block(f, bbname)
+        changed_cfg = True
+
+    # 参照されなくなった定数の定義命令を削除する。
+    used = set()
+    for bb in f.bbtable.values():
+        for i in bb.insts:
+            for term in i.args:
+                if term.kind == TERM_ID:
+                    used.add(term.val)
+    removable = {name for name, v in value.items()
+                 if v != UNDEF and v != VARYING and name not in used}
+    for bb in f.bbtable.values():
+        insts = []
+        for i in bb.insts:
+            if (i.left is not None and i.left.kind == TERM_ID
+                and i.op != Op.DEFPARAM and i.left.val in removable):
+                f.symtable.delete_sym(i.left.val)
+            else:
+                insts.append(i)
+        bb.insts = insts
+
+    if changed_cfg:
+        update_dominators(f)
+
+    if is_verbose(f):
+        print_blocks(f, 'SCCP')
+
+# 自分自身との比較の結果(x op xの値)
+self_compare = {Op.EQ: True, Op.LE: True, Op.GE: True,
+                Op.NE: False, Op.LT: False, Op.GT: False}
+
+# のぞき穴最適化の対象とする命令
+simplified_ops = (Op.ADD, Op.SUB, Op.MUL, Op.DIV, Op.NEG, Op.PHI,
+                  Op.LT, Op.LE, Op.GT, Op.GE, Op.EQ, Op.NE)
+
+# 定数の項の値を返す。定数でなければNoneを返す。
+def const_value(term):
+    return wrap_int32(int(term.val)) if term.kind == TERM_NUM else None
+
+# 同じ変数を表す項かどうか
+def same_id(t1, t2):
+    return t1.kind == TERM_ID and t2.kind == TERM_ID and t1.val == t2.val
+
+# 右側のオペランドが定数の加算・減算・乗算を、(演算, 変数, 定数)の形で返す。
+# 減算は符号を反転した定数の加算とする。それ以外の命令はNoneを返す。
+def const_operation(i):
+    if i is None or len(i.args) != 2:
+        return None
+    a, b = i.args
+    ca, cb = const_value(a), const_value(b)
+    if i.op in (Op.ADD, Op.MUL) and ca is not None and cb is None:
+        return (i.op, b, ca)
+    elif i.op in (Op.ADD, Op.MUL) and cb is not None and ca is None:
+        return (i.op, a, cb)
+    elif i.op == Op.SUB and cb is not None and ca is None:
+        return (Op.ADD, a, wrap_int32(-cb))
+    return None
+
+# 命令を簡単にする。命令を削除して、結果の代わりに別の項を使える場合はその項を
+# 返す。命令を書き換えた場合や変更しない場合はNoneを返す。
+# defsは変数名 -> 定義命令の辞書とする。
+def simplify_inst(i, defs):
+    opcode = i.op
+    if opcode == Op.PHI:
+        # φ(x, x, ...) -> x (φ関数自身を参照する引数は除く)
+        args = [a for a in i.args if not same_id(a, i.left)]
+        if args and all(a.kind == args[0].kind and a.val == args[0].val
+                        for a in args):
+            return args[0]
+        return None
+    elif opcode == Op.NEG:
+        # -(-x) -> x
+        inner = defs.get(i.args[0].val) if i.args[0].kind == TERM_ID else None
+        if inner is not None and inner.op == Op.NEG:
+            return inner.args[0]
+        return None
+    elif opcode in self_compare:
+        # x op x -> 比較の結果(0または1)のコピー
+        # 結果はboolean型の変数なので、参照を数値に置き換えず定義命令を書き換える。
+        if same_id(i.args[0], i.args[1]):
+            i.op, i.args = Op.COPY, [make_num(int(self_compare[opcode]))]
+        return None
+    elif opcode == Op.SUB and same_id(i.args[0], i.args[1]):
+        # x - x -> 0
+        return make_num(0)
+    elif opcode == Op.DIV:
+        # x / 1 -> x
+        if const_value(i.args[1]) == 1:
+            return i.args[0]
+        return None
+    elif opcode in (Op.ADD, Op.SUB):
+        # x - (-y) -> x + y、x + (-y) -> x - y、(-y) + x -> x - y
+        a, b = i.args
+        for x, y in ((a, b), (b, a)) if opcode == Op.ADD else ((a, b),):
+            inner = defs.get(y.val) if y.kind == TERM_ID else None
+            if inner is not None and inner.op == Op.NEG:
+                i.op = Op.SUB if opcode == Op.ADD else Op.ADD
+                i.args = [x, inner.args[0]]
+                return None
+
+    operation = const_operation(i)
+    if operation is None:
+        return None
+    opcode, x, c = operation
+    # (x + c1) + c2 -> x + (c1 + c2)、(x * c1) * c2 -> x * (c1 * c2)
+    inner = const_operation(defs.get(x.val)) if x.kind == TERM_ID else None
+    if inner is not None and inner[0] == opcode:
+        x = inner[1]
+        c = wrap_int32(c + inner[2] if opcode == Op.ADD else c * inner[2])
+    if opcode == Op.ADD:
+        if c == 0:
+            # x + 0 -> x
+            return x
+        elif c < 0 and c != -0x80000000:
+            i.op, i.args = Op.SUB, [x, make_num(-c)]
+        else:
+            i.op, i.args = Op.ADD, [x, make_num(c)]
+    else:
+        if c == 1:
+            # x * 1 -> x
+            return x
+        elif c == 0:
+            # x * 0 -> 0
+            return make_num(0)
+        elif c == -1:
+            # x * -1 -> -x
+            i.op, i.args = Op.NEG, [x]
+        else:
+            i.op, i.args = Op.MUL, [x, make_num(c)]
+    return None
+
+# 代数的な性質を使って命令を簡単にする(のぞき穴最適化)。
+#   x + 0, x - 0, x * 1, x / 1 -> x     x * 0, x - x -> 0
+#   -(-x) -> x                          x * -1 -> -x
+#   (x + 1) + 2 -> x + 3                (x * 2) * 4 -> x * 8
+#   x == x, x <= x, x >= x -> 1         x != x, x < x, x > x -> 0
+#   x - (-y) -> x + y                   x + (-y) -> x - y
+#   φ(x, x, ...) -> x
+# 定義より先に参照が現れないよう、ブロックを逆後順にたどる。
+# 削除した命令の数をf.context['simplified']に記録する。
+def algebraic_simplification(f):
+    defs = {}
+    replace = {}
+    removed = 0
+    for bbname in reverse_postorder(f):
+        bb = f.bbtable[bbname]
+        insts = []
+        for i in bb.insts:
+            args = i.args
+            for pos in range(len(args)):
+                term = args[pos]
+                if term.kind == TERM_ID and term.val in replace:
+                    args[pos] = replace[term.val]
+            if i.op in simplified_ops:
+                term = simplify_inst(i, defs)
+                if term is not None:
+                    replace[i.left.val] = term
+                    f.symtable.delete_sym(i.left.val)
+                    removed += 1
+                    continue
+            if i.left is not None and i.left.kind == TERM_ID:
+                defs[i.left.val] = i
+            insts.append(i)
+        bb.insts = insts
+
+    # φ関数の引数は後にたどるブロックで定義した変数を参照することがある。
+    if replace:
+        for bb in f.bbtable.values():
+            for i in bb.insts:
+                if i.op == Op.PHI:
+                    args = i.args
+                    for pos in range(len(args)):
+                        term = args[pos]
+                        if term.kind == TERM_ID and term.val in replace:
+                            args[pos] = replace[term.val]
+
+    f.context['simplified'] = removed
+    if is_verbose(f):
+        print_blocks(f, 'algebraic simplification ({} removed)'.format(removed))
+
+# 基本ブロックが自分自身の末尾呼び出しで終わっていれば、その呼び出し命令を返す。
+# 末尾呼び出しは次の形の命令列とする。
+#   t = call f, 引数...
+#   .retval.N = t
+#   goto __end
+# tと.retval.Nは、それぞれ次の命令と出口ブロックでしか参照されないものとする。
+def self_tail_call(f, bb, uses):
+    insts = bb.insts
+    if len(insts) < 3 or bb.succ != [f.end]:
+        return None
+    call, copy, goto = insts[-3:]
+    if (call.op == Op.CALL and call.args[0].val == f.name
+        and copy.op == Op.COPY and copy.args[0].kind == TERM_ID
+        and copy.args[0].val == call.left.val
+        and f.symtable.get_origin(copy.left.val) == '.retval'
+        and uses.get(call.left.val, 0) == 1
+        and uses.get(copy.left.val, 0) == 1):
+        return call
+    return None
+
+# 自分自身を末尾で呼び出す関数の呼び出しを、ループに置き換える(末尾再帰の除去)。
+# 入口ブロックの仮引数の定義以外の命令を新しいループヘッダへ移し、ヘッダには
+# 仮引数ごとに、入口ブロックからは仮引数の値を、末尾呼び出しのブロックからは
+# 呼び出しの引数を受け取るφ関数を置く。関数内の仮引数の参照はφ関数の値に
+# 置き換え、末尾呼び出しは出口ブロックへの分岐の代わりにヘッダへ分岐させる。
+def tail_recursion_elimination(f):
+    uses = {}
+    for bb in f.bbtable.values():
+        for i in bb.insts:
+            for term in i.args:
+                if term.kind == TERM_ID:
+                    uses[term.val] = uses.get(term.val, 0) + 1
+    calls = {}
+    for bbname, bb in f.bbtable.items():
+        call = self_tail_call(f, bb, uses)
+        if call is not None:
+            calls[bbname] = call
+    if not calls:
+        return
+
+    # 入口ブロックを仮引数の定義とループヘッダへの分岐だけにする。
+    entry = f.bbtable[f.entry]
+    header = unique_name(f, f.name + '.tailrecurse')
+    f.symtable.add_sym(header, 'label')
+    hbb = BasicBlock(header)
+    ndefs = 1 + sum(1 for i in entry.insts if i.op == Op.DEFPARAM)
+    hbb.insts = [make_inst(None, Op.DEFLABEL, make_label(header))] + entry.insts[ndefs:]
+    entry.insts = entry.insts[:ndefs] + [make_inst(None, Op.GOTO, make_label(header))]
+    for i in hbb.insts:
+        if i.left is not None and i.left.kind == TERM_ID:
+            f.symtable.set_sym(i.left.val, {'bb': header})
+    hbb.succ = entry.succ
+    hbb.pred = [f.entry]
+    entry.succ = [header]
+    for succ in hbb.succ:
+        pred = f.bbtable[succ].pred
+        pred[pred.index(f.entry)] = header
+    if f.entry in calls:
+        calls[header] = calls.pop(f.entry)
+
+    # 入口ブロックの直後にヘッダを置く。
+    bbtable = {}
+    for k, v in f.bbtable.items():
+        bbtable[k] = v
+        if k == f.entry:
+            bbtable[header] = hbb
+    f.bbtable = bbtable
+
+    # 仮引数ごとにφ関数を作り、仮引数の参照を置き換える。
+    params = [i.left for i in entry.insts if i.op == Op.DEFPARAM]
+    phis = []
+    replace = {}
+    for param in params:
+        origin = f.symtable.get_origin(param.val)
+        term = make_id(unique_name(f, origin + '.tr'))
+        f.symtable.add_sym(term.val, 'ssavar',
+                           {'type': f.symtable.get_type(param.val),
+                            'bb': header, 'origin': origin})
+        phis.append(make_inst(term, Op.PHI, param))
+        replace[param.val] = term
+    for bb in f.bbtable.values():
+        for i in bb.insts:
+            args = i.args
+            for pos in range(len(args)):
+                term = args[pos]
+                if term.kind == TERM_ID and term.val in replace:
+                    args[pos] = replace[term.val]
+
+    # 末尾呼び出しをヘッダへの分岐に置き換える。
+    for bbname, call in calls.items():
+        bb = f.bbtable[bbname]
+        remove_edge(f, bbname, f.end)
+        for name in (call.left.val, bb.insts[-2].left.val):
+            f.symtable.delete_sym(name)
+        bb.insts[-3:] = [make_inst(None, Op.GOTO, make_label(header))]
+        bb.succ.append(header)
+        hbb.pred.append(bbname)
+        for phi, arg in zip(phis, call.args[1:]):
+            phi.args.append(arg)
+    hbb.insts[1:1] = phis
+
+    # すべてのreturn文が末尾呼び出しだった場合は出口ブロックに到達しない。
+    if not f.bbtable[f.end].pred:
+        remove_block(f, f.end)
+    update_dominators(f)
+
+    if is_verbose(f):
+        print_blocks(f, 'tail recursion elimination')
+
+# 値番号付けの対象とする、副作用のない命令
+# 関数呼び出しは結果が同じとは限らないので対象としない。
+numbering_ops = (Op.ADD, Op.SUB, Op.MUL, Op.DIV, Op.NEG,
+                 Op.LT, Op.LE, Op.GT, Op.GE, Op.EQ, Op.NE)
+# 引数の順序を入れ替えても結果が変わらない命令
+commutative_ops = (Op.ADD, Op.MUL, Op.EQ, Op.NE)
+
+# 命令の値を表すキーを返す。同じキーの命令は同じ値を計算する。
+def value_key(i):
+    args = tuple((term.kind, term.val) for term in i.args)
+    if i.op in commutative_ops and args[1] < args[0]:
+        args = (args[1], args[0])
+    return (i.op, args)
+
+# 支配木に沿った値番号付けにより、共通部分式を削除する。
+# 支配木を深さ優先でたどりながら、命令のキーから、その値を計算した変数への
+# 表を作る。表は各ブロックの子孫を処理している間だけ有効とするので、
+# 同じ値を計算した変数は必ず置き換える命令を支配している。
+# 同じ値を再び計算する命令は削除し、その変数の参照を表の変数に置き換える。
+# 同じブロック内で引数がすべて等しいφ関数も同様に削除する。
+def value_numbering(f):
+    # 式のキー -> 値を持つ変数の項
+    available = {}
+    # 削除した変数名 -> 置き換える項
+    replace = {}
+    removed = []
+
+    # ブロック内の命令に値番号を付け、表に追加したキーのリストを返す。
+    def number_block(bbname):
+        added = []
+        insts = []
+        for i in f.bbtable[bbname].insts:
+            args = i.args
+            for pos in range(len(args)):
+                term = args[pos]
+                if term.kind == TERM_ID and term.val in replace:
+                    args[pos] = replace[term.val]
+            if i.op in numbering_ops:
+                key = value_key(i)
+            elif i.op == Op.PHI:
+                key = (bbname, value_key(i))
+            else:
+                insts.append(i)
+                continue
+            leader = available.get(key)
+            if leader is None:
+                available[key] = i.left
+                added.append(key)
+                insts.append(i)
+            else:
+                replace[i.left.val] = leader
+                removed.append(i.left.val)
+        f.bbtable[bbname].insts = insts
+        return added
+
+    added = number_block(f.entry)
+    work = [(iter(f.tree.get(f.entry, ())), added)]
+    while work:
+        children, added = work[-1]
+        for child in children:
+            work.append((iter(f.tree.get(child, ())), number_block(child)))
+            break
+        else:
+            # 子孫の処理が終わったブロックで計算した値を表から取り除く。
+            work.pop()
+            for key in added:
+                del available[key]
+
+    # φ関数の引数は支配木で後にたどる先行ブロックの値を参照することがあるので、
+    # 最後にまとめて置き換える。
+    if replace:
+        for bb in f.bbtable.values():
+            for i in bb.insts:
+                if i.op == Op.PHI:
+                    args = i.args
+                    for pos in range(len(args)):
+                        term = args[pos]
+                        if term.kind == TERM_ID and term.val in replace:
+                            args[pos] = replace[term.val]
+
+    for name in removed:
+        f.symtable.delete_sym(name)
+
+    if is_verbose(f):
+        print_blocks(f, 'GVN ({} removed)'.format(len(removed)))
+
+# 基本ブロックaがbを支配するかどうかを、支配木をbからさかのぼって調べる。
+def dominates(f, a, b):
+    while b is not None:
+        if b == a:
+            return True
+        b = f.idom[b]
+    return False
+
+# 自然ループを求める。
+# 後続ブロックが自分を支配している辺(後退辺)ごとに、後退辺の元のブロックから
+# 先行ブロックをループの先頭(ヘッダ)に達するまでさかのぼり、ループに含まれる
+# ブロックを集める。ヘッダが同じループはひとつにまとめる。
+# ヘッダ名 -> ループに含まれるブロック名の集合の辞書を返す。
+def find_loops(f):
+    loops = {}
+    for bbname, bb in f.bbtable.items():
+        for header in bb.succ:
+            if not dominates(f, header, bbname):
+                continue
+            body = loops.setdefault(header, {header})
+            work = [bbname]
+            while work:
+                b = work.pop()
+                if b not in body:
+                    body.add(b)
+                    work.extend(f.bbtable[b].pred)
+    return loops
+
+# 識別子表にない名前を作る。baseが使われていれば末尾に番号を付ける。
+def unique_name(f, base):
+    name = base
+    n = 1
+    while f.symtable.get_sym(name) is not None:
+        name = '{}.{}'.format(base, n)
+        n += 1
+    return name
+
+# ループの前置ブロック(ループの外からヘッダへ分岐する唯一のブロック)を返す。
+# ループの外の先行ブロックがひとつで、その後続ブロックがヘッダだけであれば
+# それを前置ブロックとする。そうでなければ新しいブロックをヘッダの直前に作り、
+# ループの外からの分岐をそのブロックへ付け替える。ヘッダのφ関数のうちループの
+# 外から来る引数は、前置ブロックのφ関数にまとめる。
+def insert_preheader(f, header, body):
+    hbb = f.bbtable[header]
+    outside = [p for p in hbb.pred if p not in body]
+    if len(outside) == 1 and len(f.bbtable[outside[0]].succ) == 1:
+        return outside[0]
+
+    name = unique_name(f, header + '.preheader')
+    f.symtable.add_sym(name, 'label')
+    pbb = BasicBlock(name)
+    pbb.insts.append(make_inst(None, Op.DEFLABEL, make_label(name)))
+    pbb.pred = outside
+    pbb.succ = [header]
+
+    # ヘッダのφ関数の引数を前置ブロックからの1個にまとめる。
+    positions = [pos for pos, p in enumerate(hbb.pred) if p not in body]
+    for i in hbb.insts:
+        if i.op != Op.PHI:
+            continue
+        args = [i.args[pos] for pos in positions]
+        if all(a.kind == args[0].kind and a.val == args[0].val for a in args):
+            term = args[0]
+        else:
+            origin = f.symtable.get_origin(i.left.val)
+            term = make_id(unique_name(f, origin + '.ph'))
+            f.symtable.add_sym(term.val, 'ssavar',
+                               {'type': f.symtable.get_type(i.left.val),
+                                'bb': name, 'origin': origin})
+            pbb.insts.append(make_inst(term, Op.PHI, *args))
+        i.args = ([a for pos, a in enumerate(i.args) if pos not in positions]
+                  + [term])
+    pbb.insts.append(make_inst(None, Op.GOTO, make_label(header)))
+    hbb.pred = [p for p in hbb.pred if p in body] + [name]
+
+    # ループの外からヘッダへの分岐を前置ブロックへの分岐に付け替える。
+    for p in outside:
+        bb = f.bbtable[p]
+        bb.succ = [name if s == header else s for s in bb.succ]
+        last = bb.insts[-1]
+        last.args = [make_label(name)
+                     if a.kind == TERM_LABEL and a.val == header else a
+                     for a in last.args]
+
+    # 出力する順序を保つため、前置ブロックをヘッダの直前に置く。
+    bbtable = {}
+    for k, v in f.bbtable.items():
+        if k == header:
+            bbtable[name] = pbb
+        bbtable[k] = v
+    f.bbtable = bbtable
+    return name
+
+# ループ不変式をループの外へ移動する(loop-invariant code motion)。
+# 自然ループごとに前置ブロックを用意し、オペランドがすべてループの外で
+# 定義されている副作用のない命令を、前置ブロックの末尾へ移動する。
+# ループが一度も実行されない場合にも移動した命令が実行されるので、
+# 0による除算などで例外となりうる除算は、除数が0と-1以外の定数の場合だけ移動する。
+# 内側のループから順に処理し、内側のループの前置ブロックへ移動した命令を
+# さらに外側のループの外へ移動できるようにする。
+def loop_invariant_code_motion(f):
+    loops = find_loops(f)
+    if not loops:
+        return
+    # 入口ブロックには前置ブロックを置けないので、対象としない。
+    loops.pop(f.entry, None)
+    nblocks = len(f.bbtable)
+    for header, body in loops.items():
+        insert_preheader(f, header, body)
+    if len(f.bbtable) != nblocks:
+        update_dominators(f)
+        loops = find_loops(f)
+        loops.pop(f.entry, None)
+
+    # 変数名 -> 定義している基本ブロック名
+    defblock = {}
+    for bbname, bb in f.bbtable.items():
+        for i in bb.insts:
+            if i.left is not None and i.left.kind == TERM_ID:
+                defblock[i.left.val] = bbname
+    order = {bbname: n for n, bbname in enumerate(reverse_postorder(f))}
+
+    def is_invariant(i, body):
+        if i.op == Op.DIV:
+            divisor = i.args[1]
+            if divisor.kind != TERM_NUM or int(divisor.val) in (0, -1):
+                return False
+        elif i.op not in numbering_ops and i.op != Op.COPY:
+            return False
+        for term in i.args:
+            if term.kind == TERM_ID and defblock.get(term.val) in body:
+                return False
+        return True
+
+    hoisted = 0
+    for header, body in sorted(loops.items(), key=lambda item: len(item[1])):
+        preheader = [p for p in f.bbtable[header].pred if p not in body][0]
+        moved = []
+        # 定義が使用より先に現れるよう、ブロックを逆後順にたどる。
+        for bbname in sorted(body, key=order.get):
+            bb = f.bbtable[bbname]
+            insts = []
+            for i in bb.insts:
+                if is_invariant(i, body):
+                    moved.append(i)
+                    defblock[i.left.val] = preheader
+                    f.symtable.set_sym(i.left.val, {'bb': preheader})
+                else:
+                    insts.append(i)
+            bb.insts = insts
+        pbb = f.bbtable[preheader]
+        pbb.insts[-1:-1] = moved
+        hoisted += len(moved)
+
+    if is_verbose(f):
+        print_blocks(f, 'LICM ({} hoisted)'.format(hoisted))
+
+# 副作用を持つため、結果が参照されなくても削除できない命令
+# 制御フローを変えないよう、ラベルと分岐命令もすべて残す。
+essential_ops = (Op.RETURN, Op.IF, Op.GOTO, Op.CALL, Op.DEFLABEL, Op.DEFPARAM)
+
+# 不要な命令を削除する(dead code elimination)。
+# return, if, 関数呼び出しなどの命令を起点として、それらが参照する変数の
+# 定義命令に印を付けていき(mark)、印の付かなかった命令を削除する(sweep)。
+# 互いに参照しあうだけのφ関数も削除できる。
+# 削除した命令で定義していた変数は識別子表からも削除する。
+def dead_code_elimination(f):
+    # 変数名 -> 定義命令
+    defs = {}
+    live = set()
+    work = []
+    for bb in f.bbtable.values():
+        for i in bb.insts:
+            if i.left is not None and i.left.kind == TERM_ID:
+                defs[i.left.val] = i
+            if i.op in essential_ops:
+                live.add(id(i))
+                work.append(i)
+
+    # 必要な命令が参照する変数の定義命令に印を付ける。
+    while work:
+        i = work.pop()
+        for term in i.args:
+            if term.kind == TERM_ID:
+                d = defs.get(term.val)
+                if d is not None and id(d) not in live:
+                    live.add(id(d))
+                    work.append(d)
+
+    # 印の付かなかった命令を削除する。
+    removed = 0
+    for bb in f.bbtable.values():
+        insts = []
+        for i in bb.insts:
+            if id(i) in live:
+                insts.append(i)
+            else:
+                removed += 1
+                if (i.left is not None and i.left.kind == TERM_ID
+                    and f.symtable.get_sym(i.left.val) is not None):
+                    f.symtable.delete_sym(i.left.val)
+        bb.insts = insts
+
+    if is_verbose(f):
+        print_blocks(f, 'DCE ({} removed)'.format(removed))
+
+# 関数に対して順に実行する処理の一覧
+default_passes = [
+    divide_into_blocks,
+    calc_dom,
+    calc_idom,
+    calc_df,
+    type_analysis,
+    calc_liveness,
+    insert_phi_functions,
+    rename_variables,
+    sccp,
+    algebraic_simplification,
+    tail_recursion_elimination,
+    value_numbering,
+    loop_invariant_code_motion,
+    copy_propagation,
+    dead_code_elimination,
+]
+
+# インライン展開などで命令を書き換えた関数に対して、SSA形式のまま
+# 実行し直す後処理の一覧
+cleanup_passes = [
+    update_dominators,
+    sccp,
+    merge_blocks,
+    algebraic_simplification,
+    value_numbering,
+    loop_invariant_code_motion,
+    copy_propagation,
+    dead_code_elimination,
+]
+
+# 関数に対して処理の一覧を順に実行する。
+# プログラムにpass_recorderが設定されていれば、処理ごとに時間などを記録する。
+def run_passes(f, passes=None):
+    recorder = f.program.pass_recorder if f.program is not None else None
+    for p in (default_passes if passes is None else passes):
+        if recorder is None:
+            p(f)
+        else:
+            recorder.run_pass(f, p)
 
 # 構文解析した結果の命令列をSSA形式の内部表現に変換する。
-def irgen(source):
-    program = parse(source, debug=False)
+# recorder(passreport.PassRecorder)を指定すると、構文解析と各処理を記録する。
+def irgen(source, verbose=False, recorder=None):
+    if recorder is None:
+        program = parse(source, debug=False)
+    else:
+        with recorder.phase('parse') as record:
+            program = record['program'] = parse(source, debug=False)
     if program is not None:
+        program.verbose = verbose
+        program.pass_recorder = recorder
         for func in program.func_list:
-            divide_into_blocks(func)
-            calc_dom(func)
-            calc_idom(func)
-            calc_df(func)
-            type_analysis(func)
-            insert_phi_functions(func)
-            rename_variables(func)
-            copy_propagation(func)
+            run_passes(func)
+        for message in program.warnings:
+            print('warning: ' + message)
     return program
@@ -0,0 +1,157 @@
+# 複数のソースファイルをまとめてコンパイルするバッチ処理
+#
+# ソースファイルはプロセスプールのワーカーに分配してコンパイルする。
+# 各ワーカーは構文解析器を一度だけ構築し、複数のファイルのコンパイルで使い回す。
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from parser import get_parser, set_table_cache
+from session import CompileOptions, compile_to_files, evict_cache
+
+# ソースファイルの拡張子
+source_suffix = '.mc'
+
+# コマンドラインで指定されたパスからソースファイルの一覧を作成する。
+# ディレクトリの場合はその下にあるソースファイルをすべて対象とする。
+# manifestには1行に1個のパスを書いたファイルを指定する。#以降は読み飛ばす。
+def collect_sources(paths, manifest=None):
+    if manifest is not None:
+        paths = list(paths)
+        base = os.path.dirname(manifest)
+        with open(manifest) as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if line != '':
+                    paths.append(os.path.join(base, line))
+
+    sources = []
+    seen = set()
+    for path in paths:
+        if os.path.isdir(path):
+            found = []
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                found.extend(os.path.join(dirpath, name) for name in filenames
+                             if name.endswith(source_suffix))
+            found.sort()
+        else:
+            found = [path]
+        for f in found:
+            if f not in seen:
+                seen.add(f)
+                sources.append(f)
+    return sources
+
+# ワーカープロセスの初期化を行う。
+def init_worker(table_cache):
+    if table_cache is not None:
+        set_table_cache(table_cache)
+    get_parser()
+
+# ソースファイルをひとつコンパイルし、結果を辞書で返す。
+# 例外が発生した場合も失敗として結果を返す。
+def compile_file(path, options=None):
+    status = {'source': path, 'ok': False, 'errors': [], 'outputs': []}
+    start = time.perf_counter()
+    try:
+        with open(path) as f:
+            source = f.read()
+        result, status['outputs'] = compile_to_files(source, path, options)
+        status['errors'] = result.errors
+        if result.warnings:
+            status['warnings'] = result.warnings
+        if result.program is not None:
+            status['functions'] = len(result.program.func_list)
+        if result.cache_stats is not None:
+            status['cache'] = result.cache_stats
+        if result.pass_records is not None:
+            for record in result.pass_records:
+                record['source'] = path
+            status['passes'] = result.pass_records
+        status['ok'] = result.ok
+    except Exception as e:
+        status['errors'].append('{}: {}'.format(type(e).__name__, e))
+        status['traceback'] = traceback.format_exc()
+    status['time'] = time.perf_counter() - start
+    return status
+
+# ソースファイルの一覧をプロセスプールでコンパイルし、
+# ファイルごとの結果の辞書のリストを入力と同じ順番で返す。
+# jobsを省略した場合はCPUの数だけワーカーを起動する。
+def compile_batch(sources, jobs=None, options=None, table_cache=None):
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(sources)))
+    if jobs == 1:
+        init_worker(table_cache)
+        return [compile_file(path, options) for path in sources]
+
+    # fork()でワーカーを起動する環境では、親プロセスで構築した構文解析器を
+    # ワーカーがそのまま引き継ぐ。
+    init_worker(table_cache)
+    # ワーカーに渡す単位を大きくしてプロセス間通信の回数を減らす。
+    chunksize = max(1, len(sources) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                             initargs=(table_cache,)) as executor:
+        return list(executor.map(compile_file, sources,
+                                 [options] * len(sources),
+                                 chunksize=chunksize))
+
+# バッチ処理の結果の要約を作成する。
+def summarize(statuses, elapsed, jobs):
+    failed = [s for s in statuses if not s['ok']]
+    summary = {
+        'files': len(statuses),
+        'succeeded': len(statuses) - len(failed),
+        'failed': len(failed),
+        'jobs': jobs,
+        'elapsed': elapsed,
+        'compile_time': sum(s['time'] for s in statuses),
+        'results': statuses,
+    }
+    cached = [s['cache'] for s in statuses if 'cache' in s]
+    if cached != []:
+        summary['cache'] = {'hits': sum(c['hits'] for c in cached),
+                            'misses': sum(c['misses'] for c in cached)}
+    return summary
+
+# 要約をテキストの表として出力する。
+def print_summary(summary, out, verbose=False):
+    for s in summary['results']:
+        if verbose or not s['ok']:
+            out.write('{:4} {:8.1f} ms  {}\n'
+                      .format('ok' if s['ok'] else 'FAIL',
+                              1000 * s['time'], s['source']))
+            for message in s['errors']:
+                out.write('         {}\n'.format(message))
+    out.write('{} files, {} succeeded, {} failed, {:.2f} s elapsed '
+              '({:.2f} s compile time, {} jobs)\n'
+              .format(summary['files'], summary['succeeded'],
+                      summary['failed'], summary['elapsed'],
+                      summary['compile_time'], summary['jobs']))
+    if 'cache' in summary:
+        out.write('ir cache: {} hits, {} misses\n'
+                  .format(summary['cache']['hits'], summary['cache']['misses']))
+
+# 要約をJSON形式で出力する。
+def write_json_summary(summary, out):
+    json.dump(summary, out, indent=2)
+    out.write('\n')
+
+# バッチ処理を実行し、要約を返す。
+def run_batch(paths, manifest=None, jobs=None, options=None, table_cache=None):
+    sources = collect_sources(paths, manifest)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(sources)))
+    start = time.perf_counter()
+    statuses = compile_batch(sources, jobs, options, table_cache)
+    summary = summarize(statuses, time.perf_counter() - start, jobs)
+    # キャッシュの追い出しはワーカーではなく最後に一度だけ行う。
+    if options is not None and options.ir_cache is not None:
+        # すべてのファイルが読み込みに失敗した場合はキャッシュの統計がない。
+        cache = summary.setdefault('cache', {'hits': 0, 'misses': 0})
+        cache['evicted'] = evict_cache(options)
+    return summary
@@ -0,0 +1,80 @@
+# 支配関係の計算の規模に対する処理時間を計測するベンチマーク
+#
+# 使い方: python bench/bench_dom.py [--sizes 250,500,1000,2000,4000]
+#
+# 連続したif文、入れ子になったif文、入れ子になったwhile文の3種類の制御フローを
+# 持つ関数を規模を変えて生成し、calc_dom()とcalc_idom()の処理時間、
+# calc_df()の処理時間と、規模を2倍にしたときの時間の比を表示する。
+import argparse
+import os
+import sys
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from parser import parse
+from analysis import divide_into_blocks, calc_dom, calc_idom, calc_df
+
+# n個のif文が連続する関数を生成する。
+def generate_sequence(n):
+    stats = ['if (x < {}) {{ x = x + {}; }}'.format(i % 13, i) for i in range(n)]
+    return 'int f(int x) {{ {} return x; }}'.format(' '.join(stats))
+
+# 深さnの入れ子になったif-else文を持つ関数を生成する。
+def generate_nested_if(n):
+    return ('int f(int x) {{ {} x = 0; {} return x; }}'
+            .format('if (x < 5) { x = x + 1; ' * n,
+                    '} else { x = x - 1; }' * n))
+
+# 深さnの入れ子になったwhile文を持つ関数を生成する。
+def generate_nested_while(n):
+    return ('int f(int x) {{ {} x = x - 1; {} return x; }}'
+            .format('while (x > 5) { ' * n, '}' * n))
+
+generators = [
+    ('sequence', generate_sequence),
+    ('nested-if', generate_nested_if),
+    ('nested-while', generate_nested_while),
+]
+
+def measure(source, repeat):
+    best_dom = best_df = None
+    for _ in range(repeat):
+        f = parse(source).func_list[0]
+        divide_into_blocks(f)
+        start = time.perf_counter()
+        calc_dom(f)
+        calc_idom(f)
+        t_dom = time.perf_counter() - start
+        start = time.perf_counter()
+        calc_df(f)
+        t_df = time.perf_counter() - start
+        best_dom = t_dom if best_dom is None else min(best_dom, t_dom)
+        best_df = t_df if best_df is None else min(best_df, t_df)
+    return best_dom, best_df, len(f.bbtable)
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--sizes', default='250,500,1000,2000,4000')
+    argp.add_argument('--repeat', type=int, default=3)
+    args = argp.parse_args()
+    sizes = [int(s) for s in args.sizes.split(',')]
+
+    print('{:12s} {:>8s} {:>8s} {:>10s} {:>8s} {:>10s} {:>8s}'
+          .format('shape', 'n', 'blocks', 'dom', 'ratio', 'df', 'ratio'))
+    for name, generate in generators:
+        prev = None
+        for n in sizes:
+            t_dom, t_df, blocks = measure(generate(n), args.repeat)
+            if prev is not None and prev[0] * 2 == n:
+                ratios = ['{:8.2f}'.format(t / p) for t, p in
+                          zip((t_dom, t_df), prev[1:])]
+            else:
+                ratios = ['{:>8s}'.format('-')] * 2
+            print('{:12s} {:8d} {:8d} {:9.4f}s {} {:9.4f}s {}'
+                  .format(name, n, blocks, t_dom, ratios[0], t_df, ratios[1]))
+            prev = (n, t_dom, t_df)
+
+if __name__ == '__main__':
+    main()
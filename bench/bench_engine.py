@@ -0,0 +1,163 @@
+# 実行エンジン(engine.py)の実行時間を計測するベンチマーク
+#
+# 使い方: python bench/bench_engine.py [--scale 1] [--repeat 3]
+#
+# いくつかのプログラムを、engine.run()と、同じSSA形式の内部表現を命令ごとに
+# 解釈して実行する素朴なインタプリタ(naive_run())とで実行し、処理時間と
+# 速度の比を表示する。両者の結果が一致することの確認を兼ねる。
+import argparse
+import os
+import sys
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+import engine
+from analysis import irgen
+from util import *
+
+# (名前, ソースコード, 引数)
+programs = [
+    ('fib', '''
+int fib(int n) {
+    if (n < 2) { return n; }
+    return fib(n - 1) + fib(n - 2);
+}
+int app_main(int n) { return fib(n); }
+''', [20]),
+    ('loop', '''
+int app_main(int n) {
+    int i; int s;
+    i = 0; s = 0;
+    while (i < n) { s = s + i * i - s / 3; i = i + 1; }
+    return s;
+}
+''', [100000]),
+    ('nested', '''
+int app_main(int n) {
+    int i; int j; int s;
+    i = 0; s = 0;
+    while (i < n) {
+        j = 0;
+        while (j < n) {
+            if (i < j) { s = s + i * j; } else { s = s - j; }
+            j = j + 1;
+        }
+        i = i + 1;
+    }
+    return s;
+}
+''', [300]),
+    ('calls', '''
+int sq(int x) { return x * x; }
+int step(int x, int k) { if (x > k) { return x - k; } return x + sq(k); }
+int app_main(int n) {
+    int i; int x;
+    i = 0; x = 1;
+    while (i < n) { x = step(x, i) * 3 + 1; i = i + 1; }
+    return x;
+}
+''', [50000]),
+]
+
+# SSA形式の内部表現を命令ごとに解釈して実行する。
+# 変数の値は名前をキーとする辞書に置き、命令のたびに命令コードで処理を選ぶ。
+def naive_run(program, name, *args):
+    functions = {f.name: f for f in program.func_list}
+
+    def call(f, args):
+        env = {}
+        params = [i.left.val for i in f.bbtable[f.entry].insts
+                  if i.op == Op.DEFPARAM]
+        for p, a in zip(params, args):
+            env[p] = a
+
+        def value(term):
+            if term.kind == TERM_NUM:
+                return int(term.val)
+            return env[term.val]
+
+        prev = None
+        bbname = f.entry
+        while True:
+            bb = f.bbtable[bbname]
+            # φ関数は先行ブロックに応じた引数の値をまとめて代入する。
+            phis = [(i.left.val, value(i.args[bb.pred.index(prev)]))
+                    for i in bb.insts if i.op == Op.PHI]
+            for k, v in phis:
+                env[k] = v
+            nxt = None
+            for i in bb.insts:
+                opcode = i.op
+                if opcode == Op.ADD:
+                    env[i.left.val] = engine.wrap(value(i.args[0]) + value(i.args[1]))
+                elif opcode == Op.SUB:
+                    env[i.left.val] = engine.wrap(value(i.args[0]) - value(i.args[1]))
+                elif opcode == Op.MUL:
+                    env[i.left.val] = engine.wrap(value(i.args[0]) * value(i.args[1]))
+                elif opcode == Op.DIV:
+                    env[i.left.val] = engine.wrap(
+                        engine.c_div(value(i.args[0]), value(i.args[1])))
+                elif opcode == Op.NEG:
+                    env[i.left.val] = engine.wrap(-value(i.args[0]))
+                elif opcode == Op.COPY:
+                    env[i.left.val] = value(i.args[0])
+                elif opcode == Op.LT:
+                    env[i.left.val] = value(i.args[0]) < value(i.args[1])
+                elif opcode == Op.LE:
+                    env[i.left.val] = value(i.args[0]) <= value(i.args[1])
+                elif opcode == Op.GT:
+                    env[i.left.val] = value(i.args[0]) > value(i.args[1])
+                elif opcode == Op.GE:
+                    env[i.left.val] = value(i.args[0]) >= value(i.args[1])
+                elif opcode == Op.EQ:
+                    env[i.left.val] = value(i.args[0]) == value(i.args[1])
+                elif opcode == Op.NE:
+                    env[i.left.val] = value(i.args[0]) != value(i.args[1])
+                elif opcode == Op.CALL:
+                    env[i.left.val] = call(functions[i.args[0].val],
+                                           [value(a) for a in i.args[1:]])
+                elif opcode == Op.GOTO:
+                    nxt = i.args[0].val
+                elif opcode == Op.IF:
+                    nxt = i.args[1].val if value(i.args[0]) else i.args[2].val
+                elif opcode == Op.RETURN:
+                    return value(i.args[0])
+            prev, bbname = bbname, nxt
+
+    return call(functions[name], args)
+
+def best_time(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        t = time.perf_counter() - start
+        best = t if best is None else min(best, t)
+    return best, result
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--scale', type=float, default=1.0)
+    argp.add_argument('--repeat', type=int, default=3)
+    args = argp.parse_args()
+    sys.setrecursionlimit(10000)
+
+    print('{:8s} {:>10s} {:>10s} {:>10s} {:>8s}'
+          .format('program', 'load', 'engine', 'naive', 'speedup'))
+    for name, source, params in programs:
+        params = [max(1, int(p * args.scale)) for p in params]
+        program = irgen(source)
+        t_load, executable = best_time(lambda: engine.load(program), args.repeat)
+        t_engine, r1 = best_time(lambda: executable.run('app_main', *params),
+                                 args.repeat)
+        t_naive, r2 = best_time(lambda: naive_run(program, 'app_main', *params),
+                                args.repeat)
+        if r1 != r2:
+            print('{}: results differ ({} != {})'.format(name, r1, r2))
+        print('{:8s} {:9.4f}s {:9.3f}s {:9.3f}s {:7.1f}x'
+              .format(name, t_load, t_engine, t_naive, t_naive / t_engine))
+
+if __name__ == '__main__':
+    main()
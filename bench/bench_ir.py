@@ -0,0 +1,95 @@
+# 内部表現の大きさと処理時間を計測するベンチマーク
+#
+# 使い方: python bench/bench_ir.py [-n 文の数]
+#
+# 直線的な長い関数を持つプログラムを生成し、irgen()、llvmgen()、
+# write_llvm()(ファイルへの書き出し)の処理時間と、tracemallocで計測した
+# メモリ使用量のピークを表示する。
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from analysis import irgen
+from llvmgen import llvmgen, write_llvm
+from util import *
+
+# 文の数がnの長い関数を持つプログラムを生成する。
+def generate(n, nvars=8):
+    names = ['v{}'.format(i) for i in range(nvars)]
+    lines = ['int big(int a, int b) {']
+    lines.extend('    int {};'.format(v) for v in names)
+    lines.extend('    {} = a + {};'.format(v, i) for i, v in enumerate(names))
+    for i in range(n):
+        x = names[i % nvars]
+        y = names[(i * 3 + 1) % nvars]
+        z = names[(i * 5 + 2) % nvars]
+        lines.append('    {} = {} * {} + {} - b / {};'
+                     .format(x, y, i % 7 + 1, z, i % 5 + 1))
+    lines.append('    return {};'.format(' + '.join(names)))
+    lines.append('}')
+    lines.append('int app_main(int n) { return big(n, n + 1); }')
+    return '\n'.join(lines)
+
+def count_insts(program):
+    return sum(len(bb.insts) for f in program.func_list
+               for bb in f.bbtable.values())
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('-n', type=int, default=12500)
+    argp.add_argument('-f', '--functions', type=int, default=1,
+                      help='生成する関数の数')
+    args = argp.parse_args()
+    source = generate(args.n)
+    if args.functions > 1:
+        # 同じ関数を名前を変えて複数並べる。
+        body = source.split('\nint app_main')[0]
+        source = '\n'.join(body.replace('int big(', 'int big{}('.format(i), 1)
+                            for i in range(args.functions))
+
+    # 構文解析器の構築時間を含めないように一度空で解析しておく。
+    irgen('int f() { return 0; }')
+
+    # 処理時間はtracemallocの影響を受けないように別に計測する。
+    start = time.perf_counter()
+    program = irgen(source)
+    t_irgen = time.perf_counter() - start
+    start = time.perf_counter()
+    llvmgen(program)
+    t_llvmgen = time.perf_counter() - start
+    program = irgen(source)
+    with open(os.devnull, 'w') as out:
+        start = time.perf_counter()
+        write_llvm(program, out)
+        t_write = time.perf_counter() - start
+    del program
+
+    tracemalloc.start()
+    program = irgen(source)
+    _, peak_irgen = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    lines = llvmgen(program)
+    del lines
+    current, peak_llvmgen = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    with open(os.devnull, 'w') as out:
+        write_llvm(program, out)
+    _, peak_write = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print('instructions     {:10d}'.format(count_insts(program)))
+    print('irgen            {:10.2f} s   peak {:8.1f} MB'
+          .format(t_irgen, peak_irgen / 2**20))
+    print('llvmgen          {:10.2f} s   peak {:8.1f} MB'
+          .format(t_llvmgen, peak_llvmgen / 2**20))
+    print('write_llvm       {:10.2f} s   peak {:8.1f} MB'
+          .format(t_write, peak_write / 2**20))
+    print('resident IR      {:10.1f} MB'.format(current / 2**20))
+
+if __name__ == '__main__':
+    main()
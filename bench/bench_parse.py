@@ -0,0 +1,87 @@
+# 構文解析(内部表現の構築)の規模に対する処理時間を計測するベンチマーク
+#
+# 使い方: python bench/bench_parse.py [--sizes 1000,2000,4000,8000] [--check]
+#
+# 直線的な長い関数、長い演算子の連鎖、深く入れ子になった関数呼び出しと
+# 単項マイナスの4種類のプログラムを規模を変えて生成し、parse()の処理時間と
+# 規模を2倍にしたときの時間の比を表示する。比が2前後なら線形である。
+# --checkを指定すると、比が許容値を超えた場合に終了コード1で終了する。
+import argparse
+import os
+import sys
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from parser import parse
+from bench_ir import generate as generate_straight
+
+# 長さnの演算子の連鎖からなる式を持つプログラムを生成する。
+def generate_chain(n):
+    ops = ['+', '-', '*', '<', '+', '==']
+    terms = ['a']
+    for i in range(n):
+        terms.append(ops[i % len(ops)])
+        terms.append('b' if i % 2 else str(i % 100))
+    return 'int f(int a, int b) {{ return {}; }}'.format(' '.join(terms))
+
+# 深さnの入れ子になった関数呼び出しを持つプログラムを生成する。
+def generate_calls(n):
+    return ('int g(int a, int b) {{ return a; }}\n'
+            'int f(int a) {{ return {}a{}; }}'
+            .format('g(1, ' * n, ')' * n))
+
+# 深さnの入れ子になった単項マイナスを持つプログラムを生成する。
+def generate_unary(n):
+    return 'int f(int a) {{ return {}a; }}'.format('- ' * n)
+
+generators = [
+    ('straight', generate_straight),
+    ('chain', generate_chain),
+    ('calls', generate_calls),
+    ('unary', generate_unary),
+]
+
+def measure(source, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        program = parse(source)
+        elapsed = time.perf_counter() - start
+        assert program is not None
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--sizes', default='1000,2000,4000,8000')
+    argp.add_argument('--repeat', type=int, default=3)
+    argp.add_argument('--check', action='store_true')
+    argp.add_argument('--max-ratio', type=float, default=3.0)
+    args = argp.parse_args()
+    sizes = [int(s) for s in args.sizes.split(',')]
+
+    # 構文解析器の構築時間を含めないように一度空で解析しておく。
+    parse('int f() { return 0; }')
+
+    failed = False
+    print('{:10s} {:>8s} {:>10s} {:>8s}'.format('shape', 'n', 'time', 'ratio'))
+    for name, generate in generators:
+        prev = None
+        for n in sizes:
+            t = measure(generate(n), args.repeat)
+            if prev is not None and prev[0] * 2 == n:
+                ratio = '{:8.2f}'.format(t / prev[1])
+                if t / prev[1] > args.max_ratio:
+                    failed = True
+            else:
+                ratio = '{:>8s}'.format('-')
+            print('{:10s} {:8d} {:9.3f}s {}'.format(name, n, t, ratio))
+            prev = (n, t)
+    if args.check and failed:
+        print('parse time grows faster than linear')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+# コンパイラの規模に対する処理時間を計測するベンチマーク
+#
+# 使い方: python bench/bench_scaling.py [--sweep 軸=値,値,...] [--seeds 3]
+#             [--repeat 3] [--memory] [-o 結果.json]
+#         python bench/bench_scaling.py --compare 旧.json 新.json
+#
+# gen_program.pyで生成したプログラムを、生成の設定の軸(関数の数、文の数、
+# 入れ子の深さ、局所変数の数、式の大きさ、呼び出しの割合)ごとに規模を変えて
+# session.compile_source()でコンパイルし、構文解析、SSA化と最適化の各処理、
+# インライン展開、LLVM IRの生成の処理時間(passreport.pyの記録)を表示する。
+# 軸の値と処理時間を両対数で直線近似した傾きを、経験的な計算量の次数として表示する
+# (1なら線形、2なら2乗)。
+#
+# -oを指定すると、結果(各規模での処理ごとの時間と次数)をJSON形式で保存する。
+# --compareは保存した2つの結果を比較し、処理時間の比と次数を並べて表示する。
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from gen_program import GeneratorConfig, generate
+from session import compile_source, CompileOptions
+from analysis import default_passes, rename_variables
+from passreport import program_size
+
+# 軸ごとの既定の規模
+default_sweeps = [
+    ('functions', [1, 2, 4, 8, 16]),
+    ('statements', [50, 100, 200, 400, 800]),
+    ('depth', [1, 2, 4, 8, 16]),
+    ('locals', [4, 16, 64, 256]),
+    ('expr_depth', [1, 2, 4, 8, 16]),
+    ('calls', [0.05, 0.1, 0.2, 0.4]),
+]
+
+# 入れ子の深さを変える場合は、深くできるだけの文の数にする。
+axis_base = {'depth': {'statements': 200}}
+
+# 表に表示する処理のまとまり
+# SSA化(rename_variablesまで)とそれ以降の最適化に分け、その他は処理名のまま表示する。
+ssa_passes = [p.__name__ for p in
+              default_passes[:default_passes.index(rename_variables) + 1]]
+opt_passes = [p.__name__ for p in default_passes if p.__name__ not in ssa_passes]
+stage_groups = [('parse', ['parse']), ('ssa', ssa_passes), ('opt', opt_passes),
+                ('inline', ['inline']), ('llvmgen', ['llvmgen'])]
+
+# ソースコードを1回コンパイルし、処理ごとの時間(関数ごとの合計)の辞書を返す。
+# 入れ子になった処理(インライン展開の後処理)の時間は外側の処理に含める。
+def compile_once(source, memory):
+    options = CompileOptions(time_passes=True, mem_report=memory)
+    result = compile_source(source, options)
+    if not result.ok:
+        raise RuntimeError('generated program does not compile: {}'
+                           .format(result.errors))
+    stages = {}
+    peaks = {}
+    for r in result.pass_records:
+        if r['depth'] != 0:
+            continue
+        stages[r['pass']] = stages.get(r['pass'], 0.0) + r['time']
+        if 'peak' in r:
+            peaks[r['pass']] = max(peaks.get(r['pass'], 0), r['peak'])
+    parse_record = result.pass_records[0]
+    return stages, peaks, parse_record['after'], program_size(result.program)
+
+# ひとつの規模について、シードごとにrepeat回のうち最短の時間を取り、
+# シードの間で平均した結果を返す。
+def measure_point(axis, value, args):
+    params = dict(axis_base.get(axis, {}))
+    params[axis] = value
+    config = GeneratorConfig(**params)
+    totals = {}
+    peaks = {}
+    size = {'source_bytes': 0, 'insts': 0, 'blocks': 0, 'phis': 0,
+            'symbols': 0}
+    for seed in range(args.seeds):
+        source = generate(config, seed)
+        best = None
+        for _ in range(args.repeat):
+            stages, stage_peaks, parsed, final = compile_once(source, args.memory)
+            if best is None or sum(stages.values()) < sum(best.values()):
+                best = stages
+            for k, v in stage_peaks.items():
+                peaks[k] = max(peaks.get(k, 0), v)
+        for k, v in best.items():
+            totals[k] = totals.get(k, 0.0) + v / args.seeds
+        size['source_bytes'] += len(source) / args.seeds
+        size['insts'] += parsed['insts'] / args.seeds
+        for k in ('blocks', 'phis', 'symbols'):
+            size[k] += final[k] / args.seeds
+    point = {'axis': axis, 'value': value, 'config': config.as_dict()}
+    point.update(size)
+    point['stages'] = totals
+    point['total'] = sum(totals.values())
+    if args.memory:
+        point['peaks'] = peaks
+    return point
+
+def group_time(point, names):
+    return sum(point['stages'].get(name, 0.0) for name in names)
+
+# 両対数での最小二乗法の直線の傾きを返す。正の値の点が2個未満ならNoneを返す。
+def loglog_slope(xs, ys):
+    pts = [(math.log(x), math.log(y)) for x, y in zip(xs, ys) if x > 0 and y > 0]
+    if len(pts) < 2:
+        return None
+    mx = sum(x for x, _ in pts) / len(pts)
+    my = sum(y for _, y in pts) / len(pts)
+    sxx = sum((x - mx) ** 2 for x, _ in pts)
+    if sxx == 0:
+        return None
+    return sum((x - mx) * (y - my) for x, y in pts) / sxx
+
+# 軸ごと、処理ごとに、軸の値と命令数のそれぞれに対する次数を求める。
+def complexity(results):
+    table = {}
+    for axis in dict.fromkeys(p['axis'] for p in results):
+        points = [p for p in results if p['axis'] == axis]
+        names = list(dict.fromkeys(k for p in points for k in p['stages']))
+        entry = {}
+        for name in names + ['total']:
+            if name == 'total':
+                ys = [p['total'] for p in points]
+            else:
+                ys = [p['stages'].get(name, 0.0) for p in points]
+            entry[name] = {
+                'exponent': loglog_slope([p['value'] for p in points], ys),
+                'exponent_insts': loglog_slope([p['insts'] for p in points], ys),
+            }
+        table[axis] = entry
+    return table
+
+def format_exponent(k):
+    return '{:6.2f}'.format(k) if k is not None else '{:>6s}'.format('-')
+
+def print_axis(axis, points, fits):
+    print('{} ({})'.format(axis, ', '.join(
+        '{}={}'.format(k, v) for k, v in points[0]['config'].items() if k != axis)))
+    print('{:>8s} {:>8s} {:>7s} {}  {:>10s}'.format(
+        'value', 'insts', 'blocks',
+        ' '.join('{:>10s}'.format(name) for name, _ in stage_groups), 'total(ms)'))
+    for p in points:
+        print('{:>8} {:8.0f} {:7.0f} {}  {:10.3f}'.format(
+            p['value'], p['insts'], p['blocks'],
+            ' '.join('{:10.3f}'.format(group_time(p, names) * 1000)
+                     for _, names in stage_groups),
+            p['total'] * 1000))
+    # まとまりごとの次数は、まとまりの時間の合計から求める。
+    groups = [loglog_slope([p['value'] for p in points],
+                           [group_time(p, names) for p in points])
+              for _, names in stage_groups]
+    print('{:>8s} {:>8s} {:>7s} {}  {:>10s}'.format(
+        'exponent', '', '',
+        ' '.join('{:>10s}'.format(format_exponent(k)) for k in groups),
+        format_exponent(fits['total']['exponent'])))
+    slowest = max((k for k in fits if k != 'total'),
+                  key=lambda k: fits[k]['exponent'] or 0, default=None)
+    if slowest is not None and fits[slowest]['exponent'] is not None:
+        print('highest exponent: {} ({:.2f})'
+              .format(slowest, fits[slowest]['exponent']))
+    print()
+
+def git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=root,
+                             capture_output=True, text=True, timeout=10)
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+# 2つの結果を比較して表示する。
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print('old {} ({})'.format(old.get('commit'), old.get('date')))
+    print('new {} ({})'.format(new.get('commit'), new.get('date')))
+    old_points = {(p['axis'], p['value']): p for p in old['results']}
+    print('{:12s} {:>8s} {:>12s} {:>12s} {:>7s}  {}'.format(
+        'axis', 'value', 'old(ms)', 'new(ms)', 'ratio', 'largest stage change'))
+    for p in new['results']:
+        q = old_points.get((p['axis'], p['value']))
+        if q is None:
+            continue
+        changes = [(p['stages'][k] / q['stages'][k], k) for k in p['stages']
+                   if q['stages'].get(k)]
+        worst = max(changes, key=lambda c: abs(math.log(c[0])) if c[0] > 0 else 0,
+                    default=None)
+        print('{:12s} {:>8} {:12.3f} {:12.3f} {:6.2f}x  {}'.format(
+            p['axis'], p['value'], q['total'] * 1000, p['total'] * 1000,
+            p['total'] / q['total'] if q['total'] else float('inf'),
+            '{} {:.2f}x'.format(worst[1], worst[0]) if worst else ''))
+    print()
+    print('{:12s} {:>10s} {:>10s}'.format('axis', 'old exp', 'new exp'))
+    for axis, fits in new['complexity'].items():
+        old_fits = old['complexity'].get(axis, {})
+        print('{:12s} {:>10s} {:>10s}'.format(
+            axis, format_exponent(old_fits.get('total', {}).get('exponent')),
+            format_exponent(fits['total']['exponent'])))
+
+def parse_sweep(text):
+    axis, _, values = text.partition('=')
+    if axis not in dict(default_sweeps):
+        raise argparse.ArgumentTypeError('unknown axis {}'.format(axis))
+    cast = float if axis == 'calls' else int
+    return axis, [cast(v) for v in values.split(',')]
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--sweep', type=parse_sweep, action='append',
+                      help='軸=値,値,... (軸: {})'.format(
+                          ', '.join(a for a, _ in default_sweeps)))
+    argp.add_argument('--seeds', type=int, default=3)
+    argp.add_argument('--repeat', type=int, default=3)
+    argp.add_argument('--memory', action='store_true',
+                      help='処理ごとのメモリ使用量も計測する')
+    argp.add_argument('-o', '--output')
+    argp.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = argp.parse_args()
+    if args.compare is not None:
+        compare(*args.compare)
+        return
+    sys.setrecursionlimit(10000)
+
+    sweeps = args.sweep or default_sweeps
+    results = []
+    for axis, values in sweeps:
+        points = [measure_point(axis, v, args) for v in values]
+        results.extend(points)
+        print_axis(axis, points, complexity(points)[axis])
+
+    if args.output is not None:
+        data = {
+            'version': 1,
+            'commit': git_commit(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'settings': {'seeds': args.seeds, 'repeat': args.repeat,
+                         'base': GeneratorConfig().as_dict()},
+            'results': results,
+            'complexity': complexity(results),
+        }
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=1)
+            f.write('\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# SSA化の各処理の規模に対する処理時間を計測するベンチマーク
+#
+# 使い方: python bench/bench_ssa.py [--sizes 500,1000,2000,4000] [--locals 64]
+#
+# 深く入れ子になったif文を持つ関数と、多数の局所変数を持つ関数を規模を変えて
+# 生成し、SSA化の各処理(analysis.default_passes)の処理時間を表示する。
+# 入れ子の深さが1000を超えても再帰の深さの制限にかからないことの確認を兼ねる。
+import argparse
+import os
+import sys
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from parser import parse
+from analysis import default_passes
+
+# 深さnの入れ子になったif文を持つ関数を生成する。
+def generate_nested(n, nlocals):
+    names = ['v{}'.format(i) for i in range(nlocals)]
+    head = ' '.join('int {};'.format(v) for v in names)
+    body = ''.join('if (x < {}) {{ {} = x + {}; '.format(i % 7, names[i % nlocals], i)
+                   for i in range(n))
+    result = ' + '.join(names[:8])
+    return ('int f(int x) {{ {} {} x = x - 1; {} return x + {}; }}'
+            .format(head, body, '}' * n, result))
+
+# n個のif文が連続し、多数の局所変数に代入する関数を生成する。
+def generate_locals(n, nlocals):
+    names = ['v{}'.format(i) for i in range(nlocals)]
+    head = ' '.join('int {};'.format(v) for v in names)
+    body = ' '.join('if (x < {}) {{ {} = {} + x; }}'
+                    .format(i % 7, names[i % nlocals], names[(i * 7 + 3) % nlocals])
+                    for i in range(n))
+    result = ' + '.join(names[:8])
+    return ('int f(int x) {{ {} {} return {}; }}'.format(head, body, result))
+
+generators = [
+    ('nested-if', generate_nested),
+    ('locals', generate_locals),
+]
+
+def measure(source):
+    f = parse(source).func_list[0]
+    times = []
+    for p in default_passes:
+        start = time.perf_counter()
+        p(f)
+        times.append(time.perf_counter() - start)
+    return times, len(f.bbtable)
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--sizes', default='500,1000,2000,4000')
+    argp.add_argument('--locals', type=int, default=64)
+    args = argp.parse_args()
+    sizes = [int(s) for s in args.sizes.split(',')]
+
+    names = [p.__name__ for p in default_passes]
+    print('{:10s} {:>6s} {:>7s} {}'.format(
+        'shape', 'n', 'blocks', ' '.join('{:>10.10s}'.format(n) for n in names)))
+    for name, generate in generators:
+        for n in sizes:
+            times, blocks = measure(generate(n, args.locals))
+            print('{:10s} {:6d} {:7d} {}'.format(
+                name, n, blocks, ' '.join('{:9.3f}s'.format(t) for t in times)))
+
+if __name__ == '__main__':
+    main()
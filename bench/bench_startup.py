@@ -0,0 +1,82 @@
+# 構文解析器の起動時間を計測するベンチマーク
+#
+# 使い方: python bench/bench_startup.py [source.mc] [-n 回数]
+#
+# 次の3つの条件でプロセス起動から最初の構文解析完了までの時間を計測する。
+#   none -- テーブルを保存しない(プロセスごとにLALRテーブルを生成する)
+#   cold -- 空のキャッシュディレクトリを指定する(テーブルを生成して保存する)
+#   warm -- 保存済みのキャッシュディレクトリを指定する(テーブルを読み込む)
+# また同一プロセス内でparse()を繰り返したときの1回目と2回目以降の時間も計測する。
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+child_code = '''
+import time
+t = time.perf_counter()
+import parser
+parser.parse(open({path!r}).read())
+print(time.perf_counter() - t)
+'''
+
+# 子プロセスで構文解析を1回行い、プロセス全体の時間と解析までの時間を返す。
+def run_child(path, cache_dir):
+    env = dict(os.environ)
+    env.pop('MICROC_TABLE_CACHE', None)
+    if cache_dir is not None:
+        env['MICROC_TABLE_CACHE'] = cache_dir
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', child_code.format(path=path)],
+                         cwd=root, env=env, capture_output=True, text=True,
+                         check=True)
+    return time.perf_counter() - start, float(out.stdout.split()[-1])
+
+def report(label, samples):
+    total = sorted(s[0] for s in samples)
+    inproc = sorted(s[1] for s in samples)
+    print('{:6} process {:8.1f} ms   import+parse {:8.1f} ms'
+          .format(label, 1000 * total[len(total) // 2],
+                  1000 * inproc[len(inproc) // 2]))
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('source', nargs='?',
+                      default=os.path.join(root, 'sample', 'fib.mc'))
+    argp.add_argument('-n', type=int, default=10)
+    args = argp.parse_args()
+    path = os.path.abspath(args.source)
+
+    report('none', [run_child(path, None) for _ in range(args.n)])
+
+    cold = []
+    warm = []
+    for _ in range(args.n):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cold.append(run_child(path, cache_dir))
+            warm.append(run_child(path, cache_dir))
+        finally:
+            shutil.rmtree(cache_dir)
+    report('cold', cold)
+    report('warm', warm)
+
+    import parser
+    with open(path) as f:
+        source = f.read()
+    times = []
+    for _ in range(args.n):
+        start = time.perf_counter()
+        parser.parse(source)
+        times.append(time.perf_counter() - start)
+    print('in-process parse() first {:.2f} ms, later {:.2f} ms'
+          .format(1000 * times[0], 1000 * min(times[1:])))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# 関数を1個ずつ処理するコンパイル(--stream)のメモリ使用量を計測するベンチマーク
+#
+# 使い方: python bench/bench_stream.py [--functions 25,50,100,200]
+#             [--statements 50] [--inline-threshold N] [--seed 0]
+#
+# gen_program.pyで関数の数を変えて生成したプログラムを、通常のコンパイルと
+# 関数を1個ずつ処理するコンパイルでそれぞれLLVM IRをファイルに書き出しながら
+# コンパイルし、tracemallocで計測したコンパイル中のメモリ使用量の最大値と
+# 処理時間を表示する。LLVM IRは/dev/nullに書き出すので、出力の大きさは含まない。
+# 関数を1個ずつ処理する場合は、関数の数が増えてもメモリ使用量の最大値がほぼ
+# 一定になる。
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from gen_program import GeneratorConfig, generate
+from session import compile_source, CompileOptions
+from inliner import default_threshold
+
+# ソースコードを1回コンパイルし、(メモリ使用量の最大値, 処理時間)を返す。
+def measure(source, options):
+    with open(os.devnull, 'w') as out:
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = compile_source(source, options, out)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    if not result.ok:
+        raise RuntimeError('generated program does not compile: {}'
+                           .format(result.errors))
+    return peak, elapsed
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--functions', default='25,50,100,200',
+                      help='関数の数(カンマ区切り)')
+    argp.add_argument('--statements', type=int, default=50)
+    argp.add_argument('--inline-threshold', type=int, default=default_threshold)
+    argp.add_argument('--seed', type=int, default=0)
+    args = argp.parse_args()
+    sys.setrecursionlimit(10000)
+
+    # 構文解析テーブルの読み込みを計測に含めないよう、先に1回コンパイルしておく。
+    compile_source(generate(GeneratorConfig(functions=1), args.seed))
+
+    print('{:>9s} {:>10s} {:>12s} {:>12s} {:>7s} {:>10s} {:>10s}'.format(
+        'functions', 'source(KB)', 'normal(MB)', 'stream(MB)', 'ratio',
+        'normal(s)', 'stream(s)'))
+    for n in [int(v) for v in args.functions.split(',')]:
+        config = GeneratorConfig(functions=n, statements=args.statements)
+        source = generate(config, args.seed)
+        normal = measure(source, CompileOptions(
+            inline_threshold=args.inline_threshold))
+        stream = measure(source, CompileOptions(
+            inline_threshold=args.inline_threshold, streaming=True))
+        print('{:9d} {:10.1f} {:12.2f} {:12.2f} {:6.2f}x {:10.3f} {:10.3f}'.format(
+            n, len(source) / 1024, normal[0] / 2 ** 20, stream[0] / 2 ** 20,
+            normal[0] / stream[0], normal[1], stream[1]))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+# SSA化で挿入したφ関数の数を関数ごとに数える。
+#
+# 使い方: python bench/count_phi.py [--no-prune] ソースファイル...
+#
+# --no-pruneを指定すると、変数が生きているかどうかにかかわらず
+# 反復支配辺境のすべてにφ関数を挿入した場合の数を数える。
+import argparse
+import functools
+import os
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+import analysis
+from parser import parse
+from util import *
+
+def count_phi(f):
+    return sum(1 for bb in f.bbtable.values() for i in bb.insts
+               if op(i) == Op.PHI)
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('sources', nargs='+')
+    argp.add_argument('--no-prune', action='store_true')
+    args = argp.parse_args()
+
+    passes = [functools.partial(analysis.insert_phi_functions, pruned=False)
+              if p is analysis.insert_phi_functions else p
+              for p in analysis.default_passes
+              if not (args.no_prune and p is analysis.calc_liveness)]
+    total = 0
+    for path in args.sources:
+        with open(path) as f:
+            program = parse(f.read())
+        if program is None:
+            continue
+        for func in program.func_list:
+            analysis.run_passes(func, passes if args.no_prune else None)
+            n = count_phi(func)
+            total += n
+            print('{}:{} {}'.format(path, func.name, n))
+    print('total {}'.format(total))
+
+if __name__ == '__main__':
+    main()
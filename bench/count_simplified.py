@@ -0,0 +1,39 @@
+# のぞき穴最適化(algebraic_simplification)で削除した命令の数を関数ごとに数える。
+#
+# 使い方: python bench/count_simplified.py ソースファイル...
+#
+# 関数ごとに、削除した命令の数と、最適化の後に残った命令の数を表示する。
+import argparse
+import os
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+import analysis
+from parser import parse
+
+def count_insts(f):
+    return sum(len(bb.insts) for bb in f.bbtable.values())
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('sources', nargs='+')
+    args = argp.parse_args()
+
+    total = 0
+    for path in args.sources:
+        with open(path) as f:
+            program = parse(f.read())
+        if program is None:
+            continue
+        for func in program.func_list:
+            analysis.run_passes(func)
+            n = func.context.get('simplified', 0)
+            total += n
+            print('{}:{} removed {} remaining {}'
+                  .format(path, func.name, n, count_insts(func)))
+    print('total {}'.format(total))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+# ベンチマーク用のMicroCプログラムを生成する。
+#
+# 使い方: python bench/gen_program.py [--seed 0] [--functions 4] [--statements 50]
+#             [--depth 3] [--locals 8] [--expr-depth 3] [--calls 0.1] [-o FILE]
+#
+# 同じシードと設定からは同じプログラムを生成する。設定の意味はGeneratorConfigを
+# 参照。生成するプログラムは次の性質を持つ。
+#   - 関数は自分より前に定義した関数だけを呼び出すので、再帰呼び出しはない。
+#   - while文は専用のカウンタ変数で回数を定数に制限するので、必ず終了する。
+#   - 除算は0以外の定数による除算だけとする。
+# したがって生成したプログラムは実行すれば必ず終了する。
+# 式の括弧は使わず、演算子の優先順位だけで式を組み立てる。
+import argparse
+import random
+
+# 生成するプログラムの規模を決める設定
+class GeneratorConfig:
+    def __init__(self, functions=4, statements=50, depth=3, locals=8,
+                 expr_depth=3, calls=0.1):
+        # 関数の数(app_mainを含む)
+        self.functions = functions
+        # 関数ごとの文の数(代入文、if文、while文、return文を1文と数える)
+        self.statements = statements
+        # if文とwhile文の入れ子の深さの上限
+        self.depth = depth
+        # 関数ごとの局所変数の数
+        self.locals = locals
+        # 式に含まれる2項演算子の数
+        self.expr_depth = expr_depth
+        # 式の被演算子を関数呼び出しにする確率
+        self.calls = calls
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+# 複合文(if文、while文)を選ぶ確率
+compound_ratio = 0.3
+# 複合文の本体の文の数の上限
+max_body = 8
+# while文の繰り返し回数の上限
+max_trip = 4
+
+arith_ops = ['+', '-', '*', '+', '-']
+compare_ops = ['<', '<=', '>', '>=', '==', '!=']
+
+class ProgramGenerator:
+    def __init__(self, config, seed=0):
+        self.config = config
+        self.random = random.Random(seed)
+        # 定義済みの関数の(名前, 引数の数)のリスト
+        self.functions = []
+
+    # 被演算子(変数、定数、関数呼び出し)を生成する。
+    # 関数呼び出しの引数はdepthを半分にした式なので、depthが0のときは関数呼び出しを
+    # 生成しないことで、callsの値によらず呼び出しの入れ子が有限になる。
+    def operand(self, names, depth):
+        r = self.random
+        if depth > 0 and self.functions and r.random() < self.config.calls:
+            name, nparams = r.choice(self.functions)
+            args = ', '.join(self.expr(names, depth // 2) for _ in range(nparams))
+            return '{}({})'.format(name, args)
+        if r.random() < 0.25:
+            return str(r.randrange(100))
+        return r.choice(names)
+
+    # 2項演算子をdepth個含む式を生成する。
+    def expr(self, names, depth=None):
+        r = self.random
+        if depth is None:
+            depth = self.config.expr_depth
+        parts = [self.operand(names, depth)]
+        for _ in range(depth):
+            if r.random() < 0.1:
+                parts.append('/ {}'.format(r.randrange(1, 10)))
+            else:
+                parts.append('{} {}'.format(r.choice(arith_ops),
+                                            self.operand(names, depth)))
+        return ' '.join(parts)
+
+    def cond(self, names):
+        return '{} {} {}'.format(self.expr(names), self.random.choice(compare_ops),
+                                 self.expr(names))
+
+    # n個の文からなる文の列を生成し、行のリストを返す。
+    # 入れ子の深さが上限に達していなければ、最初の文を残りの文の大部分を本体に
+    # 持つ複合文にして、文の数が足りれば入れ子が上限の深さに達するようにする。
+    # returnsが真なら、文の列の最後にreturn文を置くことがある。
+    def block(self, n, depth, names, targets, indent, returns=True):
+        r = self.random
+        lines = []
+        pad = '    ' * indent
+        first = True
+        while n > 0:
+            compound = (depth < self.config.depth and n > 1
+                        and (first or r.random() < compound_ratio))
+            if compound:
+                if first:
+                    inner = max(1, n - 1 - r.randint(0, max_body))
+                else:
+                    inner = r.randint(1, min(n - 1, max_body))
+                n -= inner + 1
+                kind = r.randrange(3)
+                if kind == 0:
+                    lines.append('{}if ({}) {{'.format(pad, self.cond(names)))
+                    lines.extend(self.block(inner, depth + 1, names, targets,
+                                            indent + 1))
+                    lines.append('{}}}'.format(pad))
+                elif kind == 1 and inner > 1:
+                    then = r.randint(1, inner - 1)
+                    lines.append('{}if ({}) {{'.format(pad, self.cond(names)))
+                    lines.extend(self.block(then, depth + 1, names, targets,
+                                            indent + 1))
+                    lines.append('{}}} else {{'.format(pad))
+                    lines.extend(self.block(inner - then, depth + 1, names,
+                                            targets, indent + 1))
+                    lines.append('{}}}'.format(pad))
+                else:
+                    counter = 'i{}'.format(len(self.counters))
+                    self.counters.append(counter)
+                    lines.append('{}{} = 0;'.format(pad, counter))
+                    lines.append('{}while ({} < {}) {{'
+                                 .format(pad, counter, r.randint(1, max_trip)))
+                    # 本体の後にカウンタを増やす文を置くので、return文で終えない。
+                    lines.extend(self.block(inner, depth + 1, names + [counter],
+                                            targets, indent + 1, False))
+                    lines.append('{}    {} = {} + 1;'.format(pad, counter, counter))
+                    lines.append('{}}}'.format(pad))
+            elif n == 1 and depth > 0 and returns and r.random() < 0.1:
+                # return文の後に文を置かないよう、文の列の最後にだけ置く。
+                lines.append('{}return {};'.format(pad, self.expr(names)))
+                n -= 1
+            else:
+                lines.append('{}{} = {};'.format(pad, r.choice(targets),
+                                                 self.expr(names)))
+                n -= 1
+            first = False
+        return lines
+
+    # 関数を1個生成し、行のリストを返す。
+    def function(self, name, nparams):
+        config = self.config
+        params = ['p{}'.format(k) for k in range(nparams)]
+        local_names = ['v{}'.format(k) for k in range(max(1, config.locals))]
+        self.counters = []
+        names = params + local_names
+        body = self.block(config.statements, 0, names, local_names, 1)
+        lines = ['int {}({}) {{'.format(name, ', '.join('int ' + p for p in params))]
+        lines.extend('    int {};'.format(v) for v in local_names + self.counters)
+        lines.extend('    {} = {} + {};'.format(v, params[k % nparams], k)
+                     for k, v in enumerate(local_names))
+        lines.extend(body)
+        lines.append('    return {};'.format(self.expr(names)))
+        lines.append('}')
+        return lines
+
+    # プログラム全体を生成し、ソースコードの文字列を返す。
+    def program(self):
+        lines = []
+        for k in range(self.config.functions - 1):
+            name = 'f{}'.format(k)
+            nparams = self.random.randint(1, 3)
+            lines.extend(self.function(name, nparams))
+            self.functions.append((name, nparams))
+        lines.extend(self.function('app_main', 1))
+        return '\n'.join(lines) + '\n'
+
+# 設定とシードからプログラムを生成する。
+def generate(config=None, seed=0):
+    return ProgramGenerator(config or GeneratorConfig(), seed).program()
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--seed', type=int, default=0)
+    argp.add_argument('--functions', type=int, default=4)
+    argp.add_argument('--statements', type=int, default=50)
+    argp.add_argument('--depth', type=int, default=3)
+    argp.add_argument('--locals', type=int, default=8)
+    argp.add_argument('--expr-depth', type=int, default=3)
+    argp.add_argument('--calls', type=float, default=0.1)
+    argp.add_argument('-o', '--output')
+    args = argp.parse_args()
+
+    config = GeneratorConfig(args.functions, args.statements, args.depth,
+                             args.locals, args.expr_depth, args.calls)
+    source = generate(config, args.seed)
+    if args.output is None:
+        print(source, end='')
+    else:
+        with open(args.output, 'w') as f:
+            f.write(source)
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,163 @@
+import sys
+
+# 命令の種類を表す命令コード
+# 比較を速くするため、Enumではなく整数の定数として定義する。
+class Op:
+    COPY = 0
+    ADD = 1
+    SUB = 2
+    MUL = 3
+    DIV = 4
+    LT = 5
+    LE = 6
+    GT = 7
+    GE = 8
+    EQ = 9
+    NE = 10
+    NEG = 11
+    CALL = 12
+    PHI = 13
+    GOTO = 14
+    IF = 15
+    RETURN = 16
+    DEFLABEL = 17
+    DEFLOCAL = 18
+    DEFPARAM = 19
+    DEFFUNC = 20
+
+# 命令コードと内部コード上の演算子名の対応
+op_names = {
+    Op.COPY: '=', Op.ADD: '+', Op.SUB: '-', Op.MUL: '*', Op.DIV: '/',
+    Op.LT: '<', Op.LE: '<=', Op.GT: '>', Op.GE: '>=', Op.EQ: '==', Op.NE: '!=',
+    Op.NEG: 'unary_minus', Op.CALL: 'call', Op.PHI: 'phi', Op.GOTO: 'goto',
+    Op.IF: 'if', Op.RETURN: 'return', Op.DEFLABEL: 'deflabel',
+    Op.DEFLOCAL: 'deflocal', Op.DEFPARAM: 'defparam', Op.DEFFUNC: 'deffunc',
+}
+op_codes = {name: code for code, name in op_names.items()}
+
+# 項の種類
+TERM_ID = 0
+TERM_NUM = 1
+TERM_LABEL = 2
+TERM_TYPE = 3
+term_kind_names = ('id', 'num', 'label', 'type')
+
+# 項を表すクラス
+# 項は変更不可とする。数値、ラベル、型の項は同じ値のものを一つのオブジェクトで
+# 共有する(make_num()など)。識別子の項はSSA化の際に定義ごとに一つ作成し、
+# その定義を参照する命令の間で共有する。
+# 従来のリスト表現との互換のため、term[0]で種類名、term[1]で値を参照できる。
+class Term:
+    __slots__ = ('kind', 'val')
+
+    def __init__(self, kind, val):
+        self.kind = kind
+        self.val = val
+
+    def __eq__(self, other):
+        return self is other or (other.__class__ is Term
+                                 and self.kind == other.kind
+                                 and self.val == other.val)
+
+    def __hash__(self):
+        return hash((self.kind, self.val))
+
+    def __getitem__(self, n):
+        return (term_kind_names[self.kind], self.val)[n]
+
+    def __len__(self):
+        return 2
+
+    def __repr__(self):
+        return repr([term_kind_names[self.kind], self.val])
+
+# 同じ値の数値、ラベル、型の項は一つのオブジェクトを共有する。
+_num_terms = {}
+_label_terms = {}
+_type_terms = {}
+
+# 共有する項の数の上限
+# 上限を超えたら表を作り直す。項の比較は値で行うので、共有されていない項が
+# 混在しても結果は変わらない。
+max_shared_terms = 1 << 16
+
+def shared_term(table, kind, val):
+    term = table.get(val)
+    if term is None:
+        if len(table) >= max_shared_terms:
+            table.clear()
+        term = table.setdefault(val, Term(kind, val))
+    return term
+
+def make_id(name):
+    return Term(TERM_ID, name)
+
+def make_num(value):
+    value = str(value)
+    term = _num_terms.get(value)
+    return term if term is not None else shared_term(_num_terms, TERM_NUM, value)
+
+def make_label(name):
+    return shared_term(_label_terms, TERM_LABEL, name)
+
+def make_type(name):
+    return shared_term(_type_terms, TERM_TYPE, name)
+
+# 命令を表すクラス
+# 命令の意味は"left = op(args[0], args[1], ...)"であり、opは命令コード(Op)とする。
+# 従来のリスト表現[left, op, arg1, arg2, ...]との互換のため、
+# inst[0]で左辺、inst[1]で演算子名、inst[2:]で引数を参照できる。
+class Inst:
+    __slots__ = ('left', 'op', 'args')
+
+    def __init__(self, left, op, args):
+        self.left = left
+        self.op = op
+        self.args = args
+
+    def __getitem__(self, n):
+        if n.__class__ is slice:
+            return [self.left, op_names[self.op], *self.args][n]
+        elif n == 0:
+            return self.left
+        elif n == 1:
+            return op_names[self.op]
+        elif n < 0:
+            return self[len(self) + n]
+        else:
+            return self.args[n - 2]
+
+    def __setitem__(self, n, value):
+        if n == 0:
+            self.left = value
+        elif n == 1:
+            self.op = op_codes[value]
+        else:
+            self.args[n - 2] = value
+
+    def __len__(self):
+        return len(self.args) + 2
+
+    def __repr__(self):
+        return repr([self.left, op_names[self.op], *self.args])
+
+# 命令を作成する。
+def make_inst(left, op, *args):
+    return Inst(left, op, list(args))
+
 # プログラムの全体構造を管理するクラス
 class Program:
     def __init__(self):
         self.func_list = []
         self.symtable = None
+        # デバッグ出力を行うかどうか
+        self.verbose = False
+        # 各処理の時間などを記録するもの(passreport.PassRecorder、記録しなければNone)
+        self.pass_recorder = None
+        # 大域の識別子のLLVM IRでの表記と型の表(llvmgen.operand_table()が作る)
+        self.llvm_names = None
+        # 変換中に見つけた警告のメッセージのリスト
+        self.warnings = []
 
 # 関数の構造を管理するクラス
 class Function:
@@ -16,51 +171,210 @@ class Function:
         self.entry = '__entry'
         self.end = '__end'
         self.bbtable = {}
-        self.dom = {}
+        self._dom = {}
         self.idom = {}
         self.tree = {}
         self.df = {}
+        # 基本ブロックの入口と出口で生きている変数の集合
+        self.live_in = {}
+        self.live_out = {}
         # 何らかの処理を実行中のコンテキストを保存する。
         self.context = {}
+        # ソースコード上の関数定義の範囲(開始位置, 終了位置)
+        self.source_span = None
+        # キャッシュから取り出したLLVM IRの行のリスト
+        self.llvm_ir = None
+        # 呼び出している関数名のリスト(関数を1個ずつ処理する場合に設定する)
+        self.calls = None
         
-        self.insts.insert(0, [None, 'deflabel', ['label', self.entry]])
-        self.insts[1:1] = [[p[1], 'defparam', p[0]] for p in params]
+        self.insts.insert(0, make_inst(None, Op.DEFLABEL, make_label(self.entry)))
+        self.insts[1:1] = [make_inst(p[1], Op.DEFPARAM, p[0]) for p in params]
 
+    # 解析結果を捨てる。基本ブロックと識別子表は残す。
+    def release_analysis(self):
+        self._dom = {}
+        self.idom = {}
+        self.tree = {}
+        self.df = {}
+        self.live_in = {}
+        self.live_out = {}
+
+    # 関数本体と解析結果を捨て、名前、型、引数などのシグネチャだけを残す。
+    # 関数を1個ずつ処理する場合に、LLVM IRを出力した後で使う。
+    def release(self):
+        self.release_analysis()
+        self.insts = None
+        self.bbtable = {}
+        self.symtable = None
+        self.context = {}
+        self.llvm_ir = None
+
+    # 支配集合(ブロック名 -> そのブロックを支配するブロックの集合)
+    # 支配集合はブロック数の2乗の大きさになるので、直接支配の関係(idom)
+    # だけを計算しておき、参照されたときに求める。Noneを代入すると
+    # 次の参照時に求め直す。
+    @property
+    def dom(self):
+        if self._dom is None:
+            dom = {}
+            for bbname in self.idom:
+                # 支配集合の求まっている祖先まで支配木をさかのぼる。
+                path = []
+                b = bbname
+                while b is not None and b not in dom:
+                    path.append(b)
+                    b = self.idom[b]
+                base = dom[b] if b is not None else set()
+                for b in reversed(path):
+                    base = base | {b}
+                    dom[b] = base
+            self._dom = dom
+        return self._dom
+
+    @dom.setter
+    def dom(self, value):
+        self._dom = value
+
+# 識別子表を表すクラス
+# 識別子名をキー、属性の辞書を値とする表(table)に加えて、種別('kind')ごとと
+# SSA化した変数の元の変数名('origin')ごとの索引を持ち、特定の種別の識別子を
+# 表全体を走査せずに列挙できるようにする。
+# また識別子名には登録順に小さな整数の番号を割り当てる(sym_id())。
 class SymbolTable:
+    # 索引を作る属性
+    indexed_attrs = ('kind', 'origin')
+
     def __init__(self, scope):
         self.scope = scope
         self.table = {}
+        # 属性名 -> 属性値 -> 識別子名の辞書(値はtableへの追加順の番号)
+        self.index = {attr: {} for attr in self.indexed_attrs}
+        self.order = {}
+        self.counter = 0
+        # 識別子名 -> 番号、番号 -> 識別子名
+        self.ids = {}
+        self.names = []
+
+    # 識別子名に番号を割り当てる。
+    def intern(self, name):
+        n = self.ids.get(name)
+        if n is None:
+            name = sys.intern(name)
+            n = len(self.names)
+            self.ids[name] = n
+            self.names.append(name)
+        return n
+
+    # 識別子名に割り当てた番号を返す。未登録の識別子の場合はNoneを返す。
+    def sym_id(self, name):
+        return self.ids.get(name)
+
+    # 番号に対する識別子名を返す。
+    def sym_name(self, n):
+        return self.names[n]
+
+    def add_index(self, name, attr, value):
+        if value is not None:
+            self.index[attr].setdefault(value, {})[name] = self.order[name]
+
+    def remove_index(self, name, attr, value):
+        if value is not None:
+            names = self.index[attr].get(value)
+            if names is not None:
+                names.pop(name, None)
 
     # 識別子表に新しい識別子を追加する。
+    # 既にある識別子の場合は属性を置き換える(表の中の順序は変わらない)。
     def add_sym(self, name, kind, attrs={}):
-        self.table[name] = {'kind': kind}
-        self.table[name].update(attrs)
+        old = self.table.get(name)
+        if old is not None:
+            for attr in self.indexed_attrs:
+                self.remove_index(name, attr, old.get(attr))
+        else:
+            self.intern(name)
+            self.order[name] = self.counter
+            self.counter += 1
+        entry = {'kind': kind}
+        entry.update(attrs)
+        self.table[name] = entry
+        for attr in self.indexed_attrs:
+            self.add_index(name, attr, entry.get(attr))
 
     # 識別子表から識別子を削除する。
     def delete_sym(self, name):
-        del self.table[name]
+        entry = self.table.pop(name)
+        del self.order[name]
+        for attr in self.indexed_attrs:
+            self.remove_index(name, attr, entry.get(attr))
         
     # 識別子の持つ属性を取得する。
     def get_sym(self, name, attr=None):
-        if self.table.get(name) is not None:
+        entry = self.table.get(name)
+        if entry is not None:
             if attr is not None:
-                return self.table.get(name).get(attr)
+                return entry.get(attr)
             else:
-                return self.table.get(name)
+                return entry
         return None
+
+    # 識別子の種別、型、元の変数名、LLVM IRでの名前を取得する。
+    # 識別子が識別子表にない場合はNoneを返す。
+    def get_kind(self, name):
+        entry = self.table.get(name)
+        return entry['kind'] if entry is not None else None
+
+    def get_type(self, name):
+        entry = self.table.get(name)
+        return entry.get('type') if entry is not None else None
+
+    def get_origin(self, name):
+        entry = self.table.get(name)
+        return entry.get('origin') if entry is not None else None
+
+    def get_llvm_name(self, name):
+        entry = self.table.get(name)
+        return entry.get('llvm_name') if entry is not None else None
     
     # 識別子に属性を追加する。
     # 識別子が識別子表にない場合は何もしない。
     def set_sym(self, name, attrs):
-        if self.table.get(name) is None:
-            pass
-        else:
-            self.table[name].update(attrs)
+        entry = self.table.get(name)
+        if entry is None:
+            return
+        for attr in self.indexed_attrs:
+            if attr in attrs and attrs[attr] != entry.get(attr):
+                self.remove_index(name, attr, entry.get(attr))
+                entry[attr] = attrs[attr]
+                self.add_index(name, attr, attrs[attr])
+        entry.update(attrs)
+
+    # 索引を使って、属性attrの値がvalue(タプルの場合はそのいずれか)である
+    # 識別子名のリストを登録順に返す。
+    def indexed_names(self, attr, value):
+        if type(value) is not tuple:
+            return list(self.index[attr].get(value, ()))
+        groups = [self.index[attr][v] for v in value if v in self.index[attr]]
+        if len(groups) == 1:
+            return list(groups[0])
+        merged = {}
+        for names in groups:
+            merged.update(names)
+        return sorted(merged, key=merged.get)
 
     # 特定の属性値を持つ識別子を生成するジェネレータ
+    # 索引のある属性が指定された場合は、索引から候補を求める。
     def sym_enumerator(self, **kwargs):
-        for name in self.table:
-            entry = self.get_sym(name)
+        candidates = None
+        for attr in self.indexed_attrs:
+            if attr in kwargs:
+                candidates = self.indexed_names(attr, kwargs[attr])
+                break
+        if candidates is None:
+            candidates = list(self.table)
+        for name in candidates:
+            entry = self.table.get(name)
+            if entry is None:
+                continue
             match = True
             for attr, value in kwargs.items():
                 # attr = 'kind', value = ('temp', 'ssavar'), entry = ID
@@ -0,0 +1,271 @@
+# SSA形式の内部表現を実行する実行エンジン
+#
+# clangでネイティブコードを作らずに、SSA形式に変換したプログラムをその場で
+# 実行する。各関数の基本ブロックを、命令ごとのPythonのクロージャの列に
+# 変換してから実行する。
+#
+#   program = analysis.irgen(source)
+#   print(run(program, 'app_main', 10))
+#
+# 同じプログラムの関数を何度も呼び出す場合は、load()で一度だけ変換する。
+#
+#   executable = load(program)
+#   for n in range(10):
+#       print(executable.run('app_main', n))
+#
+# 変換では次のことを前もって済ませておく。
+#   - 変数と定数は関数の実行ごとに作るフレーム(リスト)の添字に対応づける。
+#     定数の値はフレームの初期値として置いておく。
+#   - φ関数は、分岐ごとに後続ブロックのφ関数へ値を移す処理に置き換える。
+#   - 分岐先は基本ブロックの番号、呼び出し先は関数のオブジェクトにする。
+# 整数の演算結果はLLVM IRのi32と同じく32ビットの2の補数で桁あふれさせる。
+import operator
+from util import *
+
+# 32ビット符号付き整数への丸めに使う定数
+_bias = 0x80000000
+_mask = 0xffffffff
+
+# 整数を32ビット符号付き整数に丸める。
+def wrap(value):
+    return ((value + _bias) & _mask) - _bias
+
+# C言語(LLVM IRのsdiv)と同じく0方向に切り捨てる除算
+# 0による除算はZeroDivisionErrorとする。
+def c_div(a, b):
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+# 整数演算の命令コードと演算の関数
+arith_ops = {Op.ADD: operator.add, Op.SUB: operator.sub, Op.MUL: operator.mul,
+             Op.DIV: c_div}
+compare_ops = {Op.LT: operator.lt, Op.LE: operator.le, Op.GT: operator.gt,
+               Op.GE: operator.ge, Op.EQ: operator.eq, Op.NE: operator.ne}
+
+# 命令を実行するクロージャを作る関数
+# 引数はいずれもフレームの添字とする。
+def make_arith(fn, d, a, b):
+    def run(fr):
+        fr[d] = ((fn(fr[a], fr[b]) + _bias) & _mask) - _bias
+    return run
+
+def make_compare(fn, d, a, b):
+    def run(fr):
+        fr[d] = fn(fr[a], fr[b])
+    return run
+
+def make_neg(d, a):
+    def run(fr):
+        fr[d] = ((_bias - fr[a]) & _mask) - _bias
+    return run
+
+def make_copy(d, a):
+    def run(fr):
+        fr[d] = fr[a]
+    return run
+
+def make_call(d, callee, args):
+    invoke = callee.invoke
+    if len(args) == 0:
+        def run(fr):
+            fr[d] = invoke()
+    elif len(args) == 1:
+        a, = args
+        def run(fr):
+            fr[d] = invoke(fr[a])
+    elif len(args) == 2:
+        a, b = args
+        def run(fr):
+            fr[d] = invoke(fr[a], fr[b])
+    else:
+        def run(fr):
+            fr[d] = invoke(*[fr[a] for a in args])
+    return run
+
+# 分岐の際にφ関数へ値を移すクロージャを作る。移すものがなければNoneを返す。
+# φ関数は同時に評価するので、すべての値を読んでから書き込む。
+def make_move(moves):
+    if not moves:
+        return None
+    elif len(moves) == 1:
+        (d, s), = moves
+        def run(fr):
+            fr[d] = fr[s]
+    else:
+        dsts = [d for d, s in moves]
+        srcs = [s for d, s in moves]
+        def run(fr):
+            values = [fr[s] for s in srcs]
+            for d, v in zip(dsts, values):
+                fr[d] = v
+    return run
+
+# 基本ブロックの末尾の分岐を実行し、次に実行する基本ブロックの番号を返す
+# クロージャを作る。return命令は返却値をフレームのretに置き、-1を返す。
+def make_goto(target, move):
+    if move is None:
+        def run(fr):
+            return target
+    else:
+        def run(fr):
+            move(fr)
+            return target
+    return run
+
+def make_if(c, then_target, then_move, else_target, else_move):
+    def run(fr):
+        if fr[c]:
+            if then_move is not None:
+                then_move(fr)
+            return then_target
+        else:
+            if else_move is not None:
+                else_move(fr)
+            return else_target
+    return run
+
+def make_return(ret, a):
+    def run(fr):
+        fr[ret] = fr[a]
+        return -1
+    return run
+
+def make_block(ops, term):
+    ops = tuple(ops)
+    if not ops:
+        return term
+    def run(fr):
+        for op in ops:
+            op(fr)
+        return term(fr)
+    return run
+
+# 実行できる形に変換した関数
+class CompiledFunction:
+    def __init__(self, func):
+        self.name = func.name
+        self.func = func
+        # フレームの初期値(定数の値を含む)
+        self.template = []
+        # 仮引数の添字と返却値の添字
+        self.params = []
+        self.ret = None
+        # 基本ブロックを実行するクロージャ(入口ブロックが0番)
+        self.blocks = []
+
+    # 関数を実行する。
+    def invoke(self, *args):
+        fr = self.template[:]
+        for slot, value in zip(self.params, args):
+            fr[slot] = value
+        blocks = self.blocks
+        b = 0
+        while b >= 0:
+            b = blocks[b](fr)
+        return fr[self.ret]
+
+# プログラムを実行できる形に変換したもの
+class Executable:
+    def __init__(self, program):
+        self.functions = {}
+        for func in program.func_list:
+            if not func.bbtable:
+                raise ValueError('function {} is not in SSA form'
+                                 .format(func.name))
+            self.functions[func.name] = CompiledFunction(func)
+        for f in self.functions.values():
+            self.compile_function(f)
+
+    # 関数の基本ブロックをクロージャに変換する。
+    def compile_function(self, f):
+        func = f.func
+        slots = {}
+        consts = {}
+        template = f.template
+
+        def slot(term):
+            if term.kind == TERM_NUM:
+                value = wrap(int(term.val))
+                n = consts.get(value)
+                if n is None:
+                    n = consts[value] = len(template)
+                    template.append(value)
+                return n
+            n = slots.get(term.val)
+            if n is None:
+                n = slots[term.val] = len(template)
+                template.append(0)
+            return n
+
+        f.ret = len(template)
+        template.append(0)
+        order = {bbname: n for n, bbname in enumerate(func.bbtable)}
+        if order.get(func.entry) != 0:
+            raise ValueError('function {} does not start with the entry block'
+                             .format(func.name))
+
+        # 分岐先のブロックのφ関数へ値を移す組(移す先, 移す元)のリスト
+        def moves(src, dst):
+            bb = func.bbtable[dst]
+            pos = bb.pred.index(src)
+            return [(slot(i.left), slot(i.args[pos]))
+                    for i in bb.insts if i.op == Op.PHI]
+
+        for bbname, bb in func.bbtable.items():
+            ops = []
+            term = None
+            for i in bb.insts:
+                opcode = i.op
+                if opcode in arith_ops:
+                    ops.append(make_arith(arith_ops[opcode], slot(i.left),
+                                          slot(i.args[0]), slot(i.args[1])))
+                elif opcode in compare_ops:
+                    ops.append(make_compare(compare_ops[opcode], slot(i.left),
+                                            slot(i.args[0]), slot(i.args[1])))
+                elif opcode == Op.NEG:
+                    ops.append(make_neg(slot(i.left), slot(i.args[0])))
+                elif opcode == Op.COPY:
+                    ops.append(make_copy(slot(i.left), slot(i.args[0])))
+                elif opcode == Op.CALL:
+                    callee = self.functions.get(i.args[0].val)
+                    if callee is None:
+                        raise ValueError('undefined function {}'
+                                         .format(i.args[0].val))
+                    ops.append(make_call(slot(i.left), callee,
+                                         [slot(a) for a in i.args[1:]]))
+                elif opcode == Op.DEFPARAM:
+                    f.params.append(slot(i.left))
+                elif opcode == Op.GOTO:
+                    target = i.args[0].val
+                    term = make_goto(order[target],
+                                     make_move(moves(bbname, target)))
+                elif opcode == Op.IF:
+                    t, e = i.args[1].val, i.args[2].val
+                    term = make_if(slot(i.args[0]),
+                                   order[t], make_move(moves(bbname, t)),
+                                   order[e], make_move(moves(bbname, e)))
+                elif opcode == Op.RETURN:
+                    term = make_return(f.ret, slot(i.args[0]))
+                # φ関数は分岐の側で処理し、ラベルは実行しない。
+            if term is None:
+                raise ValueError('block {} of function {} has no terminator'
+                                 .format(bbname, func.name))
+            f.blocks.append(make_block(ops, term))
+
+    # 関数を実行し、返却値を返す。引数は32ビット符号付き整数に丸める。
+    def run(self, name, *args):
+        f = self.functions.get(name)
+        if f is None:
+            raise ValueError('function {} not found'.format(name))
+        if len(args) != len(f.params):
+            raise ValueError('function {} takes {} arguments ({} given)'
+                             .format(name, len(f.params), len(args)))
+        return f.invoke(*[wrap(int(a)) for a in args])
+
+# プログラムを実行できる形に変換する。
+def load(program):
+    return Executable(program)
+
+# プログラムの関数を実行し、返却値を返す。
+def run(program, name, *args):
+    return load(program).run(name, *args)
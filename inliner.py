@@ -0,0 +1,284 @@
+# 関数のインライン展開
+#
+# すべての関数をSSA形式に変換した後で、小さな関数の呼び出しを呼び出し先の
+# 本体の複製に置き換える。呼び出しの多い小さな関数からなるプログラムで、
+# 呼び出しのオーバーヘッドを減らすことを目的とする。
+#
+#   for func in program.func_list:
+#       run_passes(func)
+#   inline_functions(program, threshold=30)
+#
+# 再帰呼び出しの関係にある関数(呼び出しグラフの閉路上の関数)は展開しない。
+# 呼び出される側の関数から順に処理するので、展開される関数の本体は
+# すでに展開と後処理を済ませたものになる。
+#
+# プロファイル(pgo.apply_profile)を対応づけた関数では、一度も実行されなかった
+# 呼び出しは展開せず、実行回数の多い呼び出しは上限をhot_factor倍にして展開する。
+from classes import BasicBlock
+from util import *
+from analysis import (is_verbose, print_blocks, unique_name, run_passes,
+                      cleanup_passes)
+from pgo import block_count, hot_count, inline_counts
+
+# 展開する関数の大きさ(命令数)の既定の上限
+default_threshold = 30
+
+# 実行回数の多い呼び出しに対する上限の倍率
+hot_factor = 4
+
+# 展開によって増やせる呼び出し元の大きさ(命令数)の上限の、展開する関数の
+# 大きさの上限に対する倍率
+max_growth = 10
+
+# 大きさに数えない命令
+# 仮引数の定義は引数に置き換わる。ラベルと分岐は複製した基本ブロックごとに
+# 残るので数える(後処理のmerge_blocksでまとめられたものは数えない)。
+uncounted_ops = (Op.DEFPARAM,)
+
+# SSA形式の関数の大きさ(命令数)を返す。
+def function_size(f):
+    return sum(1 for bb in f.bbtable.values() for i in bb.insts
+               if i.op not in uncounted_ops)
+
+# 関数が呼び出している関数名の一覧を返す。
+def callees(f):
+    result = []
+    for bb in f.bbtable.values():
+        for i in bb.insts:
+            if i.op == Op.CALL and i.args[0].val not in result:
+                result.append(i.args[0].val)
+    return result
+
+# 呼び出しグラフの強連結成分を、呼び出される側が先になる順に並べたリストを返す。
+# Tarjanのアルゴリズムを、再帰の深さの制限にかからないよう明示的なスタックで行う。
+def call_graph_sccs(graph):
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    result = []
+    for root in graph:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(graph[root]))]
+        while work:
+            v, succs = work[-1]
+            for w in succs:
+                if w not in graph:
+                    continue
+                if w not in index:
+                    index[w] = lowlink[w] = len(index)
+                    stack.append(w)
+                    on_stack.add(w)
+                    work.append((w, iter(graph[w])))
+                    break
+                elif w in on_stack:
+                    lowlink[v] = min(lowlink[v], index[w])
+            else:
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    lowlink[u] = min(lowlink[u], lowlink[v])
+                if lowlink[v] == index[v]:
+                    scc = []
+                    while True:
+                        w = stack.pop()
+                        on_stack.discard(w)
+                        scc.append(w)
+                        if w == v:
+                            break
+                    result.append(scc)
+    return result
+
+# 呼び出し先の関数の本体を、呼び出し元の関数の基本ブロックbbnameのpos番目の
+# 呼び出し命令の位置に展開する。
+# 呼び出し命令の後の命令は新しい基本ブロック(継続ブロック)に移し、
+# 継続ブロックの名前を返す。
+def inline_call(f, bbname, pos, callee):
+    bb = f.bbtable[bbname]
+    call = bb.insts[pos]
+    n = f.context.get('inline_count', 0)
+    f.context['inline_count'] = n + 1
+    prefix = '{}.{}.'.format(callee.name, n)
+
+    # 呼び出し先のラベルと変数の名前を、呼び出し元で重ならない名前に対応づける。
+    labels = {}
+    for name in callee.bbtable:
+        labels[name] = unique_name(f, prefix + name)
+        f.symtable.add_sym(labels[name], 'label')
+    cont = unique_name(f, prefix + 'cont')
+    f.symtable.add_sym(cont, 'label')
+
+    values = {}
+    params = [i.left.val for i in callee.bbtable[callee.entry].insts
+              if i.op == Op.DEFPARAM]
+    for param, arg in zip(params, call.args[1:]):
+        values[param] = arg
+    origins = {}
+    for name, cbb in callee.bbtable.items():
+        for i in cbb.insts:
+            if i.left is None or i.left.kind != TERM_ID or i.op == Op.DEFPARAM:
+                continue
+            origin = callee.symtable.get_origin(i.left.val)
+            if origin not in origins:
+                # 一時変数は一時変数のまま、それ以外は局所変数として登録する。
+                kind = callee.symtable.get_kind(origin)
+                origins[origin] = unique_name(f, prefix + origin)
+                f.symtable.add_sym(origins[origin],
+                                   'temp' if kind == 'temp' else 'localvar',
+                                   {'type': callee.symtable.get_type(origin)})
+            new_name = unique_name(f, prefix + i.left.val)
+            f.symtable.add_sym(new_name, 'ssavar',
+                               {'type': callee.symtable.get_type(i.left.val),
+                                'bb': labels[name], 'origin': origins[origin]})
+            values[i.left.val] = make_id(new_name)
+
+    def clone_term(term):
+        if term.kind == TERM_ID:
+            return values.get(term.val, term)
+        elif term.kind == TERM_LABEL:
+            return make_label(labels[term.val])
+        return term
+
+    # 呼び出し先の基本ブロックを複製する。
+    # 出口ブロックのreturn命令は継続ブロックへの分岐に置き換え、
+    # 返却値を呼び出し命令の結果の代わりに使う。
+    clones = []
+    result = None
+    for name, cbb in callee.bbtable.items():
+        nbb = BasicBlock(labels[name])
+        for i in cbb.insts:
+            if i.op == Op.DEFPARAM:
+                continue
+            elif i.op == Op.RETURN:
+                result = clone_term(i.args[0])
+                nbb.insts.append(make_inst(None, Op.GOTO, make_label(cont)))
+            else:
+                left = values[i.left.val] if i.left is not None else None
+                nbb.insts.append(make_inst(left, i.op,
+                                           *[clone_term(a) for a in i.args]))
+        nbb.pred = [labels[p] for p in cbb.pred]
+        nbb.succ = [labels[s] for s in cbb.succ]
+        clones.append(nbb)
+    inline_counts(f, bbname, callee, labels, cont)
+    labels_entry = labels[callee.entry]
+    labels_end = labels[callee.end]
+    clones[0].pred = [bbname]
+    [c for c in clones if c.name == labels_end][0].succ = [cont]
+
+    # 呼び出し命令の後の命令を継続ブロックに移す。
+    cbb = BasicBlock(cont)
+    cbb.insts = [make_inst(None, Op.DEFLABEL, make_label(cont))] + bb.insts[pos + 1:]
+    cbb.pred = [labels_end]
+    cbb.succ = bb.succ
+    for succ in cbb.succ:
+        pred = f.bbtable[succ].pred
+        pred[pred.index(bbname)] = cont
+    for i in cbb.insts:
+        if i.left is not None and i.left.kind == TERM_ID:
+            f.symtable.set_sym(i.left.val, {'bb': cont})
+    bb.insts[pos:] = [make_inst(None, Op.GOTO, make_label(labels_entry))]
+    bb.succ = [labels_entry]
+
+    bbtable = {}
+    for k, v in f.bbtable.items():
+        bbtable[k] = v
+        if k == bbname:
+            for c in clones:
+                bbtable[c.name] = c
+            bbtable[cont] = cbb
+    f.bbtable = bbtable
+
+    # 呼び出し命令の結果の参照を返却値に置き換える。
+    name = call.left.val
+    for b in f.bbtable.values():
+        for i in b.insts:
+            args = i.args
+            for k in range(len(args)):
+                if args[k].kind == TERM_ID and args[k].val == name:
+                    args[k] = result
+    f.symtable.delete_sym(name)
+    return cont
+
+# 呼び出しグラフの強連結成分sccsから、再帰呼び出しの関係にある関数名の集合を返す。
+def recursive_functions(graph, sccs):
+    recursive = set()
+    for scc in sccs:
+        if len(scc) > 1 or scc[0] in graph[scc[0]]:
+            recursive.update(scc)
+    return recursive
+
+# 関数を展開できるかどうか
+# SSA形式になっていて(キャッシュから取り出した関数は対象外)、出口ブロックに
+# 到達し、再帰呼び出しの関係になく、大きさが上限以下のものに限る。
+def is_inlinable(callee, recursive, threshold):
+    return (callee.bbtable and callee.end in callee.bbtable
+            and callee.name not in recursive
+            and function_size(callee) <= threshold)
+
+# 基本ブロックbbnameにある呼び出しに対する展開の上限を返す。
+# hotはpgo.hot_count()の値で、プロファイルがなければNoneとする。
+def call_site_threshold(f, bbname, threshold, hot):
+    count = block_count(f, bbname) if hot is not None else None
+    if count is None:
+        return threshold
+    elif count == 0:
+        return -1
+    elif count >= hot:
+        return threshold * hot_factor
+    return threshold
+
+# 関数fの中の呼び出しのうち、functions(関数名 -> 関数)にある関数の呼び出しを
+# インライン展開し、展開した呼び出しの数を返す。recursiveは再帰呼び出しの
+# 関係にある関数名の集合、hotはpgo.hot_count()の値とする。
+# 展開によって増える大きさの合計は、threshold * max_growthまでとする。
+# 展開を行った場合は後処理(cleanup_passes)を実行する。
+def inline_calls(f, functions, recursive, threshold, hot=None):
+    count = 0
+    budget = threshold * max_growth
+    for bbname in list(f.bbtable.keys()):
+        # 展開した後は継続ブロックの残りの命令を調べる。
+        pos = 0
+        while True:
+            limit = call_site_threshold(f, bbname, threshold, hot)
+            insts = f.bbtable[bbname].insts
+            while pos < len(insts):
+                i = insts[pos]
+                if i.op == Op.CALL:
+                    callee = functions.get(i.args[0].val)
+                    if (callee is not None and callee is not f
+                        and is_inlinable(callee, recursive, limit)
+                        and function_size(callee) <= budget):
+                        break
+                pos += 1
+            if pos == len(insts):
+                break
+            budget -= function_size(callee)
+            bbname = inline_call(f, bbname, pos, callee)
+            pos = 1
+            count += 1
+    if count > 0:
+        run_passes(f, cleanup_passes)
+        if is_verbose(f):
+            print_blocks(f, 'inline ({} calls)'.format(count))
+    return count
+
+# プログラム中の関数呼び出しをインライン展開し、展開した呼び出しの数を返す。
+# 展開を行った関数には後処理(cleanup_passes)を実行する。
+def inline_functions(program, threshold=default_threshold):
+    functions = {f.name: f for f in program.func_list}
+    graph = {f.name: callees(f) for f in program.func_list}
+    sccs = call_graph_sccs(graph)
+    recursive = recursive_functions(graph, sccs)
+    hot = hot_count(program)
+
+    total = 0
+    for scc in sccs:
+        for name in scc:
+            f = functions[name]
+            if f.bbtable:
+                total += inline_calls(f, functions, recursive, threshold, hot)
+    return total
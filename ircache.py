@@ -0,0 +1,220 @@
+# 関数単位のLLVM IRのキャッシュ
+#
+# 関数のトークン列、呼び出している関数のシグネチャ、コンパイラのバージョンから
+# キーを作り、そのキーで生成済みのLLVM IRをディスクに保存する。
+# キーが一致する関数はSSA化やLLVM IRの生成を行わずにキャッシュの内容を使う。
+import hashlib
+import os
+import sys
+from lexer import tokenize
+from util import *
+from inliner import call_graph_sccs
+
+# キャッシュファイルの拡張子
+entry_suffix = '.ll'
+
+# キャッシュの大きさの既定の上限(バイト)
+default_max_size = 256 * 1024 * 1024
+
+# コンパイラのバージョン
+# コンパイラ自身のソースコードのハッシュ値とし、コンパイラが変わったら
+# キャッシュの内容がすべて無効になるようにする。
+_compiler_version = None
+
+compiler_modules = ('lexer', 'parser', 'classes', 'util', 'analysis',
+                    'llvmgen', 'session', 'ircache', 'inliner', 'pgo')
+
+def compiler_version():
+    global _compiler_version
+    if _compiler_version is None:
+        h = hashlib.sha256()
+        for name in compiler_modules:
+            module = sys.modules.get(name)
+            path = getattr(module, '__file__', None)
+            if path is not None and os.path.exists(path):
+                with open(path, 'rb') as f:
+                    h.update(f.read())
+            else:
+                h.update(name.encode())
+        _compiler_version = h.hexdigest()
+    return _compiler_version
+
+# 関数が呼び出している関数名の一覧を返す。
+def called_functions(func):
+    if func.insts is None:
+        # 本体を捨てた関数(Function.release())は呼び出し先の一覧を持つ。
+        return list(func.calls or [])
+    result = []
+    for inst in func.insts:
+        if op(inst) == Op.CALL:
+            name = id_name(right(inst, 1))
+            if name not in result:
+                result.append(name)
+    return result
+
+# キーの計算に使う、プログラム中の関数ごとのハッシュ値
+# 関数のトークン列のハッシュ値と、関数から直接または間接に呼び出す関数全体の
+# ハッシュ値を、関数ごとに一度だけ求めて覚えておく。
+# 関数を1個ずつ処理する場合は、その時点までに定義された関数だけを対象とする。
+class ProgramHashes:
+    def __init__(self, program, source):
+        self.program = program
+        self.source = source
+        # 関数名 -> 関数(program.func_listに追加された関数を順に登録する)
+        self.functions = {}
+        self.registered = 0
+        # 関数名 -> トークン列のハッシュ値
+        self.bodies = {}
+        # 関数名 -> 呼び出す関数全体のハッシュ値
+        self.closures = {}
+
+    # 関数名に対する関数を返す。プログラムになければNoneを返す。
+    def function(self, name):
+        func_list = self.program.func_list
+        if self.registered < len(func_list):
+            for f in func_list[self.registered:]:
+                self.functions[f.name] = f
+            self.registered = len(func_list)
+        return self.functions.get(name)
+
+    # 関数のトークン列のハッシュ値を返す。
+    def body(self, func):
+        digest = self.bodies.get(func.name)
+        if digest is None:
+            h = hashlib.sha256()
+            start, end = func.source_span
+            for tok in tokenize(self.source[start:end]):
+                h.update('{}\0{}\0'.format(*tok).encode())
+            digest = self.bodies[func.name] = h.hexdigest()
+        return digest
+
+    # 関数nameと、そこから直接または間接に呼び出す関数のトークン列全体の
+    # ハッシュ値を返す。プログラムにない関数ならNoneを返す。
+    # まだ求めていない関数の呼び出しグラフの強連結成分ごとに、呼び出される側
+    # から順に、成分の関数のトークン列と成分の外の呼び出し先のハッシュ値を合わせる。
+    def closure(self, name):
+        if name in self.closures or self.function(name) is None:
+            return self.closures.get(name)
+        graph = {}
+        work = [name]
+        while work:
+            n = work.pop()
+            if n in graph or n in self.closures or self.function(n) is None:
+                continue
+            graph[n] = called_functions(self.function(n))
+            work.extend(graph[n])
+        for scc in call_graph_sccs(graph):
+            h = hashlib.sha256()
+            for n in sorted(scc):
+                h.update('{}\0{}\0'.format(n, self.body(self.function(n))).encode())
+            outside = {c for n in scc for c in graph[n]} - set(scc)
+            for n in sorted(outside):
+                digest = self.closures.get(n)
+                if digest is not None:
+                    h.update('{}\0{}\0'.format(n, digest).encode())
+            digest = h.hexdigest()
+            for n in scc:
+                self.closures[n] = digest
+        return self.closures[name]
+
+class IRCache:
+    def __init__(self, cache_dir, max_size=default_max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # 最後にキーを求めたプログラムの関数ごとのハッシュ値
+        self.hashes = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def program_hashes(self, program, source):
+        if (self.hashes is None or self.hashes.program is not program
+            or self.hashes.source is not source):
+            self.hashes = ProgramHashes(program, source)
+        return self.hashes
+
+    # 関数に対するキャッシュのキーを求める。
+    # sourceは関数を含むソースコード全体、optionsはコード生成に影響する
+    # オプションを表す文字列とする。
+    # calleesが真の場合は、インライン展開で関数の本体が変わりうるので、
+    # 直接または間接に呼び出す関数のトークン列もキーに含める。
+    # トークン列のハッシュ値は同じプログラムの関数の間で共有する(ProgramHashes)。
+    def function_key(self, func, source, options='', callees=False):
+        hashes = self.program_hashes(func.program, source)
+        h = hashlib.sha256()
+        h.update(compiler_version().encode())
+        h.update(options.encode())
+        h.update('{} {}'.format(func.ftype, func.name).encode())
+        h.update(hashes.body(func).encode())
+        if callees:
+            for name in called_functions(func):
+                digest = hashes.closure(name)
+                if digest is not None:
+                    h.update('{}\0{}\0'.format(name, digest).encode())
+        # 呼び出し先のシグネチャ(返値型と引数の数)
+        symtable = func.program.symtable
+        for name in called_functions(func):
+            h.update('{}:{}:{}\0'.format(name,
+                                         symtable.get_sym(name, 'type'),
+                                         symtable.get_sym(name, 'nparams'))
+                     .encode())
+        return h.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key + entry_suffix)
+
+    # キーに対するLLVM IRの行のリストを返す。キャッシュにない場合はNoneを返す。
+    def load(self, key):
+        path = self.entry_path(key)
+        try:
+            with open(path) as f:
+                lines = f.read().split('\n')
+        except OSError:
+            self.misses += 1
+            return None
+        # 最終使用時刻を更新してLRUの順番を保つ。
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return lines
+
+    # キーに対するLLVM IRの行のリストを保存する。
+    def store(self, key, lines):
+        path = self.entry_path(key)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(tmp, mode='w') as f:
+                f.write('\n'.join(lines))
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    # キャッシュの大きさが上限を超えていれば、最後に使われた時刻の古い順に
+    # エントリを削除し、上限の9割以下にする。削除したエントリの数を返す。
+    def evict(self):
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for e in it:
+                if e.name.endswith(entry_suffix) and e.is_file():
+                    st = e.stat()
+                    entries.append((st.st_mtime, st.st_size, e.path))
+                    total += st.st_size
+        if total <= self.max_size:
+            return 0
+        entries.sort()
+        removed = 0
+        limit = self.max_size * 9 // 10
+        for mtime, size, path in entries:
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
@@ -1,3 +1,8 @@
+import hashlib
+import importlib.util
+import os
+import sys
+import threading
 import ply.lex as lex
 
 # 予約語のリスト
@@ -64,19 +69,116 @@ def t_newline(t):
 t_ignore = ' \t'
 
 # エラー発生時の処理の定義
+# 字句解析器にerrorsのリストが設定されていれば、メッセージをそこに記録する。
 def t_error(t):
-    print("Illegal character {}"
-          .format(t.value[0]))
+    message = "Illegal character {}".format(t.value[0])
+    errors = getattr(t.lexer, 'errors', None)
+    if errors is None:
+        print(message)
+    else:
+        errors.append(message)
     t.lexer.skip(1)
 
-# 字句解析器の構築
-lexer = lex.lex(debug=False)
+# 構築済みの字句解析器
+_lexer = None
+_lexer_lock = threading.Lock()
+
+# 字句規則のハッシュ値を求める。
+# 規則が変わるとハッシュ値が変わるので、永続化したテーブルのキーとして使う。
+def lexer_signature():
+    h = hashlib.sha256()
+    h.update(lex.__tabversion__.encode())
+    h.update(repr(sorted(reserved.items())).encode())
+    h.update(' '.join(tokens).encode())
+    for name, value in globals().items():
+        if name.startswith('t_'):
+            rule = value.__doc__ if callable(value) else value
+            h.update('{}={}'.format(name, rule).encode())
+    return h.hexdigest()[:16]
+
+# ファイルに保存したテーブルをモジュールとして読み込む。
+# 読み込めない場合はNoneを返す。
+def load_table_module(name, path):
+    if not os.path.exists(path):
+        return None
+    try:
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    except Exception:
+        return None
+
+# 一時ディレクトリに書き出したテーブルをキャッシュディレクトリに移動する。
+# 複数のプロセスが同時に書き込んでも壊れたファイルが見えないようにする。
+def install_table_file(tmpdir, filename, cache_dir):
+    try:
+        os.replace(os.path.join(tmpdir, filename),
+                   os.path.join(cache_dir, filename))
+    except OSError:
+        pass
+    finally:
+        for f in os.listdir(tmpdir):
+            os.remove(os.path.join(tmpdir, f))
+        os.rmdir(tmpdir)
+
+# 字句解析器を構築する。
+# cache_dirを指定した場合は字句解析テーブル(lextab)をそのディレクトリに
+# 保存し、次回以降のプロセスではテーブルを読み込むだけにする。
+def build_lexer(cache_dir=None):
+    module = sys.modules[__name__]
+    if cache_dir is None:
+        return lex.lex(module=module, debug=False)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tabname = 'lextab_{}'.format(lexer_signature())
+    tabfile = os.path.join(cache_dir, tabname + '.py')
+    lextab = load_table_module(tabname, tabfile)
+    if lextab is not None:
+        return lex.lex(module=module, optimize=True, lextab=lextab)
+
+    # tempfileの読み込みは遅いので、テーブルを生成するときだけ読み込む。
+    import tempfile
+    tmpdir = tempfile.mkdtemp(dir=cache_dir)
+    lexobj = lex.lex(module=module, optimize=True, lextab=tabname,
+                     outputdir=tmpdir)
+    install_table_file(tmpdir, tabname + '.py', cache_dir)
+    return lexobj
+
+# 構築済みの字句解析器を返す。
+# 字句解析器は最初に呼ばれたときに一度だけ構築する。
+def get_lexer(cache_dir=None):
+    global _lexer
+    with _lexer_lock:
+        if _lexer is None:
+            _lexer = build_lexer(cache_dir)
+    return _lexer
+
+# 構築済みの字句解析器を破棄する。
+def reset_lexer():
+    global _lexer
+    _lexer = None
+
+# 文字列を字句解析し、(トークン名, 値)のリストを返す。
+# 字句解析のエラーは構文解析で報告するので、ここでは捨てる。
+def tokenize(data):
+    lexer = get_lexer().clone()
+    lexer.errors = []
+    lexer.input(data)
+    result = []
+    while True:
+        tok = lexer.token()
+        if not tok:
+            break
+        result.append((tok.type, tok.value))
+    return result
 
 # 字句解析器のテスト用コード
 if __name__ == '__main__':
     data = '''
     int foo(int x, int y) {return x + y;}
     '''
+    lexer = get_lexer()
     lexer.input(data)
     while True:
         tok = lexer.token()
@@ -1,11 +1,18 @@
 from util import *
+from pgo import branch_weights, entry_count
+
+llvm_type_map = {'int': 'i32', 'boolean': 'i1'}
+llvm_binop = {Op.ADD: 'add', Op.SUB: 'sub', Op.MUL: 'mul', Op.DIV: 'sdiv'}
+llvm_relop = {Op.LT: 'slt', Op.LE: 'sle', Op.GT: 'sgt', Op.GE: 'sge',
+              Op.EQ: 'eq', Op.NE: 'ne'}
 
 # 項に対するLLM表現を返す。
 def llvm_id(func, value):
-    if func.symtable.get_sym(value) is not None:
-        return func.symtable.get_sym(value, 'llvm_name')
-    elif func.program.symtable.get_sym(value) is not None:
-        return func.program.symtable.get_sym(value, 'llvm_name')
+    entry = func.symtable.get_sym(value)
+    if entry is None:
+        entry = func.program.symtable.get_sym(value)
+    if entry is not None:
+        return entry.get('llvm_name')
     else:
         return None
 
@@ -13,7 +20,6 @@ def llvm_num(func, value):
     return value
 
 def llvm_type(func, value):
-    llvm_type_map = {'int': 'i32', 'boolean': 'i1'}
     return llvm_type_map[value]
 
 def llvm_label(func, value):
@@ -31,121 +37,284 @@ def llvm_term(func, term):
     else:
         return tval(term)
 
-# φ関数引数のLLVM表現を構築する。
-def create_phi_arg(func, terms):
-    result = []
-    for pos, t in enumerate(terms):
-        if is_id(t):
-            bb = func.symtable.get_sym(id_name(t), 'bb')
-            result.append([llvm_term(func, t),
-                           '%{}'.format(llvm_label(func, bb))])
-        elif is_num(t):
-            # 数値の場合は、ファイ関数の引数の位置に相当する先行ブロックから
-            # 到達するものと考える。
-            curbb = func.context['current_bb']
-            pred_bb = func.bbtable[curbb].pred[pos]
-            result.append([llvm_term(func, t),
-                           '%{}'.format(llvm_label(func, func.bbtable[pred_bb].name))])
-        else:
-            print('WARNING: invalid phi arg {}'.format(t))
-            result.append([])
-    return result
+# 識別子表にある識別子のLLVM IRでの表記と型の表を作る。
+# 識別子名 -> (LLVM IRでの名前, LLVM IRでの型)の辞書を返す。
+def symtable_operands(symtable):
+    names = {}
+    for name, entry in symtable.table.items():
+        llvm_name = entry.get('llvm_name')
+        if llvm_name is not None:
+            names[name] = (llvm_name, llvm_type_map.get(entry.get('type')))
+    return names
+
+# 関数内で参照する識別子のLLVM IRでの表記と型の表を作る。
+# 命令ごとに識別子表を引き直さないよう、関数ごとに一度だけ作成する。
+# 大域の識別子(関数名)の表はプログラムごとに一度だけ作成してprogram.llvm_names
+# に置き、関数ごとには関数の識別子表の分と、呼び出している関数の分だけを加える。
+def operand_table(func):
+    program = func.program
+    if program.llvm_names is None:
+        program.llvm_names = symtable_operands(program.symtable)
+    global_names = program.llvm_names
+    names = symtable_operands(func.symtable)
+    for bb in func.bbtable.values():
+        for i in bb.insts:
+            if i.op == Op.CALL:
+                callee = i.args[0].val
+                if callee not in names and callee in global_names:
+                    names[callee] = global_names[callee]
+    return names
+
+# 項のLLVM IRでの表記を返す。
+def operand(names, term):
+    if term.kind == TERM_ID:
+        entry = names.get(term.val)
+        return entry[0] if entry is not None else str(None)
+    else:
+        return term.val
+
+# 項のLLVM IRでの型を返す。数値の型は仕様からi32固定とする。
+def operand_type(names, term):
+    if term.kind == TERM_ID:
+        return names[term.val][1]
+    else:
+        return 'i32'
+
+# 命令コードごとにLLVM IRの1行を作成する関数
+# 関数、識別子の表、命令を受け取り、出力する行を返す。
+def emit_deflabel(func, names, inst):
+    return '{}:'.format(inst.args[0].val)
+
+def emit_goto(func, names, inst):
+    return '    br label %{}'.format(inst.args[0].val)
+
+# プロファイルから分岐の重みがわかれば、!prof branch_weightsを付ける。
+# 条件が数値の場合は、boolean型の変数を定数に畳み込んだものなのでi1とする。
+# 分岐先の辺はφ関数のために両方残す。
+def emit_if(func, names, inst):
+    cond, then_label, else_label = inst.args
+    if cond.kind == TERM_ID:
+        cond_type, cond_value = operand_type(names, cond), operand(names, cond)
+    else:
+        cond_type, cond_value = 'i1', int(int(cond.val) != 0)
+    line = ('    br {} {}, label %{}, label %{}'
+            .format(cond_type, cond_value, then_label.val, else_label.val))
+    weights = branch_weights(func, func.context.get('current_bb'),
+                             then_label.val, else_label.val)
+    if weights is not None:
+        line += ', !prof !{{!"branch_weights", i32 {}, i32 {}}}'.format(*weights)
+    return line
+
+# φ関数の引数は、引数の位置に相当する先行ブロックから到達するものとする。
+def emit_phi(func, names, inst):
+    pred = func.bbtable[func.context['current_bb']].pred
+    argstr = ', '.join('[{}, %{}]'.format(operand(names, t), pred[pos])
+                       for pos, t in enumerate(inst.args))
+    return ('    {} = phi {} {}'
+            .format(operand(names, inst.left), operand_type(names, inst.left),
+                    argstr))
+
+def emit_return(func, names, inst):
+    value = inst.args[0]
+    return '    ret {} {}'.format(operand_type(names, value), operand(names, value))
+
+def emit_call(func, names, inst):
+    argstr = ', '.join('{} {}'.format(operand_type(names, a), operand(names, a))
+                       for a in inst.args[1:])
+    return ('    {} = call i32 {} ({})'
+            .format(operand(names, inst.left), operand(names, inst.args[0]),
+                    argstr))
+
+def emit_binop(func, names, inst):
+    a1, a2 = inst.args
+    opname = llvm_binop[inst.op]
+    if inst.op == Op.MUL:
+        # 2のべき乗の定数との乗算は左シフトにする。
+        # nsw等のフラグを付けないので、桁あふれした場合の結果も乗算と同じになる。
+        if a1.kind == TERM_NUM and a2.kind != TERM_NUM:
+            a1, a2 = a2, a1
+        shift = power_of_two_exponent(a2)
+        if shift is not None:
+            opname, a2 = 'shl', make_num(shift)
+    return ('    {} = {} {} {}, {}'
+            .format(operand(names, inst.left), opname,
+                    operand_type(names, a1), operand(names, a1),
+                    operand(names, a2)))
+
+# 項が2のべき乗の数値であれば、その指数を返す。そうでなければNoneを返す。
+def power_of_two_exponent(term):
+    if term.kind != TERM_NUM:
+        return None
+    value = int(term.val)
+    if value > 0 and value & (value - 1) == 0:
+        return value.bit_length() - 1
+    return None
+
+def emit_relop(func, names, inst):
+    a1, a2 = inst.args
+    return ('    {} = icmp {} {} {}, {}'
+            .format(operand(names, inst.left), llvm_relop[inst.op],
+                    operand_type(names, a1), operand(names, a1),
+                    operand(names, a2)))
+
+# 単項マイナスは0からの減算命令に置き換える。
+def emit_neg(func, names, inst):
+    a1 = inst.args[0]
+    return ('    {} = sub {} 0, {}'
+            .format(operand(names, inst.left), operand_type(names, a1),
+                    operand(names, a1)))
+
+# コピー文をLLVM IRでは表現できない(?)ようなので、
+# ゼロとの加算命令に置き換える。
+# 通常の処理の一覧(analysis.default_passes)ではコピー伝播ですべての
+# コピー文を削除するので、コピー伝播を含まない処理の一覧を使った場合だけ使われる。
+# 数値のコピーはコピー先の型に合わせる(boolean型の定数の場合はi1)。
+def emit_copy(func, names, inst):
+    a1 = inst.args[0]
+    return ('    {} = add {} {}, 0'
+            .format(operand(names, inst.left), operand_type(names, inst.left),
+                    operand(names, a1)))
+
+# 命令コードからLLVM IRを作成する関数への対応表
+# 表にない命令(仮引数の定義など)は出力しない。
+emitters = {
+    Op.DEFLABEL: emit_deflabel,
+    Op.GOTO: emit_goto,
+    Op.IF: emit_if,
+    Op.PHI: emit_phi,
+    Op.RETURN: emit_return,
+    Op.CALL: emit_call,
+    Op.NEG: emit_neg,
+    Op.COPY: emit_copy,
+}
+emitters.update({code: emit_binop for code in llvm_binop})
+emitters.update({code: emit_relop for code in llvm_relop})
 
 # ひとつの命令をLLVM IRに変換し出力する。
 def gen_inst(func, inst, result):
-    llvm_binop = {'+': 'add', '-': 'sub', '*': 'mul', '/': 'sdiv'}
-    llvm_relop = {'<': 'slt', '<=': 'sle', '>': 'sgt', '>=': 'sge', '==': 'eq', '!=': 'ne'}
-
-    if op(inst) == 'deflabel':
-        result.append('{}:'.format(llvm_term(func, right(inst, 1))))
-    elif op(inst) == 'defparam':
-        pass
-    elif op(inst) == 'goto':
-        result.append('    br label %{}'.format(llvm_term(func, right(inst, 1))))
-    elif op(inst) == 'if':
-        result.append('    br {} {}, label %{}, label %{}'
-                      .format(llvm_type(func, term_type(func, right(inst, 1))),
-                              llvm_term(func, right(inst, 1)),
-                              llvm_term(func, right(inst, 2)),
-                              llvm_term(func, right(inst, 3))))
-    elif op(inst) == 'phi':
-        phiarg = create_phi_arg(func, right(inst))
-        argstr = []
-        for a in phiarg:
-            argstr.append('[{}, {}]'.format(*a))
-        result.append('    {} = phi {} {}'
-                      .format(llvm_term(func, left(inst)),
-                              llvm_type(func, term_type(func, left(inst))),
-                              ', '.join(argstr)))
-
-    elif op(inst) == 'return':
-        result.append('    ret {} {}'
-                      .format(llvm_type(func, term_type(func, right(inst, 1))),
-                              llvm_term(func, right(inst, 1))))
-    elif op(inst) == 'call':
-        argstr = []
-        for a in right(inst)[1:]:
-            argstr.append('{} {}'.format(llvm_type(func, term_type(func, a)),
-                                         llvm_term(func, a)))
-        result.append('    {} = call i32 {} ({})'
-                      .format(llvm_term(func, left(inst)),
-                              llvm_term(func, right(inst, 1)),
-                              ', '.join(argstr)))
-    elif op(inst) in llvm_binop:
-        result.append('    {} = {} {} {}, {}'
-                      .format(llvm_term(func, left(inst)),
-                              llvm_binop[op(inst)],
-                              llvm_type(func, term_type(func, right(inst, 1))),
-                              llvm_term(func, right(inst, 1)),
-                              llvm_term(func, right(inst, 2))))
-    elif op(inst) in llvm_relop:
-        result.append('    {} = icmp {} {} {}, {}'
-                      .format(llvm_term(func, left(inst)),
-                              llvm_relop[op(inst)],
-                              llvm_type(func, term_type(func, right(inst, 1))),
-                              llvm_term(func, right(inst, 1)),
-                              llvm_term(func, right(inst, 2))))
-    elif op(inst) == '=':
-        # コピー文をLLVM IRでは表現できない(?)ようなので、
-        # ゼロとの加算命令に置き換える。
-        result.append('    {} = {} {} {}, {}'
-                      .format(llvm_term(func, left(inst)),
-                              llvm_binop['+'],
-                              llvm_type(func, term_type(func, right(inst, 1))),
-                              llvm_term(func, right(inst, 1)),
-                              llvm_num(func, '0')))
+    names = func.context.get('llvm_names')
+    if names is None:
+        names = operand_table(func)
+    emitter = emitters.get(inst.op)
+    if emitter is not None:
+        result.append(emitter(func, names, inst))
 
-# LLVM IRを生成する。
-def llvmgen(p):
-    # LLVM IRの命名規則にしたがった識別子名を登録する。
+# LLVM IRの命名規則にしたがった識別子名を登録する。
+# 名前のない一時変数(%0, %1, ...)は関数内に現れる順に番号を付ける必要が
+# あるので、命令を移動する最適化の後でも出力する順に番号を付ける。
+def assign_llvm_names(p):
     for item in p.symtable.sym_enumerator(kind='func'):
         p.symtable.set_sym(item, {'llvm_name': '@{}'.format(item)})
+    p.llvm_names = None
     for func in p.func_list:
-        counter = 0
-        symtable = func.symtable
-        for item in func.symtable.sym_enumerator(kind='ssavar'):
-            origin = func.symtable.get_sym(item, 'origin')
-            if func.symtable.get_sym(origin, 'kind') == 'temp':
-                func.symtable.set_sym(item, {'llvm_name': '%{}'.format(counter)})
+        assign_function_llvm_names(func)
+
+# 関数内の変数のLLVM IRでの名前を登録する。
+def assign_function_llvm_names(func):
+    symtable = func.symtable
+    counter = 0
+    kinds = {}
+    for bb in func.bbtable.values():
+        for i in bb.insts:
+            if i.left is None or i.left.kind != TERM_ID:
+                continue
+            # llvm_nameは索引のない属性なので、エントリを直接更新する。
+            entry = symtable.get_sym(i.left.val)
+            if entry is None or entry['kind'] != 'ssavar':
+                continue
+            origin = entry['origin']
+            kind = kinds.get(origin)
+            if kind is None:
+                kind = kinds[origin] = symtable.get_kind(origin)
+            if kind == 'temp':
+                entry['llvm_name'] = '%' + str(counter)
                 counter += 1
-            elif func.symtable.get_sym(origin, 'kind') in ('localvar', 'param'):
-                func.symtable.set_sym(item, {'llvm_name': '%{}'.format(item)})
+            elif kind in ('localvar', 'param'):
+                entry['llvm_name'] = '%' + i.left.val
+
+# 基本ブロックの実行回数を数える配列と、基本ブロック名を並べた文字列の
+# グローバル変数名(ランタイムコードから参照する)
+def counters_name(fname):
+    return '__microc_prof_{}'.format(fname)
+
+def counter_names_name(fname):
+    return '__microc_prof_names_{}'.format(fname)
+
+# 計測用の関数の前に置くグローバル変数の定義を返す。
+# 基本ブロック名の文字列は名前をNUL文字で区切り、末尾に空の名前を置く。
+def counter_globals(func):
+    n = len(func.bbtable)
+    names = ''.join('{}\\00'.format(k) for k in func.bbtable) + '\\00'
+    size = sum(len(k) + 1 for k in func.bbtable) + 1
+    return ['@{} = global [{} x i64] zeroinitializer'
+            .format(counters_name(func.name), n),
+            '@{} = constant [{} x i8] c"{}"'
+            .format(counter_names_name(func.name), size, names)]
 
+# k番目の基本ブロックの実行回数を1増やす命令の行を返す。
+# 変数名は'.'で始め、MicroCの識別子から作る名前と重ならないようにする。
+# 型付きポインタを使うので、LLVM 16以前を前提とする(README参照)。
+def counter_lines(func, k):
+    n = len(func.bbtable)
+    ptr = ('i64* getelementptr inbounds ([{0} x i64], [{0} x i64]* @{1}, '
+           'i64 0, i64 {2})'.format(n, counters_name(func.name), k))
+    return ['    %.prof.{} = load i64, {}'.format(k, ptr),
+            '    %.prof.{0}.inc = add i64 %.prof.{0}, 1'.format(k),
+            '    store i64 %.prof.{}.inc, {}'.format(k, ptr)]
+
+# ひとつの関数のLLVM IRを1行ずつ生成するジェネレータ
+# instrumentが真なら、各基本ブロックのφ関数の後に実行回数を数える命令を置く。
+# プロファイルから呼び出し回数がわかれば、!prof function_entry_countを付ける。
+def function_lines(func, instrument=False):
+    names = operand_table(func)
+    func.context['llvm_names'] = names
+    if instrument:
+        yield from counter_globals(func)
+    argstr = ', '.join('{} {}'.format(llvm_type_map[type_name(ptype)],
+                                      operand(names, pvar))
+                       for ptype, pvar in func.params)
+    prof = ''
+    count = entry_count(func)
+    if count is not None:
+        prof = ' !prof !{{!"function_entry_count", i64 {}}}'.format(count)
+    yield 'define {} {}({}){} {{'.format(llvm_type_map[func.ftype],
+                                         llvm_id(func, func.name), argstr, prof)
+    for n, (k, bb) in enumerate(func.bbtable.items()):
+        func.context['current_bb'] = k
+        counted = not instrument
+        for inst in bb.insts:
+            if not counted and inst.op != Op.DEFLABEL and inst.op != Op.PHI:
+                yield from counter_lines(func, n)
+                counted = True
+            emitter = emitters.get(inst.op)
+            if emitter is not None:
+                yield emitter(func, names, inst)
+    yield '}'
+    del func.context['current_bb']
+    del func.context['llvm_names']
+
+# ひとつの関数のLLVM IRを生成し、resultに追加する。
+def gen_function(func, result, instrument=False):
+    result.extend(function_lines(func, instrument))
+
+# LLVM IRの行のリストをファイルに書き出す。
+def write_lines(out, lines):
+    out.write('\n'.join(lines))
+    out.write('\n')
+
+# LLVM IRを生成する。
+def llvmgen(p):
+    assign_llvm_names(p)
     result = []
     # 各関数のLLVM IRを出力する。
     for func in p.func_list:
-        argstr = []
-        for param in func.params:
-            argstr.append('{} {}'.format(llvm_term(func, param[0]),
-                                         llvm_term(func, param[1])))
-        result.append('define {} {}({}) {{'.format(llvm_type(func, func.ftype),
-                                                   llvm_id(func, func.name),
-                                                   ', '.join(argstr)))
-        for k in func.bbtable.keys():
-            func.context['current_bb'] = k
-            for inst in func.bbtable[k].insts:
-                gen_inst(func, inst, result)
-        result.append('}')
-        del func.context['current_bb']
-
+        gen_function(func, result)
     return result
+
+# LLVM IRを関数ごとに生成しながらファイル(writeメソッドを持つオブジェクト)
+# outに書き出す。モジュール全体の行のリストは作らないので、メモリ使用量は
+# 最大の関数のLLVM IRの大きさで決まる。
+def write_llvm(p, out):
+    assign_llvm_names(p)
+    for func in p.func_list:
+        write_lines(out, list(function_lines(func)))
@@ -1,61 +1,132 @@
-import sys
+import argparse
 import os
-from analysis import irgen
-from llvmgen import llvmgen
-
-rt_template = r'''
-#include <stdio.h>
-#include <stdlib.h>
-
-extern int app_main({1});
-
-int main(int argc, char *argv[])
-{{
-    int result;
-    if (argc <= {0}) {{
-        printf("%s {2}\n", argv[0]);
-        return -1;
-    }}
-    result = app_main({3});
-    printf("%d\n", result);
-    return 0;
-}}
-'''
-
-# ランタイム用のmain関数を作成する。
-def create_main(program):
-    app_main = [f for f in program.func_list if f.name == 'app_main']
-    if app_main == []:
-        print("function app_main not found")
-        return
-
-    narg = len(app_main[0].params)
-    extern_spec = ['int arg{}'.format(1+n) for n in range(narg)]
-    usage_spec = ['arg{}'.format(1+n) for n in range(narg)]
-    arg_spec = ['atoi(argv[{}])'.format(1+n) for n in range(narg)]
-
-    return rt_template.format(narg,', '.join(extern_spec),
-                              ' '.join(usage_spec), ', '.join(arg_spec))
+import sys
+from session import compile_to_files, evict_cache, CompileOptions
+from inliner import default_threshold
 
-if __name__ == '__main__':
-    args = sys.argv
-    if len(args) < 2:
+# コマンドライン引数を解析する。
+def parse_args(argv):
+    argp = argparse.ArgumentParser(
+        prog='microc.py',
+        description='MicroCのソースコードをLLVM IRに変換する。')
+    argp.add_argument('sources', nargs='*', metavar='source',
+                      help='ソースファイルまたはソースファイルを含むディレクトリ')
+    argp.add_argument('--manifest', metavar='FILE',
+                      help='1行に1個のソースファイルを書いたファイル')
+    argp.add_argument('-j', '--jobs', type=int, default=None,
+                      help='バッチ処理のワーカー数(省略時はCPUの数)')
+    argp.add_argument('--json', metavar='FILE', nargs='?', const='-',
+                      help='バッチ処理の結果をJSON形式で出力する(-は標準出力)')
+    argp.add_argument('--table-cache', metavar='DIR',
+                      help='構文解析テーブルを保存するディレクトリ')
+    argp.add_argument('--ir-cache', metavar='DIR',
+                      help='関数単位のLLVM IRのキャッシュを保存するディレクトリ')
+    argp.add_argument('--ir-cache-size', metavar='MB', type=int,
+                      help='LLVM IRのキャッシュの大きさの上限(MB)')
+    argp.add_argument('--inline-threshold', metavar='N', type=int,
+                      default=default_threshold,
+                      help='インライン展開する関数の大きさ(命令数)の上限'
+                      '(0で展開しない、省略時は{})'.format(default_threshold))
+    argp.add_argument('--profile-generate', action='store_true',
+                      help='基本ブロックの実行回数を数えるコードを生成する'
+                      '(インライン展開は行わない)')
+    argp.add_argument('--profile-use', metavar='FILE',
+                      help='プロファイルを最適化とLLVM IRの分岐確率に使う')
+    argp.add_argument('--stream', action='store_true',
+                      help='関数を1個ずつ処理し、内部表現を保持するメモリを抑える'
+                      '(インライン展開は前に定義した関数だけに行う)')
+    argp.add_argument('--time-passes', action='store_true',
+                      help='各処理の時間と内部表現の大きさを表にして表示する')
+    argp.add_argument('--mem-report', action='store_true',
+                      help='各処理のメモリ使用量も計測する(tracemallocを使う)')
+    argp.add_argument('--pass-json', metavar='FILE',
+                      help='各処理の記録をJSON形式で出力する')
+    argp.add_argument('--pass-trace', metavar='FILE',
+                      help='各処理の記録をChromeのトレースイベント形式で出力する')
+    argp.add_argument('-v', '--verbose', action='store_true',
+                      help='処理の途中結果を印字する')
+    return argp.parse_args(argv)
+
+# 各処理の記録を、表(標準エラー出力)、JSON、トレースイベントの形式で出力する。
+def report_passes(records, args):
+    from passreport import format_table, write_json, write_chrome_trace
+
+    if args.time_passes or args.mem_report:
+        sys.stderr.write('\n'.join(format_table(records)) + '\n')
+    if args.pass_json is not None:
+        with open(args.pass_json, mode='w') as f:
+            write_json(records, f)
+    if args.pass_trace is not None:
+        with open(args.pass_trace, mode='w') as f:
+            write_chrome_trace(records, f)
+
+# ソースファイルをひとつコンパイルする。
+def compile_one(path, options, args):
+    with open(path) as f:
+        source = f.read()
+
+    result, written = compile_to_files(source, path, options)
+    for message in result.errors:
+        print(message)
+    for message in result.warnings:
+        sys.stderr.write('warning: {}\n'.format(message))
+    if options.ir_cache is not None:
+        evict_cache(options)
+        sys.stderr.write('ir cache: {} hits, {} misses\n'
+                         .format(result.cache_stats['hits'],
+                                 result.cache_stats['misses']))
+    if result.pass_records is not None:
+        report_passes(result.pass_records, args)
+    return 0 if result.ok else 1
+
+# 複数のソースファイルをまとめてコンパイルする。
+def compile_many(args, options):
+    from batch import run_batch, print_summary, write_json_summary
+
+    summary = run_batch(args.sources, args.manifest, args.jobs, options,
+                        args.table_cache)
+    # 各処理の記録は要約とは別に出力する。
+    records = [r for s in summary['results'] for r in s.pop('passes', [])]
+    if args.json == '-':
+        write_json_summary(summary, sys.stdout)
+    else:
+        print_summary(summary, sys.stdout, args.verbose)
+        if args.json is not None:
+            with open(args.json, mode='w') as f:
+                write_json_summary(summary, f)
+    if options.time_passes or options.mem_report:
+        report_passes(records, args)
+    return 0 if summary['failed'] == 0 else 1
+
+def main(argv):
+    args = parse_args(argv)
+    if args.sources == [] and args.manifest is None:
         print('microc.py <source>')
+        return 1
+
+    options = CompileOptions(args.verbose, args.ir_cache,
+                             inline_threshold=args.inline_threshold,
+                             instrument=args.profile_generate,
+                             profile=args.profile_use,
+                             time_passes=(args.time_passes
+                                          or args.pass_json is not None
+                                          or args.pass_trace is not None),
+                             mem_report=args.mem_report,
+                             streaming=args.stream)
+    if args.ir_cache_size is not None:
+        options.ir_cache_size = args.ir_cache_size * 1024 * 1024
+
+    batch = (len(args.sources) > 1 or args.manifest is not None
+             or args.jobs is not None or args.json is not None
+             or any(os.path.isdir(s) for s in args.sources))
+    if batch:
+        options.verbose = False
+        return compile_many(args, options)
     else:
-        with open(args[1]) as f:
-            source = f.read()
-            
-        program = irgen(source)
-        if program is not None:
-            result = llvmgen(program)
-
-            dirname, filename = os.path.split(sys.argv[1])
-            basename = os.path.splitext(filename)[0]
-            with open('{}{}{}.ll'
-                      .format(dirname, os.path.sep, basename), mode='w') as f:
-                f.writelines('\n'.join(result))
-
-            runtime_c = create_main(program)
-            with open('{}{}main-{}.c'
-                      .format(dirname, os.path.sep, basename), mode='w') as f:
-                f.writelines(runtime_c)
+        if args.table_cache is not None:
+            from parser import set_table_cache
+            set_table_cache(args.table_cache)
+        return compile_one(args.sources[0], options, args)
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
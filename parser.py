@@ -1,95 +1,121 @@
+import copy
+import hashlib
+import os
+import sys
+import threading
 import ply.yacc as yacc
-from lexer import tokens
+from lexer import tokens, get_lexer, reset_lexer, load_table_module, install_table_file
 from classes import Function, Program, SymbolTable
 from util import *
 
-# プログラム全体
-_program = None
-
-#  仮の識別子表
-_global_symtable = None
-_func_symtable = None
-
 # 関数の入り口のラベル名
 function_entry = '__entry'
 
-# 新しい変数名を生成し、識別子表に登録する。
-def newvar():
-    newvar.counter += 1
-    var = '.temp{}'.format(newvar.counter)
-    _func_symtable.add_sym(var, 'temp')
-    return ['id', var]
-
-newvar.counter = -1
-
-# 新しいラベル名を生成し、識別子表に登録する。
-def newlabel():
-    newlabel.counter += 1
-    label = 'label{}'.format(newlabel.counter)
-    _func_symtable.add_sym(label, 'label')
-    return ['label', label]
-
-newlabel.counter = -1
-
-# 命令列のリストをマージしたリストと、マージ元のリストの
-# 最後の変数のリストを返す。
-def merge_insts_list(*insts_list):
-    if len(insts_list) == 1 and is_term(insts_list[0]):
-        # 項だけが渡された場合はマージ後の命令列はなしで
-        # 最後の変数として項を返す。
-        return None, insts_list[0]
-    else:
+# 構文解析中の状態を管理するクラス
+# 構文解析ごとに生成するので、複数の構文解析を並行して実行できる。
+class ParseState:
+    def __init__(self):
+        # プログラム全体
+        self.program = None
+        # 仮の識別子表
+        # 関数スコープの識別子表名はfunc_defを還元しときに確定するので、
+        # ここでは仮に.tempとしておく
+        self.global_symtable = SymbolTable('.global')
+        self.func_symtable = SymbolTable('.temp')
+        # 一時変数とラベルの番号
+        self.var_counter = -1
+        self.label_counter = -1
+        # 構文エラーのメッセージ
+        self.errors = []
+        # 最後に還元した複文の閉じ括弧の位置
+        self.last_rbrace = None
+        # 解析中の式の命令列
+        # 式の各部分は還元された順、つまり評価する順に命令を追加していく。
+        self.expr_insts = []
+        # 関数定義を還元するたびに、その関数を引数として呼び出す関数
+        # 関数を1個ずつ処理する場合に指定する。
+        self.on_function = None
+
+    # 新しい変数名を生成し、識別子表に登録する。
+    def newvar(self):
+        self.var_counter += 1
+        var = '.temp{}'.format(self.var_counter)
+        self.func_symtable.add_sym(var, 'temp')
+        return make_id(var)
+
+    # 新しいラベル名を生成し、識別子表に登録する。
+    def newlabel(self):
+        self.label_counter += 1
+        label = 'label{}'.format(self.label_counter)
+        self.func_symtable.add_sym(label, 'label')
+        return make_label(label)
+
+    # 式の命令を追加し、その結果を格納する一時変数を返す。
+    def emit(self, op, *args):
+        var = self.newvar()
+        self.expr_insts.append(make_inst(var, op, *args))
+        return var
+
+    # 解析中の式の命令列を取り出す。
+    def take_expr_insts(self):
+        insts = self.expr_insts
+        self.expr_insts = []
+        return insts
+
+    # 関数定義の終わりで状態をリセットし、次の関数のパースに備える。
+    def reset_function(self):
+        self.func_symtable = SymbolTable('.temp')
+        self.var_counter = -1
+        self.label_counter = -1
+        self.expr_insts = []
+
+# 文の命令列を組み立てるクラス
+# 文の命令列を連結するたびにリストをコピーしないよう、命令または部分命令列
+# (Code)への参照を追加していき、関数定義を還元するときに一度だけ平坦な
+# 命令列にする(flatten())。
+class Code:
+    __slots__ = ('parts', 'last')
+
+    def __init__(self):
+        self.parts = []
+        # 最後の命令(命令がなければNone)
+        self.last = None
+
+    # 命令を追加する。
+    def append(self, inst):
+        self.parts.append(inst)
+        self.last = inst
+
+    # 命令のリストを追加する。
+    def extend(self, insts):
+        if insts:
+            self.parts.extend(insts)
+            self.last = insts[-1]
+
+    # 部分命令列を追加する。
+    def append_code(self, code):
+        if code.last is not None:
+            self.parts.append(code)
+            self.last = code.last
+
+    # 最後の命令が分岐またはreturnかどうかを調べる。
+    def ends_with(self, ops):
+        return self.last is not None and self.last.op in ops
+
+    # 平坦な命令のリストを返す。
+    # 入れ子の深い文でも再帰の深さの制限にかからないよう、明示的なスタックを使う。
+    def flatten(self):
         result = []
-        last_vars = []
-        for i in insts_list:
-            result.extend(i)
-            if is_id(left(result[-1])):
-                last_vars.append(left(result[-1]))
-        return result, last_vars
-
-# 命令リストからコピー文をひとつ取り出す。
-def pop_copy_inst(insts):
-    candidate = -1
-    for i in range(len(insts)):
-        if is_copy(insts[i]):
-            candidate = i
-            break;
-    if candidate >= 0:
-        if len(insts) > 1:
-            return insts.pop(i)
-        else:
-            # 命令リストが1個のコピー文しか含んでいなかった場合は、
-            # 右辺の項(識別子または数値)を返す。
-            # このとき代入先の一時変数を辞書から削除する。
-            inst = insts.pop(i)
-            if is_id(left(inst)):
-                _func_symtable.delete_sym(id_name(left(inst)))
-            return right(inst, 1)
-    else:
-        return None
-
-# 命令リストのコピー文を削除し、式に対する命令列をシュリンクさせる。
-# 結果は、すべてのコピー文が削除された命令列か、識別子一つのいずれかとなる。
-def shrink(insts):
-    while True:
-        # コピー文を一つ取り出す。
-        copy_inst = pop_copy_inst(insts)
-        if copy_inst is None:
-            return insts
-        elif is_term(copy_inst):
-            return copy_inst
-        else:
-            # コピー文の左辺変数の参照先をコピー文の右辺変数で置き換える。
-            copy_right = right(copy_inst, 1)
-            copy_left = left(copy_inst)
-            for inst in insts:
-                for pos in range(2, len(inst)):
-                    if is_id(inst[pos]) and id_name(inst[pos]) == id_name(copy_left):
-                        inst[pos] = copy_right
-                        
-            # 置換元変数は不要になったので識別子表から削除する。
-            _func_symtable.delete_sym(id_name(copy_left))
-    return insts
+        stack = [iter(self.parts)]
+        while stack:
+            for item in stack[-1]:
+                if item.__class__ is Code:
+                    stack.append(iter(item.parts))
+                    break
+                result.append(item)
+            else:
+                stack.pop()
+        return result
 
 # 文法の開始記号
 start = 'func_def_list'
@@ -98,38 +124,44 @@ start = 'func_def_list'
 def p_func_def_list(p):
     '''func_def_list : func_def
                      | func_def_list func_def'''
-    global _program
-    global _func_symtable
+    state = p.parser.parse_state
 
     if len(p) == 2:
         func = p[1]
     elif len(p) == 3:
         func = p[2]
 
-    if _program is None:
-        _program = Program()
-    func.program = _program
-    _program.func_list.append(func)
-    _global_symtable.add_sym(func.name, 'func', {'type': func.ftype})
-    _func_symtable.scope = func.name
+    if state.program is None:
+        state.program = Program()
+        state.program.symtable = state.global_symtable
+    func.program = state.program
+    state.program.func_list.append(func)
+    state.global_symtable.add_sym(func.name, 'func', {'type': func.ftype,
+                                                      'nparams': len(func.params)})
+    state.func_symtable.scope = func.name
+    if state.on_function is not None:
+        state.on_function(func)
 
     # 状態をリセットし、次のパースに備える。
-    _func_symtable = SymbolTable('.temp')
-    newvar.counter = -1
-    newlabel.counter = -1
-    p[0] = _program
+    state.reset_function()
+    p[0] = state.program
     
 # 関数定義の文法
 def p_func_def(p):
     '''func_def : type_spec ID LPAREN RPAREN compound_stat
                 | type_spec ID LPAREN param_list RPAREN compound_stat'''
+    state = p.parser.parse_state
     p[0] = None
     if len(p) == 6:
-        p[0] = Function(p[2], p[1][1], [], function_entry, _func_symtable, p[5])
+        p[0] = Function(p[2], type_name(p[1]), [], function_entry,
+                        state.func_symtable, p[5].flatten())
     elif len(p) == 7:
-        p[0] = Function(p[2], p[1][1], p[4], function_entry, _func_symtable, p[6])
-    _func_symtable.add_sym(function_entry, 'label')
+        p[0] = Function(p[2], type_name(p[1]), p[4], function_entry,
+                        state.func_symtable, p[6].flatten())
+    state.func_symtable.add_sym(function_entry, 'label')
     p[0].entry = function_entry
+    # 関数名から関数本体の閉じ括弧までのソースコード上の範囲を記録する。
+    p[0].source_span = (p.lexpos(2), state.last_rbrace + 1)
     
 def p_param_list(p):
     '''param_list : param
@@ -141,48 +173,56 @@ def p_param_list(p):
 
 def p_param(p):
     'param : type_spec ID'
-    p[0] = [[p[1], ['id', p[2]]]]
-    _func_symtable.add_sym(p[2], 'param', {'type': p[1][1]})
+    state = p.parser.parse_state
+    p[0] = [[p[1], make_id(p[2])]]
+    state.func_symtable.add_sym(p[2], 'param', {'type': type_name(p[1])})
 
 def p_type_spec(p):
     'type_spec : INT'
-    p[0] = ['type', p[1]]
+    p[0] = make_type(p[1])
 
 # 複文
 def p_compound_stat(p):
     '''compound_stat : LBRACE RBRACE
                      | LBRACE stat_list RBRACE
                      | LBRACE decl_list stat_list RBRACE'''
+    p.parser.parse_state.last_rbrace = p.lexpos(len(p) - 1)
     if len(p) == 3:
-        p[0] = []
+        p[0] = Code()
     elif len(p) == 4:
         p[0] = p[2]
     elif len(p) == 5:
-        p[0] = p[2] + p[3]
+        p[0] = p[2]
+        p[0].append_code(p[3])
 
 # 変数宣言のリスト
 def p_decl_list(p):
     '''decl_list : decl
                  | decl_list decl'''
     if len(p) == 2:
-        p[0] = p[1]
+        p[0] = Code()
+        p[0].append(p[1])
     elif len(p) == 3:
-        p[0] = p[1] + p[2]
+        p[0] = p[1]
+        p[0].append(p[2])
 
 # 変数宣言
 def p_decl(p):
     'decl : type_spec ID SEMI'
-    p[0] = [[['id', p[2]], 'deflocal', p[1]]]
-    _func_symtable.add_sym(p[2], 'localvar', {'type': p[1][1]})
+    state = p.parser.parse_state
+    p[0] = make_inst(make_id(p[2]), Op.DEFLOCAL, p[1])
+    state.func_symtable.add_sym(p[2], 'localvar', {'type': type_name(p[1])})
 
 def p_stat_list(p):
     '''stat_list : stat
                  | stat_list stat
     '''
     if len(p) == 2:
-        p[0] = p[1]
+        p[0] = Code()
+        p[0].append_code(p[1])
     elif len(p) == 3:
-        p[0] = p[1] + p[2]
+        p[0] = p[1]
+        p[0].append_code(p[2])
 
 def p_stat(p):
     '''stat : assignment_stat
@@ -194,83 +234,82 @@ def p_stat(p):
 
 def p_assignment_stat(p):
     'assignment_stat : ID EQUAL expr SEMI'
-    p[0], lastvar = merge_insts_list(p[3])
-    if p[0] == None:
-        p[0] = [[['id', p[1]], '=', lastvar]]
+    state = p.parser.parse_state
+    insts, value = p[3]
+    p[0] = Code()
+    if not insts:
+        p[0].append(make_inst(make_id(p[1]), Op.COPY, value))
     else:
-        # 最後の文の左辺を代入文の左辺に置き換える。
+        # 最後の命令の左辺を代入文の左辺に置き換える。
         # 置き換える元の変数名は識別子表から削除する。
-        last_inst = p[0][-1]
-        _func_symtable.delete_sym(id_name(left(last_inst)))
-        set_tval(left(last_inst), p[1])
+        last_inst = insts[-1]
+        state.func_symtable.delete_sym(id_name(left(last_inst)))
+        last_inst.left = make_id(p[1])
+        p[0].extend(insts)
 
 def p_while_stat(p):
     'while_stat : WHILE LPAREN expr RPAREN stat'
-    label_entry = newlabel();
-    label_body = newlabel();
-    label_end = newlabel();
-    p[0] = [[None, 'deflabel', label_entry]]
-    expr, lastvar = merge_insts_list(p[3])
-    if expr is None:
-        p[0].append([None, 'if', lastvar, label_body, label_end])
-    else:
-        p[0].extend(expr)
-        p[0].append([None, 'if', lastvar[0], label_body, label_end])
-    p[0].append([None, 'deflabel', label_body])
-    p[0].extend(p[5])
-    if op(p[5][-1]) not in ('goto', 'if', 'return'):
-        p[0].append([None, 'goto', label_entry])
-    p[0].append([None, 'deflabel', label_end])
+    state = p.parser.parse_state
+    label_entry = state.newlabel();
+    label_body = state.newlabel();
+    label_end = state.newlabel();
+    insts, value = p[3]
+    p[0] = Code()
+    p[0].append(make_inst(None, Op.DEFLABEL, label_entry))
+    p[0].extend(insts)
+    p[0].append(make_inst(None, Op.IF, value, label_body, label_end))
+    p[0].append(make_inst(None, Op.DEFLABEL, label_body))
+    p[0].append_code(p[5])
+    if not p[5].ends_with((Op.GOTO, Op.IF, Op.RETURN)):
+        p[0].append(make_inst(None, Op.GOTO, label_entry))
+    p[0].append(make_inst(None, Op.DEFLABEL, label_end))
 
 def p_if_stat(p):
     '''if_stat : IF LPAREN expr RPAREN stat
                | IF LPAREN expr RPAREN stat ELSE stat'''
+    state = p.parser.parse_state
+    insts, value = p[3]
+    p[0] = Code()
+    p[0].extend(insts)
     if len(p) == 6:
-        label_then = newlabel();
-        label_end = newlabel();
-        p[0], lastvar = merge_insts_list(p[3])
-        if p[0] is None:
-            p[0] = [[None, 'if', lastvar, label_then, label_end]]
-        else:
-            p[0].append([None, 'if', lastvar[0], label_then, label_end])
-        p[0].append([None, 'deflabel', label_then])
-        p[0].extend(p[5])
-        if op(p[5][-1]) not in ('goto', 'if', 'return'):
-            p[0].append([None, 'goto', label_end])
-        p[0].append([None, 'deflabel', label_end])
+        label_then = state.newlabel();
+        label_end = state.newlabel();
+        p[0].append(make_inst(None, Op.IF, value, label_then, label_end))
+        p[0].append(make_inst(None, Op.DEFLABEL, label_then))
+        p[0].append_code(p[5])
+        if not p[5].ends_with((Op.GOTO, Op.IF, Op.RETURN)):
+            p[0].append(make_inst(None, Op.GOTO, label_end))
+        p[0].append(make_inst(None, Op.DEFLABEL, label_end))
     elif len(p) == 8:
-        label_then = newlabel();
-        label_else = newlabel();
-        label_end = newlabel();
-        p[0], lastvar = merge_insts_list(p[3])
-        if p[0] is None:
-            p[0] = [[None, 'if', lastvar, label_then, label_else]]
-        else:
-            p[0].append([None, 'if', lastvar[0], label_then, label_else])
-        p[0].append([None, 'deflabel', label_then])
-        p[0].extend(p[5])
-        if op(p[5][-1]) != 'return':
-            p[0].append([None, 'goto', label_end])
-        p[0].append([None, 'deflabel', label_else])
-        p[0].extend(p[7])
-        if op(p[7][-1]) not in ('goto', 'if', 'return'):
-            p[0].append([None, 'goto', label_end])
-        p[0].append([None, 'deflabel', label_end])
+        label_then = state.newlabel();
+        label_else = state.newlabel();
+        label_end = state.newlabel();
+        p[0].append(make_inst(None, Op.IF, value, label_then, label_else))
+        p[0].append(make_inst(None, Op.DEFLABEL, label_then))
+        p[0].append_code(p[5])
+        if not p[5].ends_with((Op.RETURN,)):
+            p[0].append(make_inst(None, Op.GOTO, label_end))
+        p[0].append(make_inst(None, Op.DEFLABEL, label_else))
+        p[0].append_code(p[7])
+        if not p[7].ends_with((Op.GOTO, Op.IF, Op.RETURN)):
+            p[0].append(make_inst(None, Op.GOTO, label_end))
+        p[0].append(make_inst(None, Op.DEFLABEL, label_end))
 
 # return文
 def p_return_stat(p):
     'return_stat : RETURN expr SEMI'
-    p[0], lastvar = merge_insts_list(p[2])
-    if p[0] is None:
-        p[0] = [[None, 'return', lastvar]]
-    else:
-        p[0].append([None, 'return', lastvar[0]])
+    insts, value = p[2]
+    p[0] = Code()
+    p[0].extend(insts)
+    p[0].append(make_inst(None, Op.RETURN, value))
 
 # 式
+# 式の各部分は値を表す項(識別子または数値)を返し、値を計算する命令を
+# state.expr_instsに追加する。式全体の還元時に命令列を取り出して、
+# (命令列, 式の値の項)を返す。
 def p_expr(p):
     'expr : equality_expr'
-    # 式からコピー文を削除したものを返す。
-    p[0] = shrink(p[1])
+    p[0] = (p.parser.parse_state.take_expr_insts(), p[1])
 
 # 等号比較式
 def p_equality_epxr(p):
@@ -280,8 +319,7 @@ def p_equality_epxr(p):
     if len(p) == 2:
         p[0] = p[1]
     else:
-        p[0], last_vars = merge_insts_list(p[1], p[3])
-        p[0].append([newvar(), p[2], last_vars[0], last_vars[1]])
+        p[0] = p.parser.parse_state.emit(op_codes[p[2]], p[1], p[3])
 
 def p_relational_expr(p):
     '''relational_expr : additive_expr
@@ -292,8 +330,7 @@ def p_relational_expr(p):
     if len(p) == 2:
         p[0] = p[1]
     else:
-        p[0], last_vars = merge_insts_list(p[1], p[3])
-        p[0].append([newvar(), p[2], last_vars[0], last_vars[1]])
+        p[0] = p.parser.parse_state.emit(op_codes[p[2]], p[1], p[3])
 
 def p_additive_expr(p):
     '''additive_expr : multicative_expr
@@ -302,8 +339,7 @@ def p_additive_expr(p):
     if len(p) == 2:
         p[0] = p[1]
     else:
-        p[0], last_vars = merge_insts_list(p[1], p[3])
-        p[0].append([newvar(), p[2], last_vars[0], last_vars[1]])
+        p[0] = p.parser.parse_state.emit(op_codes[p[2]], p[1], p[3])
 
 def p_multicative_expr(p):
     '''multicative_expr : unary_expr
@@ -312,8 +348,7 @@ def p_multicative_expr(p):
     if len(p) == 2:
         p[0] = p[1]
     else:
-        p[0], last_vars = merge_insts_list(p[1], p[3])
-        p[0].append([newvar(), p[2], last_vars[0], last_vars[1]])
+        p[0] = p.parser.parse_state.emit(op_codes[p[2]], p[1], p[3])
 
 def p_unary_expr(p):
     '''unary_expr : postfix_expr
@@ -321,20 +356,19 @@ def p_unary_expr(p):
     if len(p) == 2:
         p[0] = p[1]
     elif p[1] == '-':
-        p[0], last_vars = merge_insts_list(p[2])
-        p[0].append([newvar(), 'unary_minus', last_vars[0]])
+        p[0] = p.parser.parse_state.emit(Op.NEG, p[2])
 
 def p_postfix_expr(p):
     '''postfix_expr : primary_expr
                     | ID LPAREN RPAREN
                     | ID LPAREN argument_expr_list RPAREN'''
+    state = p.parser.parse_state
     if len(p) == 2:
         p[0] = p[1]
     elif len(p) == 4:
-        p[0] = [[newvar(), 'call', ['id', p[1]], []]]
+        p[0] = state.emit(Op.CALL, make_id(p[1]))
     elif len(p) == 5:
-        p[0], last_vars = merge_insts_list(*p[3])
-        p[0].append([newvar(), 'call', ['id', p[1]], *last_vars])
+        p[0] = state.emit(Op.CALL, make_id(p[1]), *p[3])
 
 def p_argument_expr_list(p):
     '''argument_expr_list : equality_expr
@@ -342,46 +376,161 @@ def p_argument_expr_list(p):
     if len(p) == 2:
         p[0] = [p[1]]
     elif len(p) == 4:
-        p[0] = p[1] + [p[3]]
+        p[0] = p[1]
+        p[0].append(p[3])
     
 def p_primary_expr_id(p):
     'primary_expr : ID'
-    p[0] = [[newvar(), '=', ['id', p[1]]]]
+    p[0] = make_id(p[1])
 
 def p_primary_expr_number(p):
     'primary_expr : NUMBER'
-    p[0] = [[newvar(), '=', ['num', p[1]]]]
+    p[0] = make_num(p[1])
 
 def p_primary_expr_paren(p):
     'primary_expr : RPAREN expr LPAREN'
-    p[0] = p[1]
-
-def p_error(p):
+    # 内側の式の還元で取り出した命令列を戻し、外側の式の命令列として続ける。
+    # 内側の式の還元以降に命令は追加されていないので、戻すだけでよい。
+    state = p.parser.parse_state
+    insts, value = p[2]
+    state.expr_insts = insts
+    p[0] = value
+
+# 構文エラーのメッセージを作成する。
+def syntax_error_message(p):
     if p:
-        print("Syntax error at token '{}' at line {}, pos {}"
-              .format(p.value, p.lineno, p.lexpos))
+        return ("Syntax error at token '{}' at line {}, pos {}"
+                .format(p.value, p.lineno, p.lexpos))
     else:
-        print('Syntax error at EOF')
+        return 'Syntax error at EOF'
+
+def p_error(p):
+    print(syntax_error_message(p))
         
+# 構築済みの構文解析器
+_parser = None
+_parser_lock = threading.Lock()
+
+# 構文解析テーブルを保存するディレクトリ。
+# Noneの場合はテーブルをファイルに保存せず、プロセスごとにメモリ上で生成する。
+_table_cache_dir = os.environ.get('MICROC_TABLE_CACHE') or None
+
+# 構文解析テーブルと字句解析テーブルの保存先ディレクトリを設定する。
+# Noneを指定すると保存を行わない。構築済みの解析器は破棄する。
+def set_table_cache(cache_dir):
+    global _table_cache_dir
+    global _parser
+    _table_cache_dir = cache_dir
+    _parser = None
+    reset_lexer()
+
+# 文法規則のハッシュ値を求める。
+# 文法が変わるとハッシュ値が変わるので、永続化したテーブルのキーとして使う。
+def grammar_signature():
+    h = hashlib.sha256()
+    h.update(yacc.__tabversion__.encode())
+    h.update(start.encode())
+    h.update(' '.join(tokens).encode())
+    for name, value in globals().items():
+        if name.startswith('p_') and callable(value) and value.__doc__:
+            h.update(value.__doc__.encode())
+    return h.hexdigest()[:16]
+
+# 構文解析器を構築する。
+# cache_dirを指定した場合はLALRテーブルをそのディレクトリに保存し、
+# 次回以降のプロセスではテーブルを読み込むだけにする。
+def build_parser(cache_dir=None):
+    module = sys.modules[__name__]
+    if cache_dir is None:
+        return yacc.yacc(module=module, debug=False, write_tables=False,
+                         errorlog=yacc.NullLogger())
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tabname = 'parsetab_{}'.format(grammar_signature())
+    tabfile = os.path.join(cache_dir, tabname + '.py')
+    parsetab = load_table_module(tabname, tabfile)
+    if parsetab is not None:
+        # テーブル名に文法のハッシュ値が入っているので、文法の検証は省略する。
+        return yacc.yacc(module=module, debug=False, optimize=True,
+                         tabmodule=parsetab, write_tables=False)
+
+    # tempfileの読み込みは遅いので、テーブルを生成するときだけ読み込む。
+    import tempfile
+    tmpdir = tempfile.mkdtemp(dir=cache_dir)
+    parser = yacc.yacc(module=module, debug=False, tabmodule=tabname,
+                       outputdir=tmpdir)
+    install_table_file(tmpdir, tabname + '.py', cache_dir)
+    return parser
+
+# 構築済みの構文解析器を返す。
+# 構文解析器は最初に呼ばれたときに一度だけ構築する。
+def get_parser():
+    global _parser
+    with _parser_lock:
+        if _parser is None:
+            _parser = build_parser(_table_cache_dir)
+    return _parser
+
+# 状態stateを使って入力された文字列を構文解析する。
+# 字句解析と構文解析のエラーのメッセージはstate.errorsに記録する。
+def parse_with_state(data, state, debug=False):
+    # 構文解析器と字句解析器は解析中の状態を持つので、解析ごとに複製して使う。
+    # 解析テーブルは複製元と共有する。
+    parser = copy.copy(get_parser())
+    parser.parse_state = state
+    parser.errorfunc = lambda p: state.errors.append(syntax_error_message(p))
+    lexer = get_lexer(_table_cache_dir).clone()
+    lexer.lineno = 1
+    lexer.errors = state.errors
+    program = parser.parse(data, lexer=lexer, debug=debug)
+    if program is not None:
+        program.symtable = state.global_symtable
+    return program
+
+# 構文解析を行わずに字句解析だけで関数定義を調べる。
+# 関数ごとに(関数名, 引数の数, 呼び出している関数名のリスト)をソースコード上の
+# 順に並べたリストを返す。関数を1個ずつ処理する場合に、後で定義される関数の
+# シグネチャと呼び出し関係を知るために使う。構文エラーがあると正確でないことがある。
+def scan_functions(data):
+    lexer = get_lexer(_table_cache_dir).clone()
+    lexer.lineno = 1
+    # 字句解析のエラーは構文解析で報告する。
+    lexer.errors = []
+    lexer.input(data)
+    result = []
+    head = []
+    depth = 0
+    prev = None
+    while True:
+        tok = lexer.token()
+        if not tok:
+            break
+        if depth == 0:
+            if tok.type == 'LBRACE':
+                # 関数の頭部は「型 関数名 ( 型 引数, ... )」とする。
+                name = head[1].value if len(head) > 1 else None
+                nparams = sum(1 for t in head[2:] if t.type == 'INT')
+                result.append((name, nparams, []))
+                head = []
+                depth = 1
+            else:
+                head.append(tok)
+        elif tok.type == 'LBRACE':
+            depth += 1
+        elif tok.type == 'RBRACE':
+            depth -= 1
+        elif tok.type == 'LPAREN' and prev.type == 'ID':
+            callees = result[-1][2]
+            if prev.value not in callees:
+                callees.append(prev.value)
+        prev = tok
+    return result
+
 # 入力された文字列を構文解析する。
 # 解析した結果のプログラムデータを返す。
 def parse(data, debug=False):
-    global _func_symtable
-    global _global_symtable
-    global _program
-    
-    _global_symtable = SymbolTable('.global')
-
-    # 関数スコープの識別子表名はfunc_defを還元しときに確定するので、
-    # ここでは仮に.tempとしておく
-    _func_symtable = SymbolTable('.temp')
-
-    parser = yacc.yacc()
-    _program = parser.parse(data, debug)
-    if _program is not None:
-        _program.symtable = _global_symtable
-    
-    # 使われなかった一時識別子表をゴミ集めの対象にする。
-    _func_symtable = None
-    
-    return _program
+    state = ParseState()
+    program = parse_with_state(data, state, debug)
+    for message in state.errors:
+        print(message)
+    return program
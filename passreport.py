@@ -0,0 +1,200 @@
+# コンパイル処理の各段階(構文解析、SSA化などの各処理、インライン展開、
+# LLVM IRの生成)の処理時間、メモリ使用量、内部表現の大きさを記録する。
+#
+#   recorder = PassRecorder(memory=True)
+#   program = analysis.irgen(source, recorder=recorder)
+#   recorder.close()
+#   print('\n'.join(format_table(recorder.records)))
+#
+# CompileOptions(time_passes=True, mem_report=True)を指定した場合は、
+# セッションが記録し、CompileResult.pass_recordsに記録のリストを置く。
+#
+# 記録は処理ごと(関数単位の処理は関数ごと)に1個の辞書とする。
+#   pass      処理名
+#   function  関数名(プログラム全体に対する処理ではNone)
+#   start     開始時刻(time.perf_counter()の値、秒)
+#   time      処理時間(秒)
+#   peak      処理中に増えたメモリ使用量の最大値(バイト、memory=Trueの場合)
+#   allocated 処理の前後でのメモリ使用量の差(バイト、memory=Trueの場合)
+#   before, after  処理の前後の内部表現の大きさ(ir_size()を参照)
+#   depth     入れ子の深さ(インライン展開の後処理などは1以上になる)
+#   pid, tid  処理したプロセスとスレッドのID
+#
+# メモリ使用量はtracemallocで計測する。tracemallocはプロセス全体で一つなので、
+# 複数のスレッドで同時にコンパイルする場合は他のスレッドの分も含まれる。
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from util import Op
+
+# 関数の内部表現の大きさを辞書で返す。
+# 基本ブロックに分割する前は、命令の数だけを数える。
+def ir_size(f):
+    if f.bbtable:
+        insts = phis = 0
+        for bb in f.bbtable.values():
+            insts += len(bb.insts)
+            phis += sum(1 for i in bb.insts if i.op == Op.PHI)
+        blocks = len(f.bbtable)
+    else:
+        insts = len(f.insts) if f.insts is not None else 0
+        blocks = phis = 0
+    symbols = len(f.symtable.table) if f.symtable is not None else 0
+    return {'blocks': blocks, 'insts': insts, 'phis': phis, 'symbols': symbols}
+
+# プログラム全体の内部表現の大きさ(関数ごとの大きさの合計)を返す。
+def program_size(program):
+    total = {'blocks': 0, 'insts': 0, 'phis': 0, 'symbols': 0}
+    if program is None:
+        return total
+    for f in program.func_list:
+        for k, v in ir_size(f).items():
+            total[k] += v
+    return total
+
+# 処理ごとの記録を取るクラス
+class PassRecorder:
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.records = []
+        # 実行中の処理の入れ子の深さ
+        self.depth = 0
+        # 実行中の処理のメモリ使用量の最大値(入れ子になった処理ごと)
+        self.peaks = []
+        self.started_tracing = False
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+    # 記録を終える。このクラスで開始したtracemallocを止める。
+    def close(self):
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    # 処理nameを計測するコンテキストマネージャで、記録の辞書を返す。
+    # funcを指定すれば関数の、そうでなければプログラムprogramの大きさを記録する。
+    # withの本体でプログラムを作成する場合は、記録の'program'に置く。
+    #
+    #   with recorder.phase('parse') as record:
+    #       program = record['program'] = parse(source)
+    @contextmanager
+    def phase(self, name, func=None, program=None):
+        def size():
+            if func is not None:
+                return ir_size(func)
+            return program_size(record.get('program', program))
+
+        record = {'pass': name,
+                  'function': func.name if func is not None else None}
+        record.update({'before': size(), 'depth': self.depth,
+                       'pid': os.getpid(),
+                       'tid': threading.get_ident()})
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.peaks:
+                # 外側の処理のそれまでの最大値を退避してから計測し直す。
+                self.peaks[-1] = max(self.peaks[-1], peak)
+            tracemalloc.reset_peak()
+            self.peaks.append(current)
+        self.depth += 1
+        record['start'] = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['time'] = time.perf_counter() - record['start']
+            self.depth -= 1
+            if self.memory:
+                end, peak = tracemalloc.get_traced_memory()
+                peak = max(self.peaks.pop(), peak)
+                if self.peaks:
+                    self.peaks[-1] = max(self.peaks[-1], peak)
+                record['peak'] = peak - current
+                record['allocated'] = end - current
+            record['after'] = size()
+            record.pop('program', None)
+            self.records.append(record)
+
+    # 関数fに対して処理pを実行し、記録する。
+    def run_pass(self, f, p):
+        with self.phase(p.__name__, f):
+            p(f)
+
+# 処理ごとの合計を、記録に現れた順に並べたリストを返す。
+def summarize(records):
+    summary = {}
+    for r in records:
+        s = summary.get(r['pass'])
+        if s is None:
+            s = summary[r['pass']] = {'pass': r['pass'], 'calls': 0, 'time': 0.0,
+                                      'peak': 0, 'insts_before': 0,
+                                      'insts_after': 0}
+        s['calls'] += 1
+        s['time'] += r['time']
+        s['peak'] = max(s['peak'], r.get('peak', 0))
+        s['insts_before'] += r['before']['insts']
+        s['insts_after'] += r['after']['insts']
+    return list(summary.values())
+
+# 記録を表にした行のリストを返す。
+# 処理ごとの合計と、処理時間の長い順にtop件の関数ごとの記録を並べる。
+# 割合は入れ子になっていない処理の時間の合計に対するものとする。入れ子になった
+# 処理(インライン展開の後処理など)の時間は外側の処理にも含まれる。
+def format_table(records, top=10):
+    memory = any('peak' in r for r in records)
+    total = sum(r['time'] for r in records if r['depth'] == 0)
+    lines = ['{:28s} {:>6s} {:>10s} {:>6s}{} {:>17s}'
+             .format('pass', 'calls', 'time(ms)', '%',
+                     ' {:>10s}'.format('peak(KB)') if memory else '',
+                     'insts')]
+    for s in summarize(records):
+        lines.append('{:28s} {:6d} {:10.3f} {:5.1f}%{} {:>17s}'
+                     .format(s['pass'], s['calls'], s['time'] * 1000,
+                             s['time'] * 100 / total if total else 0.0,
+                             ' {:10.1f}'.format(s['peak'] / 1024) if memory else '',
+                             '{} -> {}'.format(s['insts_before'],
+                                               s['insts_after'])))
+    lines.append('')
+    lines.append('{:20s} {:28s} {:>10s}{} {:>17s} {:>6s} {:>5s}'
+                 .format('function', 'pass', 'time(ms)',
+                         ' {:>10s}'.format('peak(KB)') if memory else '',
+                         'insts', 'blocks', 'phis'))
+    slowest = sorted((r for r in records if r['function'] is not None),
+                     key=lambda r: r['time'], reverse=True)[:top]
+    for r in slowest:
+        lines.append('{:20s} {:28s} {:10.3f}{} {:>17s} {:6d} {:5d}'
+                     .format(r['function'], r['pass'], r['time'] * 1000,
+                             ' {:10.1f}'.format(r['peak'] / 1024) if memory else '',
+                             '{} -> {}'.format(r['before']['insts'],
+                                               r['after']['insts']),
+                             r['after']['blocks'], r['after']['phis']))
+    return lines
+
+# 記録と処理ごとの合計をJSON形式で書き出す。
+def write_json(records, out):
+    json.dump({'records': records, 'summary': summarize(records)}, out, indent=1)
+    out.write('\n')
+
+# 記録をChromeのトレースイベント形式(chrome://tracing、Perfettoで表示できる)で
+# 書き出す。時刻は最初の記録の開始時刻からのマイクロ秒とする。
+def write_chrome_trace(records, out):
+    base = min((r['start'] for r in records), default=0.0)
+    events = []
+    for r in records:
+        args = {'before': r['before'], 'after': r['after']}
+        if r['function'] is not None:
+            args['function'] = r['function']
+        if 'peak' in r:
+            args['peak'] = r['peak']
+            args['allocated'] = r['allocated']
+        name = r['pass']
+        if r['function'] is not None:
+            name = '{} ({})'.format(r['pass'], r['function'])
+        events.append({'name': name, 'cat': 'pass', 'ph': 'X',
+                       'ts': (r['start'] - base) * 1e6, 'dur': r['time'] * 1e6,
+                       'pid': r['pid'], 'tid': r['tid'], 'args': args})
+    json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, out)
+    out.write('\n')
@@ -0,0 +1,156 @@
+# プロファイルに基づく最適化(PGO)のためのプロファイル
+#
+# --profile-generateを指定してコンパイルしたプログラムは、基本ブロックごとの
+# 実行回数を数え、app_mainの終了後にプロファイルファイルに追記する。
+# ファイル名は環境変数MICROC_PROFILEで指定し、省略時はmicroc.profとする。
+# --profile-use ファイル名を指定してコンパイルすると、プロファイルを
+#   - インライン展開(実行されない呼び出しは展開せず、実行回数の多い呼び出しは
+#     大きな関数も展開する)
+#   - LLVM IRのbr命令の分岐確率(!prof branch_weights)と関数の呼び出し回数
+#     (!prof function_entry_count)
+# に使う。
+#
+# プロファイルファイルは1行に1個の基本ブロックの実行回数を書いたテキストとする。
+#
+#   関数名 基本ブロック名 実行回数
+#
+# '#'で始まる行と空行は読み飛ばす。同じ基本ブロックの行が複数あれば合計するので、
+# 複数回の実行の結果は同じファイルに追記すれば合算される。
+#
+# 基本ブロック名はインライン展開を行う前のSSA形式の内部表現のものとする。
+# 計測用のコンパイルではインライン展開を行わないので、同じソースコードであれば
+# 計測用と最適化用のコンパイルで基本ブロック名が一致する。
+import hashlib
+
+# プロファイルファイル名を指定する環境変数と、省略時のファイル名
+profile_env = 'MICROC_PROFILE'
+default_profile = 'microc.prof'
+
+# 実行回数の多い基本ブロックとみなす割合(プログラム中の最大の実行回数に対する比)
+hot_ratio = 0.01
+
+# LLVM IRの分岐の重み(i32)の上限
+max_weight = 0xffffffff
+
+# 読み込んだプロファイル
+class Profile:
+    def __init__(self):
+        # 関数名 -> {基本ブロック名: 実行回数}
+        self.counts = {}
+        # ファイルの内容のハッシュ値(キャッシュのキーに使う)
+        self.digest = None
+
+    # 関数の基本ブロックの実行回数の辞書を返す。プロファイルになければNoneを返す。
+    def function_counts(self, name):
+        return self.counts.get(name)
+
+    # プロファイル中の最大の実行回数を返す。
+    def max_count(self):
+        return max((c for counts in self.counts.values()
+                    for c in counts.values()), default=0)
+
+# プロファイルファイルを読み込む。形式に誤りがあればValueErrorとする。
+def load_profile(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    profile = Profile()
+    profile.digest = hashlib.sha256(data).hexdigest()
+    for lineno, line in enumerate(data.decode().splitlines(), 1):
+        line = line.strip()
+        if line == '' or line.startswith('#'):
+            continue
+        fields = line.split()
+        if len(fields) != 3 or not fields[2].isdigit():
+            raise ValueError('{}:{}: invalid profile line'.format(path, lineno))
+        counts = profile.counts.setdefault(fields[0], {})
+        counts[fields[1]] = counts.get(fields[1], 0) + int(fields[2])
+    return profile
+
+# SSA形式に変換した関数にプロファイルの実行回数を対応づける。
+# 実行回数は関数のcontext['block_counts']に基本ブロック名をキーとして置く。
+# 基本ブロックの集合がプロファイルと一致しない場合(ソースコードを変更した後の
+# 古いプロファイルなど)は対応づけず、Falseを返す。
+def apply_function_profile(f, profile):
+    counts = profile.function_counts(f.name)
+    if counts is None or not f.bbtable:
+        return True
+    if set(counts) != set(f.bbtable):
+        return False
+    f.context['block_counts'] = dict(counts)
+    return True
+
+# プログラムの関数にプロファイルの実行回数を対応づけ、対応づけられなかった
+# 関数名のリストを返す。
+def apply_profile(program, profile):
+    return [f.name for f in program.func_list
+            if not apply_function_profile(f, profile)]
+
+# 基本ブロックの実行回数を返す。わからなければNoneを返す。
+def block_count(f, bbname):
+    counts = f.context.get('block_counts')
+    if counts is None:
+        return None
+    return counts.get(bbname)
+
+# 関数が呼び出された回数(入口ブロックの実行回数)を返す。
+def entry_count(f):
+    return block_count(f, f.entry)
+
+# 実行回数の多い基本ブロックとみなす実行回数の下限を返す。
+# プロファイルを対応づけた関数がなければNoneを返す。
+def hot_count(program):
+    counts = [c for f in program.func_list
+              for c in f.context.get('block_counts', {}).values()]
+    if counts == []:
+        return None
+    return hot_threshold(max(counts))
+
+# 最大の実行回数に対する、実行回数の多い基本ブロックとみなす実行回数の下限
+def hot_threshold(max_count):
+    return max(1, int(max_count * hot_ratio))
+
+# 関数fの基本ブロックbbnameの呼び出し命令を、calleeの本体を複製した基本ブロック
+# に展開した際に、複製した基本ブロックと継続ブロックの実行回数を設定する。
+# 複製した基本ブロックの実行回数は、呼び出し先の実行回数を呼び出しの回数の
+# 割合で按分したものとする。labelsは呼び出し先の基本ブロック名から複製の名前
+# への対応とする。
+def inline_counts(f, bbname, callee, labels, cont):
+    site = block_count(f, bbname)
+    if site is None:
+        return
+    counts = f.context['block_counts']
+    counts[cont] = site
+    callee_counts = callee.context.get('block_counts')
+    entry = entry_count(callee)
+    if callee_counts is None or not entry:
+        return
+    for name, label in labels.items():
+        if name in callee_counts:
+            counts[label] = callee_counts[name] * site // entry
+
+# 基本ブロックbbnameから分岐先then_label、else_labelへの分岐の重みの組を返す。
+# 分岐先の先行ブロックがbbnameだけであれば、分岐先の実行回数がその辺を通った
+# 回数になる。片方だけわかれば、もう片方は分岐元の実行回数との差とする。
+# わからなければNoneを返す。
+def branch_weights(f, bbname, then_label, else_label):
+    total = block_count(f, bbname)
+    if total is None or then_label == else_label:
+        return None
+
+    def edge_count(target):
+        bb = f.bbtable.get(target)
+        if bb is not None and bb.pred == [bbname]:
+            return block_count(f, target)
+        return None
+
+    taken = edge_count(then_label)
+    not_taken = edge_count(else_label)
+    if taken is None and not_taken is None:
+        return None
+    if taken is None:
+        taken = max(total - not_taken, 0)
+    elif not_taken is None:
+        not_taken = max(total - taken, 0)
+    # 重みはi32なので、上限を超える場合は比を保って縮める。
+    scale = max(taken, not_taken) // max_weight + 1
+    return taken // scale, not_taken // scale
@@ -0,0 +1,88 @@
+# 生成したLLVM IRの関数を実行するためのランタイムコード
+from llvmgen import counters_name, counter_names_name
+from pgo import profile_env, default_profile
+
+rt_template = r'''
+#include <stdio.h>
+#include <stdlib.h>
+{4}
+extern int app_main({1});
+
+int main(int argc, char *argv[])
+{{
+    int result;
+    if (argc <= {0}) {{
+        printf("%s {2}\n", argv[0]);
+        return -1;
+    }}
+    result = app_main({3});
+{5}    printf("%d\n", result);
+    return 0;
+}}
+'''
+
+# 基本ブロックの実行回数をプロファイルファイルに追記する関数
+# 形式はpgo.pyを参照
+profile_template = r'''#include <string.h>
+
+{0}
+static void dump_counts(FILE *fp, const char *func, const char *names,
+                        const long long *counts)
+{{
+    int k;
+    for (k = 0; *names != '\0'; k++) {{
+        fprintf(fp, "%s %s %lld\n", func, names, counts[k]);
+        names += strlen(names) + 1;
+    }}
+}}
+
+static void dump_profile(void)
+{{
+    const char *path = getenv("{1}");
+    FILE *fp;
+    if (path == NULL) {{
+        path = "{2}";
+    }}
+    fp = fopen(path, "a");
+    if (fp == NULL) {{
+        perror(path);
+        return;
+    }}
+{3}    fclose(fp);
+}}
+'''
+
+# 実行回数をプロファイルファイルに書き出す関数を作成する。
+def create_profile_dump(program):
+    externs = []
+    calls = []
+    for f in program.func_list:
+        externs.append('extern long long {}[];\n'.format(counters_name(f.name)))
+        externs.append('extern const char {}[];\n'
+                       .format(counter_names_name(f.name)))
+        calls.append('    dump_counts(fp, "{}", {}, {});\n'
+                     .format(f.name, counter_names_name(f.name),
+                             counters_name(f.name)))
+    return profile_template.format(''.join(externs), profile_env,
+                                   default_profile, ''.join(calls))
+
+# ランタイム用のmain関数を作成する。
+# instrumentが真なら、app_mainの終了後に基本ブロックの実行回数を書き出す。
+# app_mainがなければNoneを返す(呼び出し側がエラーとして報告する)。
+def create_main(program, instrument=False):
+    app_main = [f for f in program.func_list if f.name == 'app_main']
+    if app_main == []:
+        return None
+
+    narg = len(app_main[0].params)
+    extern_spec = ['int arg{}'.format(1+n) for n in range(narg)]
+    usage_spec = ['arg{}'.format(1+n) for n in range(narg)]
+    arg_spec = ['atoi(argv[{}])'.format(1+n) for n in range(narg)]
+    dump, dump_call = '', ''
+    if instrument:
+        dump = create_profile_dump(program)
+        dump_call = '    dump_profile();\n'
+
+    return rt_template.format(narg,', '.join(extern_spec),
+                              ' '.join(usage_spec), ', '.join(arg_spec),
+                              dump, dump_call)
@@ -0,0 +1,392 @@
+# コンパイル処理の状態をひとまとめにして管理するセッション
+#
+# セッションはコンパイルごとの状態をすべて自分で持つので、
+# 複数のスレッドで別々のセッションを使って同時にコンパイルできる。
+#
+#   result = compile_source(source, CompileOptions(verbose=True))
+#   if result.ok:
+#       print('\n'.join(result.llvm_ir))
+#
+# 出力先のファイルを指定すると、LLVM IRを関数ごとに書き出す。
+#
+#   with open('out.ll', 'w') as out:
+#       result = compile_source(source, out=out)
+import os
+from contextlib import nullcontext
+from parser import ParseState, parse_with_state, scan_functions
+from analysis import run_passes
+from llvmgen import (assign_llvm_names, assign_function_llvm_names,
+                     gen_function, write_lines)
+from runtime import create_main
+from ircache import IRCache, called_functions
+from inliner import (inline_functions, inline_calls, is_inlinable,
+                     call_graph_sccs, recursive_functions,
+                     default_threshold, hot_factor)
+from pgo import load_profile, apply_profile, apply_function_profile, hot_threshold
+from passreport import PassRecorder
+
+# コンパイルオプション
+class CompileOptions:
+    def __init__(self, verbose=False, ir_cache=None, ir_cache_size=None,
+                 inline_threshold=default_threshold, instrument=False,
+                 profile=None, time_passes=False, mem_report=False,
+                 streaming=False):
+        # 各処理の途中結果を印字するかどうか
+        self.verbose = verbose
+        # 関数単位のLLVM IRのキャッシュを保存するディレクトリ
+        self.ir_cache = ir_cache
+        # キャッシュの大きさの上限(バイト)
+        self.ir_cache_size = ir_cache_size
+        # インライン展開する関数の大きさ(命令数)の上限(0なら展開しない)
+        self.inline_threshold = inline_threshold
+        # 基本ブロックの実行回数を数えるコードを生成するかどうか
+        self.instrument = instrument
+        # 最適化に使うプロファイルファイル名
+        self.profile = profile
+        # 各処理の時間と内部表現の大きさを記録するかどうか
+        self.time_passes = time_passes
+        # 各処理のメモリ使用量も記録するかどうか(tracemallocを使う)
+        self.mem_report = mem_report
+        # 関数を1個ずつ処理するかどうか(CompilerSession.compile_streaming())
+        self.streaming = streaming
+
+    # 生成するコードに影響するオプションを表す文字列を返す。
+    # キャッシュのキーの一部として使う。プロファイルはその内容のハッシュ値で表す。
+    def codegen_key(self, profile=None):
+        key = 'inline={}'.format(self.inline_threshold)
+        if self.instrument:
+            key += ';instrument'
+        if profile is not None:
+            key += ';profile={}'.format(profile.digest)
+        if self.streaming and self.inline_threshold > 0:
+            # 関数を1個ずつ処理する場合は、前に定義した関数だけを展開する。
+            key += ';stream'
+        return key
+
+# コンパイル結果
+class CompileResult:
+    def __init__(self):
+        # SSA形式に変換したプログラム
+        self.program = None
+        # LLVM IRの行のリスト(ファイルに書き出した場合はNone)
+        self.llvm_ir = None
+        # ランタイムコード(C言語)
+        self.runtime_c = None
+        # エラーメッセージのリスト
+        self.errors = []
+        # 警告メッセージのリスト
+        self.warnings = []
+        # LLVM IRのキャッシュのヒットとミスの回数
+        self.cache_stats = None
+        # 各処理の記録のリスト(passreport.pyを参照、記録しない場合はNone)
+        self.pass_records = None
+
+    @property
+    def ok(self):
+        return self.program is not None and self.errors == []
+
+# 関数を1個ずつ処理する場合の状態(CompilerSession.compile_streaming())
+class StreamState:
+    def __init__(self, source, out):
+        self.source = source
+        self.out = out
+        # outを指定しない場合に、生成したLLVM IRの行を集めるリスト
+        self.lines = [] if out is None else None
+        # 関数ごとの(関数名, 引数の数, 呼び出している関数名のリスト)
+        self.functions = scan_functions(source)
+        # 関数名 -> その関数を呼び出している関数のうち、最後に定義されたものの番号
+        self.last_caller = {}
+        for n, (_, _, calls) in enumerate(self.functions):
+            for name in calls:
+                self.last_caller[name] = n
+        # 再帰呼び出しの関係にある関数名の集合(展開しない)
+        graph = {name: calls for name, _, calls in self.functions}
+        self.recursive = recursive_functions(graph, call_graph_sccs(graph))
+        # 次に還元される関数の番号
+        self.index = 0
+        # インライン展開のために本体を残している関数(関数名 -> 関数)
+        self.bodies = {}
+        self.inline = False
+        self.codegen_key = ''
+        # 実行回数の多い基本ブロックとみなす実行回数の下限(pgo.hot_threshold())
+        self.hot = None
+        # 本体を残す関数の大きさの上限
+        self.limit = 0
+
+class CompilerSession:
+    def __init__(self, options=None):
+        self.options = options if options is not None else CompileOptions()
+        self.cache = None
+        if self.options.ir_cache is not None:
+            if self.options.ir_cache_size is not None:
+                self.cache = IRCache(self.options.ir_cache,
+                                     self.options.ir_cache_size)
+            else:
+                self.cache = IRCache(self.options.ir_cache)
+        self.profile = None
+        if self.options.profile is not None:
+            self.profile = load_profile(self.options.profile)
+        self.recorder = None
+
+    # 処理nameを記録するコンテキストマネージャを返す。
+    def phase(self, name, func=None, program=None):
+        if self.recorder is None:
+            return nullcontext({})
+        return self.recorder.phase(name, func, program)
+
+    # ソースコードを構文解析する。
+    def parse(self, source, result, state=None):
+        if state is None:
+            state = ParseState()
+        with self.phase('parse') as record:
+            program = record['program'] = parse_with_state(source, state)
+        result.errors.extend(state.errors)
+        if program is not None:
+            program.verbose = self.options.verbose
+            program.pass_recorder = self.recorder
+        return program
+
+    # ソースコードをSSA形式の内部表現に変換する。
+    # キャッシュにLLVM IRがある関数は変換を省略する。
+    # インライン展開を行う場合は、キャッシュにない関数から呼び出される関数も
+    # 展開のためにSSA形式に変換する(出力にはキャッシュの内容を使う)。
+    # 計測用のコンパイルでは、プロファイルの基本ブロック名をインライン展開の
+    # 有無によらないものにするため、インライン展開を行わない。
+    def irgen(self, source, result):
+        program = self.parse(source, result)
+        if program is None:
+            return program
+        inline = (self.options.inline_threshold > 0
+                  and not self.options.instrument)
+        codegen_key = self.options.codegen_key(self.profile)
+        for func in program.func_list:
+            if self.cache is not None:
+                func.context['cache_key'] = self.cache.function_key(
+                    func, source, codegen_key, callees=inline)
+                func.llvm_ir = self.cache.load(func.context['cache_key'])
+        functions = {func.name: func for func in program.func_list}
+        work = [func for func in program.func_list if func.llvm_ir is None]
+        targets = set()
+        while work:
+            func = work.pop()
+            if func.name in targets:
+                continue
+            targets.add(func.name)
+            if inline:
+                work.extend(functions[name] for name in called_functions(func)
+                            if name in functions)
+        for func in program.func_list:
+            if func.name in targets:
+                run_passes(func)
+        if self.profile is not None:
+            for name in apply_profile(program, self.profile):
+                result.warnings.append(
+                    'profile for function {} does not match the source'
+                    .format(name))
+        if inline:
+            with self.phase('inline', program=program):
+                inline_functions(program, self.options.inline_threshold)
+        return program
+
+    # SSA形式の内部表現からLLVM IRを生成し、行のリストを返す。
+    # outを指定した場合は関数ごとにoutに書き出し、Noneを返す。
+    def llvmgen(self, program, out=None):
+        assign_llvm_names(program)
+        lines = [] if out is None else None
+        for func in program.func_list:
+            if func.llvm_ir is not None:
+                func_lines = func.llvm_ir
+            else:
+                func_lines = []
+                with self.phase('llvmgen', func):
+                    gen_function(func, func_lines, self.options.instrument)
+                if self.cache is not None:
+                    self.cache.store(func.context['cache_key'], func_lines)
+            if out is None:
+                lines.extend(func_lines)
+            else:
+                write_lines(out, func_lines)
+        return lines
+
+    # 関数を1個ずつ処理しながらソースコードをコンパイルし、プログラムを返す。
+    # 構文解析で関数定義を還元するたびに、その関数をSSA形式に変換し、最適化し、
+    # LLVM IRを生成して書き出した後、関数本体を捨ててシグネチャだけを残す。
+    # 保持する内部表現は、処理中の関数と、後で定義される関数からインライン展開
+    # される小さな関数の本体だけになる。
+    # 後で定義される関数のシグネチャと呼び出し関係は、構文解析の前に
+    # 字句解析だけで調べておく(parser.scan_functions())。
+    # インライン展開は、呼び出し先が先に定義されている呼び出しだけに行う。
+    def compile_streaming(self, source, result, out=None):
+        stream = StreamState(source, out)
+        state = ParseState()
+        for name, nparams, _ in stream.functions:
+            if name is not None:
+                state.global_symtable.add_sym(name, 'func',
+                                              {'type': 'int', 'nparams': nparams})
+                state.global_symtable.set_sym(name, {'llvm_name': '@' + name})
+        stream.inline = (self.options.inline_threshold > 0
+                         and not self.options.instrument)
+        stream.codegen_key = self.options.codegen_key(self.profile)
+        if self.profile is not None:
+            stream.hot = hot_threshold(self.profile.max_count())
+            stream.limit = self.options.inline_threshold * hot_factor
+        else:
+            stream.limit = self.options.inline_threshold
+        state.on_function = lambda func: self.stream_function(stream, func, result)
+        program = self.parse(source, result, state)
+        result.llvm_ir = stream.lines
+        return program
+
+    # 構文解析で還元した関数funcをLLVM IRに変換して書き出す。
+    def stream_function(self, stream, func, result):
+        n = stream.index
+        stream.index += 1
+        program = func.program
+        program.verbose = self.options.verbose
+        program.pass_recorder = self.recorder
+        program.symtable.set_sym(func.name, {'llvm_name': '@' + func.name})
+        if n < len(stream.functions) and stream.functions[n][0] == func.name:
+            func.calls = stream.functions[n][2]
+            needed = stream.last_caller.get(func.name, -1) > n
+        else:
+            # 構文エラーなどで字句解析の結果と対応しない場合
+            func.calls = called_functions(func)
+            needed = True
+        needed = needed and stream.inline
+        if self.cache is not None:
+            func.context['cache_key'] = self.cache.function_key(
+                func, stream.source, stream.codegen_key, callees=stream.inline)
+            func.llvm_ir = self.cache.load(func.context['cache_key'])
+        # キャッシュにあっても、後で展開する場合は本体を作る。
+        if func.llvm_ir is None or needed:
+            run_passes(func)
+            if (self.profile is not None
+                and not apply_function_profile(func, self.profile)):
+                result.warnings.append(
+                    'profile for function {} does not match the source'
+                    .format(func.name))
+            if stream.inline and stream.bodies:
+                with self.phase('inline', func):
+                    inline_calls(func, stream.bodies, stream.recursive,
+                                 self.options.inline_threshold, stream.hot)
+        if func.llvm_ir is not None:
+            func_lines = func.llvm_ir
+        else:
+            assign_function_llvm_names(func)
+            func_lines = []
+            with self.phase('llvmgen', func):
+                gen_function(func, func_lines, self.options.instrument)
+            if self.cache is not None:
+                self.cache.store(func.context['cache_key'], func_lines)
+        if stream.out is None:
+            stream.lines.extend(func_lines)
+        else:
+            write_lines(stream.out, func_lines)
+
+        # 最後の呼び出し元を処理し終えた関数の本体を捨てる。
+        for name in [name for name in stream.bodies
+                     if stream.last_caller.get(name, -1) <= n]:
+            stream.bodies.pop(name).release()
+        if needed and is_inlinable(func, stream.recursive, stream.limit):
+            func.release_analysis()
+            func.llvm_ir = None
+            stream.bodies[func.name] = func
+        else:
+            func.release()
+
+    # ソースコードをコンパイルし、結果を返す。
+    # outにファイル(writeメソッドを持つオブジェクト)を指定した場合は、
+    # LLVM IRを関数ごとに生成しながら書き出し、結果には保持しない。
+    # time_passesまたはmem_reportを指定した場合は、各処理を記録して結果に置く。
+    def compile(self, source, out=None):
+        result = CompileResult()
+        if self.cache is not None:
+            hits, misses = self.cache.hits, self.cache.misses
+        if self.options.time_passes or self.options.mem_report:
+            self.recorder = PassRecorder(memory=self.options.mem_report)
+        try:
+            if self.options.streaming:
+                result.program = self.compile_streaming(source, result, out)
+            else:
+                result.program = self.irgen(source, result)
+                if result.program is not None:
+                    result.llvm_ir = self.llvmgen(result.program, out)
+            if result.program is not None:
+                result.runtime_c = create_main(result.program,
+                                               self.options.instrument)
+                if result.runtime_c is None:
+                    result.errors.append('function app_main not found')
+                result.warnings.extend(result.program.warnings)
+        finally:
+            if self.recorder is not None:
+                self.recorder.close()
+                result.pass_records = self.recorder.records
+                self.recorder = None
+                if result.program is not None:
+                    result.program.pass_recorder = None
+        if self.cache is not None:
+            result.cache_stats = {'hits': self.cache.hits - hits,
+                                  'misses': self.cache.misses - misses}
+        return result
+
+# ソースコードをコンパイルし、結果を返す。
+def compile_source(source, options=None, out=None):
+    return CompilerSession(options).compile(source, out)
+
+# オプションで指定したLLVM IRのキャッシュの追い出しを行い、
+# 削除したエントリの数を返す。
+def evict_cache(options):
+    return CompilerSession(options).cache.evict()
+
+# ソースファイルに対する出力ファイル(LLVM IRとランタイムコード)の名前を返す。
+# 出力ファイルはソースファイルと同じディレクトリに作成する。
+def output_paths(path):
+    dirname, filename = os.path.split(path)
+    basename = os.path.splitext(filename)[0]
+    return (os.path.join(dirname, '{}.ll'.format(basename)),
+            os.path.join(dirname, 'main-{}.c'.format(basename)))
+
+# ランタイムコードをファイルに出力する。
+def write_runtime(result, cname):
+    with open(cname, mode='w') as f:
+        f.writelines(result.runtime_c)
+
+# コンパイル結果をファイルに出力する。
+# ソースファイルと同じディレクトリにLLVM IRのファイルとランタイムコードの
+# ファイルを作成し、作成したファイル名のリストを返す。
+def write_result(result, path):
+    llname, cname = output_paths(path)
+    written = []
+    if result.llvm_ir is not None:
+        with open(llname, mode='w') as f:
+            write_lines(f, result.llvm_ir)
+        written.append(llname)
+    if result.runtime_c is not None:
+        write_runtime(result, cname)
+        written.append(cname)
+    return written
+
+# ソースコードをコンパイルし、LLVM IRを関数ごとにファイルに書き出す。
+# 出力ファイルはwrite_result()と同じとし、結果と作成したファイル名のリストを返す。
+# 構文解析に失敗した場合、app_mainがなくランタイムコードを作れない場合、
+# 例外が発生した場合は、どちらのファイルも残さない。
+def compile_to_files(source, path, options=None):
+    llname, cname = output_paths(path)
+    try:
+        with open(llname, mode='w') as out:
+            result = CompilerSession(options).compile(source, out)
+        if result.program is None or result.runtime_c is None:
+            remove_outputs(llname, cname)
+            return result, []
+        write_runtime(result, cname)
+    except BaseException:
+        # 書きかけのファイルを残さない。
+        remove_outputs(llname, cname)
+        raise
+    return result, [llname, cname]
+
+# 出力ファイルがあれば削除する。
+def remove_outputs(*names):
+    for name in names:
+        if os.path.exists(name):
+            os.remove(name)
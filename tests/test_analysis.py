@@ -0,0 +1,110 @@
+# SSA形式の内部表現に対する最適化のテスト
+import analysis
+import engine
+from parser import parse
+from util import Op
+
+# ソースコードを構文解析し、passesを実行した関数の一覧を返す。
+def run_source(source, passes=None):
+    program = parse(source)
+    for func in program.func_list:
+        analysis.run_passes(func, passes)
+    return program
+
+# 関数の命令を順に返す。
+def instructions(func):
+    return [i for bb in func.bbtable.values() for i in bb.insts]
+
+# 自分自身との比較は、比較の結果(0または1)のコピーに置き換えること。
+# SCCPで先に畳み込まれないよう、SCCPを除いて実行する。
+def test_self_comparison_folded():
+    source = ('int app_main(int a) { int b; b = 2; if (a == a) { b = 1; } '
+              'if (a < a) { b = b + 5; } return b; }\n')
+    passes = [p for p in analysis.default_passes if p is not analysis.sccp]
+    program = run_source(source, passes)
+    insts = instructions(program.func_list[0])
+    assert not [i for i in insts if i.op in analysis.self_compare]
+    conds = [i.args[0].val for i in insts if i.op == Op.IF]
+    assert conds == ['1', '0']
+    assert engine.run(program, 'app_main', 3) == 1
+
+# 定数の条件のif文を分岐のない命令に置き換え、実行されないブロックを削除すること。
+def test_sccp_folds_constant_branch():
+    source = ('int app_main(int a) { int x; int y; x = 3; y = x * 2; '
+              'if (y > 5) { a = a + y; } else { a = a - 100; } return a; }\n')
+    passes = analysis.default_passes[:analysis.default_passes.index(
+        analysis.sccp) + 1]
+    program = run_source(source, passes)
+    func = program.func_list[0]
+    insts = instructions(func)
+    assert not [i for i in insts if i.op == Op.IF]
+    assert not [i for i in insts if i.op == Op.SUB]
+    assert len(func.bbtable) == 4
+    assert engine.run(program, 'app_main', 1) == 7
+
+# 結果が使われないループの累積変数は、互いに参照しあうφ関数と加算ごと
+# 削除すること。
+def test_dce_removes_unused_accumulator():
+    source = ('int app_main(int n) { int i; int s; i = 0; s = 0; '
+              'while (i < n) { s = s + i * 3; i = i + 1; } return i; }\n')
+    program = run_source(source)
+    func = program.func_list[0]
+    insts = instructions(func)
+    assert not [i for i in insts if i.op == Op.MUL]
+    assert len([i for i in insts if i.op == Op.PHI]) == 1
+    assert len([i for i in insts if i.op == Op.ADD]) == 1
+    assert engine.run(program, 'app_main', 5) == 5
+
+# 交換則の成り立つ演算は引数の順序によらず同じ値とし、a*bとb*aを1回だけ
+# 計算すること。
+def test_gvn_commutative():
+    source = ('int app_main(int a, int b) { int x; int y; '
+              'x = a * b; y = b * a; return x + y; }\n')
+    program = run_source(source)
+    insts = instructions(program.func_list[0])
+    assert len([i for i in insts if i.op == Op.MUL]) == 1
+    assert engine.run(program, 'app_main', 6, 7) == 84
+
+# ループ不変式をループの外へ移動し、除数が定数でない除算は移動しないこと。
+# ループが一度も実行されなければ、除数が0でも例外にならない。
+def test_licm_hoists_invariant():
+    source = ('int app_main(int n, int a, int c, int k, int b) { int i; int s; '
+              'i = 0; s = 0; while (i < n) { s = s + a * c + k / b; '
+              'i = i + 1; } return s; }\n')
+    program = run_source(source)
+    func = program.func_list[0]
+    blocks = {}
+    for name, bb in func.bbtable.items():
+        for i in bb.insts:
+            blocks.setdefault(i.op, set()).add(name)
+    header = func.bbtable[next(iter(blocks[Op.PHI]))]
+    body = blocks[Op.DIV]
+    assert len(body) == 1 and body <= set(header.succ)
+    assert not blocks[Op.MUL] & (body | blocks[Op.PHI])
+    assert engine.run(program, 'app_main', 3, 4, 5, 12, 3) == 72
+    assert engine.run(program, 'app_main', 0, 4, 5, 12, 0) == 0
+
+# 自分自身の末尾呼び出しをループに変換し、再帰の深さによらず実行できること。
+def test_tail_recursion_becomes_loop():
+    source = ('int sum(int n, int acc) { if (n == 0) { return acc; } '
+              'return sum(n - 1, acc + n); }\n'
+              'int app_main(int n) { return sum(n, 0); }\n')
+    program = run_source(source)
+    insts = instructions(program.func_list[0])
+    assert not [i for i in insts if i.op == Op.CALL]
+    n = 3000000
+    expected = (n * (n + 1) // 2 + 2 ** 31) % 2 ** 32 - 2 ** 31
+    assert engine.run(program, 'app_main', n) == expected
+
+# コピーの連鎖と、コピーによって引数が同じになったφ関数をすべて削除すること。
+def test_copy_propagation_transitive():
+    source = ('int app_main(int a, int n) { int b; int c; int i; '
+              'b = a; c = b; i = 0; while (i < n) { c = b; i = i + 1; } '
+              'return c; }\n')
+    program = run_source(source)
+    insts = instructions(program.func_list[0])
+    assert not [i for i in insts if i.op == Op.COPY]
+    assert len([i for i in insts if i.op == Op.PHI]) == 1
+    ret = [i for i in insts if i.op == Op.RETURN][0]
+    assert ret.args[0].val == program.func_list[0].params[0][1].val
+    assert engine.run(program, 'app_main', 9, 3) == 9
@@ -0,0 +1,54 @@
+# バッチ処理のテスト
+import json
+import os
+import subprocess
+import sys
+from batch import run_batch
+from session import CompileOptions
+
+# すべてのファイルが読み込みに失敗した場合も、キャッシュの追い出しを行い、
+# 失敗したファイルとして報告すること。
+def test_all_files_fail_with_cache(tmp_path):
+    missing = [str(tmp_path / 'missing.mc'), str(tmp_path / 'gone.mc')]
+    options = CompileOptions(ir_cache=str(tmp_path / 'cache'))
+    summary = run_batch(missing, jobs=1, options=options)
+    assert summary['files'] == 2
+    assert summary['failed'] == 2
+    assert summary['cache'] == {'hits': 0, 'misses': 0, 'evicted': 0}
+
+def test_cache_stats(tmp_path):
+    path = tmp_path / 'a.mc'
+    path.write_text('int app_main(int x) { return x + 1; }\n')
+    options = CompileOptions(ir_cache=str(tmp_path / 'cache'))
+    summary = run_batch([str(path), str(tmp_path / 'missing.mc')], jobs=1,
+                        options=options)
+    assert summary['succeeded'] == 1
+    assert summary['failed'] == 1
+    assert summary['cache']['misses'] == 1
+    assert 'evicted' in summary['cache']
+
+# 成功するファイルと失敗するファイルが混在するバッチで、--json -の標準出力が
+# JSONとして読め、エラーと警告がファイルごとの結果に入ること。
+def test_json_stdout_mixed_batch(tmp_path):
+    sources = {
+        'good.mc': 'int app_main(int x) { return x + 1; }\n',
+        'noentry.mc': 'int f(int x) { return x; }\n',
+        'mismatch.mc': 'int app_main(int a) { return )a < 1( + 1; }\n',
+        'illegal.mc': 'int app_main(int a) { return a $ 1; }\n',
+    }
+    for name, source in sources.items():
+        (tmp_path / name).write_text(source)
+    microc = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'microc.py')
+    proc = subprocess.run([sys.executable, microc, '--json', '-', '-j', '2',
+                           str(tmp_path)], capture_output=True, text=True)
+    assert proc.returncode == 1
+    summary = json.loads(proc.stdout)
+    results = {os.path.basename(r['source']): r for r in summary['results']}
+    assert results['good.mc']['ok']
+    assert results['noentry.mc']['errors'] == ['function app_main not found']
+    assert 'traceback' not in results['noentry.mc']
+    assert results['mismatch.mc']['warnings'] == [
+        'type mismatch in function app_main: .temp0(boolean), 1(int)']
+    assert results['illegal.mc']['errors'][0] == 'Illegal character $'
+    assert summary['failed'] == 2
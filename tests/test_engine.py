@@ -0,0 +1,38 @@
+# 実行エンジンのテスト
+import glob
+import os
+import shutil
+import subprocess
+import pytest
+import engine
+from session import compile_to_files
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+samples = sorted(glob.glob(os.path.join(root, 'sample', '*.mc')))
+
+# app_mainの引数に与える値
+arguments = [0, 1, 2, 10, 20]
+
+# サンプルプログラムを実行エンジンで実行した結果が、LLVM IRをllcとgccで
+# ランタイムコードとリンクして実行した結果と一致すること。
+@pytest.mark.skipif(shutil.which('llc') is None or shutil.which('gcc') is None,
+                    reason='llc and gcc are required')
+@pytest.mark.parametrize('sample', samples, ids=os.path.basename)
+def test_engine_matches_llvm(sample, tmp_path):
+    path = str(tmp_path / os.path.basename(sample))
+    shutil.copy(sample, path)
+    with open(path) as f:
+        result, (llname, cname) = compile_to_files(f.read(), path)
+    assert result.ok
+    objname = os.path.splitext(llname)[0] + '.o'
+    exename = os.path.splitext(llname)[0]
+    subprocess.run(['llc', '-filetype=obj', '-relocation-model=pic',
+                    llname, '-o', objname], check=True)
+    subprocess.run(['gcc', objname, cname, '-o', exename], check=True)
+    app_main = [f for f in result.program.func_list if f.name == 'app_main']
+    nparams = len(app_main[0].params)
+    for a in arguments:
+        args = [a] * nparams
+        proc = subprocess.run([exename] + [str(v) for v in args],
+                              capture_output=True, text=True, check=True)
+        assert int(proc.stdout) == engine.run(result.program, 'app_main', *args)
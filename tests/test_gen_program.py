@@ -0,0 +1,17 @@
+# テストプログラム生成器のテスト
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'bench'))
+
+from gen_program import GeneratorConfig, generate
+from session import compile_source, CompileOptions
+
+# 関数呼び出しの割合が0から1のどの値でも生成が終わり、コンパイルできること。
+def test_generate_terminates_for_any_calls():
+    for calls in [0, 0.5, 0.7, 1.0]:
+        source = generate(GeneratorConfig(functions=3, statements=5,
+                                          calls=calls), 0)
+        result = compile_source(source, CompileOptions())
+        assert result.ok, (calls, result.errors)
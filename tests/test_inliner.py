@@ -0,0 +1,89 @@
+# インライン展開のテスト
+import engine
+import inliner
+from util import Op
+from session import compile_source, CompileOptions
+from inliner import function_size, max_growth, default_threshold
+
+# f0からfn-1までを順に呼び出す、引数をそのまま渡すだけの関数の連なりを返す。
+def call_chain(n):
+    lines = ['int f0(int x) { return x + 1; }']
+    for k in range(1, n):
+        lines.append('int f{}(int x) {{ return f{}(x); }}'.format(k, k - 1))
+    lines.append('int app_main(int x) {{ return f{}(x); }}'.format(n - 1))
+    return '\n'.join(lines) + '\n'
+
+# 展開した呼び出し先の基本ブロックが呼び出し元に積み重ならず、
+# 出力の大きさが関数の数に比例すること。
+def test_deep_call_chain():
+    sizes = []
+    for n in (100, 200):
+        result = compile_source(call_chain(n))
+        assert result.ok
+        last = result.program.func_list[-1]
+        assert len(last.bbtable) <= 2
+        assert function_size(last) <= default_threshold
+        assert engine.run(result.program, 'app_main', 41) == 42
+        sizes.append(len(result.llvm_ir))
+    assert sizes[1] <= 2 * sizes[0] + 10
+
+# 関数中の呼び出し命令の数を返す。
+def call_count(func, name):
+    return sum(1 for bb in func.bbtable.values() for i in bb.insts
+               if i.op == Op.CALL and i.args[0].val == name)
+
+# 大きさが上限ちょうどの関数は展開し、上限を1でも超える関数は展開しないこと。
+def test_threshold_boundary():
+    source = ('int g(int x) { if (x > 0) { x = x - 1; } else { x = x + 1; } '
+              'return x; }\n'
+              'int app_main(int x) { return g(x) * 2; }\n')
+    base = compile_source(source, CompileOptions(inline_threshold=0))
+    size = function_size(base.program.func_list[0])
+    over = compile_source(source, CompileOptions(inline_threshold=size - 1))
+    assert call_count(over.program.func_list[1], 'g') == 1
+    at = compile_source(source, CompileOptions(inline_threshold=size))
+    assert call_count(at.program.func_list[1], 'g') == 0
+    assert engine.run(at.program, 'app_main', 5) == 8
+
+# f0をm回呼び出すf1、f1をm回呼び出すf2、...とn個の関数が連なるプログラムを返す。
+def growth_chain(n, m):
+    body = ' + '.join('x * {}'.format(k) for k in range(2, 12))
+    lines = ['int f0(int x) {{ if (x > 0) {{ x = {}; }} return x; }}'.format(body)]
+    for k in range(1, n):
+        calls = ' + '.join('f{}(x + {})'.format(k - 1, j) for j in range(m))
+        lines.append('int f{}(int x) {{ return {}; }}'.format(k, calls))
+    lines.append('int app_main(int x) {{ return f{}(x); }}'.format(n - 1))
+    return '\n'.join(lines) + '\n'
+
+# 連なりの各関数に展開する大きさの合計が上限で止まり、f0の呼び出しの
+# 一部がf1に残ること。上限をなくすとすべて展開する。
+def test_growth_budget_on_chain(monkeypatch):
+    source = growth_chain(4, 12)
+    base = compile_source(source, CompileOptions(inline_threshold=0))
+    sizes = {f.name: function_size(f) for f in base.program.func_list}
+    expected = engine.run(base.program, 'app_main', 3)
+    result = compile_source(source)
+    for f in result.program.func_list:
+        assert function_size(f) - sizes[f.name] <= default_threshold * max_growth
+    f1 = result.program.func_list[1]
+    assert 0 < call_count(f1, 'f0') < 12
+    assert engine.run(result.program, 'app_main', 3) == expected
+    monkeypatch.setattr(inliner, 'max_growth', 1000)
+    unbounded = compile_source(source)
+    assert call_count(unbounded.program.func_list[1], 'f0') == 0
+
+# 1個の呼び出し元に展開する大きさの合計が上限を超えないこと。
+def test_growth_cap():
+    body = ' + '.join('x * {}'.format(k) for k in range(1, 10))
+    calls = ' + '.join('h(x + {})'.format(k) for k in range(40))
+    source = ('int h(int x) {{ return {}; }}\n'
+              'int app_main(int x) {{ return {}; }}\n').format(body, calls)
+    result = compile_source(source)
+    h, main = result.program.func_list
+    calls = sum(1 for bb in main.bbtable.values() for i in bb.insts
+                if i.op == Op.CALL)
+    assert 0 < calls < 40
+    assert (40 - calls) * function_size(h) <= default_threshold * max_growth
+    expected = sum(sum((x + k) * j for j in range(1, 10)) for x in [2]
+                   for k in range(40))
+    assert engine.run(result.program, 'app_main', 2) == expected
@@ -0,0 +1,36 @@
+# LLVM IRのキャッシュのテスト
+from session import compile_source, CompileOptions
+
+def chain(n, first='x + 1'):
+    lines = ['int f0(int x) {{ return {}; }}'.format(first)]
+    for k in range(1, n):
+        lines.append('int f{}(int x) {{ return f{}(x) + {}; }}'.format(k, k - 1, k))
+    lines.append('int g(int x) { return x; }')
+    lines.append('int app_main(int x) {{ return f{}(x); }}'.format(n - 1))
+    return '\n'.join(lines) + '\n'
+
+def cache_stats(source, cache_dir, **kwargs):
+    result = compile_source(source, CompileOptions(ir_cache=str(cache_dir), **kwargs))
+    assert result.ok
+    return result.cache_stats
+
+# インライン展開を行う場合は、間接に呼び出す関数を変更すると呼び出し元の
+# キーも変わり、呼び出し関係のない関数のキーは変わらないこと。
+def test_callee_change_invalidates_callers(tmp_path):
+    source = chain(20)
+    assert cache_stats(source, tmp_path) == {'hits': 0, 'misses': 22}
+    assert cache_stats(source, tmp_path) == {'hits': 22, 'misses': 0}
+    assert cache_stats(chain(20, 'x + 2'), tmp_path) == {'hits': 1, 'misses': 21}
+    # インライン展開を行わない場合は、変更した関数だけが変わる。
+    assert cache_stats(source, tmp_path, inline_threshold=0)['misses'] == 22
+    assert cache_stats(chain(20, 'x + 2'), tmp_path,
+                       inline_threshold=0) == {'hits': 21, 'misses': 1}
+
+# 再帰呼び出しの関係にある関数は、どれを変更しても互いのキーが変わること。
+def test_recursive_callees(tmp_path):
+    source = ('int even(int n) {{ if (n == 0) {{ return 1; }} return odd(n - 1); }}\n'
+              'int odd(int n) {{ if (n == 0) {{ return {}; }} return even(n - 1); }}\n'
+              'int app_main(int n) {{ return even(n); }}\n')
+    assert cache_stats(source.format(0), tmp_path)['misses'] == 3
+    assert cache_stats(source.format(0), tmp_path)['hits'] == 3
+    assert cache_stats(source.format(2), tmp_path) == {'hits': 0, 'misses': 3}
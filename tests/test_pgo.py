@@ -0,0 +1,52 @@
+# プロファイルに基づく最適化のテスト
+import os
+import re
+import shutil
+import subprocess
+import pytest
+from pgo import load_profile, profile_env
+from session import compile_to_files, CompileOptions
+
+source = ('int app_main(int n) { int i; int s; i = 0; s = 0; '
+          'while (i < n) { if (i < 3) { s = s + 1; } else { s = s + 2; } '
+          'i = i + 1; } return s; }\n')
+
+# 計測用にコンパイルしたプログラムをllcとgccで作成し、引数を変えて実行する。
+def run_instrumented(tmp_path, args):
+    path = str(tmp_path / 'loop.mc')
+    result, (llname, cname) = compile_to_files(
+        source, path, CompileOptions(instrument=True))
+    assert result.ok
+    objname = str(tmp_path / 'loop.o')
+    exename = str(tmp_path / 'loop')
+    subprocess.run(['llc', '-filetype=obj', '-relocation-model=pic',
+                    llname, '-o', objname], check=True)
+    subprocess.run(['gcc', objname, cname, '-o', exename], check=True)
+    profile = str(tmp_path / 'loop.prof')
+    env = dict(os.environ)
+    env[profile_env] = profile
+    for a in args:
+        subprocess.run([exename, str(a)], env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+    return profile
+
+# 計測した実行回数が、プロファイルを使ったコンパイルのbr命令の分岐の重みと
+# 関数の呼び出し回数になること。
+@pytest.mark.skipif(shutil.which('llc') is None or shutil.which('gcc') is None,
+                    reason='llc and gcc are required')
+def test_branch_weights_match_profile(tmp_path):
+    profile = run_instrumented(tmp_path, [10, 10])
+    counts = load_profile(profile).function_counts('app_main')
+    assert counts['__entry'] == 2
+    result, (llname, _) = compile_to_files(
+        source, str(tmp_path / 'loop.mc'), CompileOptions(profile=profile))
+    assert result.ok and not result.warnings
+    with open(llname) as f:
+        ir = f.read()
+    assert '!prof !{!"function_entry_count", i64 2}' in ir
+    weights = re.findall(r'label %(\w+), label %(\w+), '
+                         r'!prof !\{!"branch_weights", i32 (\d+), i32 (\d+)\}', ir)
+    assert sorted((int(t), int(e)) for _, _, t, e in weights) == [(6, 14),
+                                                                  (20, 2)]
+    for then_label, else_label, t, e in weights:
+        assert (counts[then_label], counts[else_label]) == (int(t), int(e))
@@ -0,0 +1,27 @@
+# コンパイルセッションのテスト
+import os
+from session import compile_source, compile_to_files
+
+# app_mainのないソースコードはエラーとし、出力ファイルを残さないこと。
+def test_missing_app_main(tmp_path):
+    path = tmp_path / 'noentry.mc'
+    source = 'int f(int x) { return x + 1; }\n'
+    path.write_text(source)
+    result, written = compile_to_files(source, str(path))
+    assert not result.ok
+    assert result.errors == ['function app_main not found']
+    assert written == []
+    assert sorted(os.listdir(tmp_path)) == ['noentry.mc']
+
+    result = compile_source(source)
+    assert not result.ok
+    assert result.runtime_c is None
+
+def test_compile_to_files(tmp_path):
+    path = tmp_path / 'ok.mc'
+    source = 'int app_main(int x) { return x + 1; }\n'
+    path.write_text(source)
+    result, written = compile_to_files(source, str(path))
+    assert result.ok
+    assert [os.path.basename(name) for name in written] == ['ok.ll', 'main-ok.c']
+    assert all(os.path.getsize(name) > 0 for name in written)
@@ -0,0 +1,33 @@
+# 関数を1個ずつ処理するコンパイル(--stream)のテスト
+import io
+import os
+import random
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(root, 'bench'))
+
+from gen_program import GeneratorConfig, generate
+from session import compile_source, CompileOptions
+
+# 関数を1個ずつ処理して書き出したLLVM IRが、プログラム全体を変換した
+# LLVM IRと一致すること。
+def test_stream_matches_whole_module():
+    sources = []
+    with open(os.path.join(root, 'sample', 'fib.mc')) as f:
+        sources.append(f.read())
+    for seed in range(10):
+        r = random.Random(seed)
+        config = GeneratorConfig(functions=r.randint(1, 5),
+                                 statements=r.randint(1, 20),
+                                 calls=r.random() * 0.25)
+        sources.append(generate(config, seed))
+    for source in sources:
+        for threshold in (0, 10, 30):
+            whole = compile_source(source, CompileOptions(
+                inline_threshold=threshold))
+            out = io.StringIO()
+            stream = compile_source(source, CompileOptions(
+                inline_threshold=threshold, streaming=True), out)
+            assert whole.ok and stream.ok
+            assert out.getvalue() == '\n'.join(whole.llvm_ir) + '\n'
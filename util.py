@@ -1,61 +1,66 @@
+from classes import (Op, Inst, Term, op_names, op_codes,
+                     TERM_ID, TERM_NUM, TERM_LABEL, TERM_TYPE,
+                     make_id, make_num, make_label, make_type, make_inst)
+
 # 命令に関するユーティリティ関数
 
 def left(inst):
-    return inst[0]
+    return inst.left
 
 def right(inst, n=0):
     if n == 0:
-        return inst[2:]
-    elif n < len(inst):
-        return inst[1+n]
+        return inst.args
+    elif n <= len(inst.args):
+        return inst.args[n-1]
     else:
-        return []
+        return None
 
 def op(inst):
-    return inst[1]
+    return inst.op
+
+# 命令の演算子名を返す。
+def op_name(inst):
+    return op_names[inst.op]
 
 # コピー文かどうか
 def is_copy(inst):
-    return is_id(left(inst)) and op(inst) == '='
+    return inst.op == Op.COPY and is_id(inst.left)
 
 # 項に関するユーティリティ関数
 
 def is_id(term):
-    return term is not None and term[0] == 'id'
+    return term is not None and term.kind == TERM_ID
 
 def is_num(term):
-    return term is not None and term[0] == 'num'
+    return term is not None and term.kind == TERM_NUM
 
 def is_label(term):
-    return term is not None and term[0] == 'label'
+    return term is not None and term.kind == TERM_LABEL
 
 def is_type(term):
-    return term is not None and term[0] == 'type'
+    return term is not None and term.kind == TERM_TYPE
 
 def is_term(term):
-    return is_id(term) or is_num(term) or is_label(term) or is_type(term)
+    return term is not None and term.__class__ is Term
 
 # 項の値を返す。
 def tval(term):
-    return term[1]
+    return term.val
 
-def set_tval(term, val):
-    term[1] = val
-    
 def label_name(term):
-    return tval(term)
+    return term.val
 
 def id_name(term):
-    return tval(term)
+    return term.val
 
 def num_value(term):
-    return tval(term)
+    return term.val
 
 def type_name(term):
-    return tval(term)
+    return term.val
 
 def id_type(func, term):
-    return func.symtable.get_sym(id_name(term), 'type')
+    return func.symtable.get_type(id_name(term))
 
 def num_type(func, term):
     # 数値の型は仕様からint固定とする。
@@ -75,7 +80,7 @@ def dump_func(func):
     print('****** {} start *****'.format(func.name))
     for bb in func.bbtable.values():
         for inst in bb.insts:
-            if op(inst) == 'deflabel':
+            if op(inst) == Op.DEFLABEL:
                 print(f'{inst}')
             else:
                 print(f'    {inst}')
@@ -90,7 +95,7 @@ def dump_program(p):
 def dump_rawfunc(func):
     print('****** {} start (raw) *****'.format(func.name))
     for inst in func.insts:
-        if op(inst) == 'deflabel':
+        if op(inst) == Op.DEFLABEL:
             print(f'{inst}')
         else:
             print(f'    {inst}')